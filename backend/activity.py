@@ -0,0 +1,298 @@
+"""
+IMU activity windows: per-device features of imu_x/y/z over sliding windows
+The writer appends every ingest batch to per-device ring buffers (one
+NumPy array for all devices, no per-message work). Once per hop a single
+pass scores every device that has samples in the window just closed:
+
+  magnitude    mean |a| (m/s², gravity included)
+  variance     variance of |a|
+  sma          signal magnitude area: mean of |x - x̄| + |y - ȳ| + |z - z̄|
+  dominant_hz  strongest non-zero frequency of |a| (FFT, zero padded)
+  steps        upward crossings of |a| over its mean + ACTIVITY_STEP_THRESHOLD
+  activity     resting (sma < ACTIVITY_REST_SMA), walking (sma >=
+               ACTIVITY_WALK_SMA) or grazing (between)
+
+Windows are ACTIVITY_WINDOW seconds ending on multiples of ACTIVITY_HOP
+(epoch time) and stay open ACTIVITY_LAG seconds for late readings; rows go
+to the activity table (one per device per window). Buffers start from the
+hot cache after a restart.
+"""
+
+import logging
+import math
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from sensor_schema import SCALE_DIVISORS, SENSOR_FIELDS
+from storage import from_epoch_ms, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+ACTIVITIES = ("resting", "grazing", "walking")
+
+IMU_FIELDS = ("imu_x", "imu_y", "imu_z")
+
+# Column of each IMU axis in writer rows (device_id, timestamp, *SENSOR_FIELDS)
+IMU_COLUMNS = tuple(2 + SENSOR_FIELDS.index(field) for field in IMU_FIELDS)
+
+ACTIVITY_COLUMNS = (
+    "device_id", "window_end", "samples", "magnitude", "variance", "sma", "dominant_hz", "steps", "activity"
+)
+
+
+async def create_tables(db):
+    """Activity windows table (called from Database.create_tables)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS activity (
+            device_id TEXT NOT NULL,
+            window_end INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            magnitude REAL,
+            variance REAL,
+            sma REAL,
+            dominant_hz REAL,
+            steps INTEGER,
+            activity INTEGER,
+            PRIMARY KEY (device_id, window_end)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_activity_window_end ON activity(window_end)")
+
+
+async def store(db, windows: List[tuple]):
+    """Insert window rows shaped as ACTIVITY_COLUMNS (caller commits)"""
+    await db.executemany(
+        f"INSERT OR REPLACE INTO activity ({', '.join(ACTIVITY_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(ACTIVITY_COLUMNS))})",
+        windows
+    )
+
+
+async def purge(db, before: str):
+    """Drop windows that ended before an ISO timestamp (caller commits)"""
+    await db.execute("DELETE FROM activity WHERE window_end < ?", (to_epoch_ms(before) // 1000,))
+
+
+def describe_row(row) -> dict:
+    """Stored row -> API dict (ISO window bounds, activity name)"""
+    window = dict(row)
+    window["window_end"] = from_epoch_ms(row["window_end"] * 1000)
+    window["activity"] = ACTIVITIES[row["activity"]]
+    return window
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ActivityTracker:
+    """Per-device IMU ring buffers (rows by slot) and the per-hop feature pass (writer only)"""
+    
+    def __init__(self, window: float, hop: float, buffer: int, lag: float, min_samples: int,
+                 rest_sma: float, walk_sma: float, step_threshold: float):
+        self.window = window
+        self.hop = hop
+        self.buffer = buffer
+        self.lag = lag
+        self.min_samples = max(2, min_samples)
+        self.rest_sma = rest_sma
+        self.walk_sma = walk_sma
+        self.step_threshold = step_threshold
+        self.divisors = np.array([SCALE_DIVISORS[field] for field in IMU_FIELDS])
+        
+        # Per-device rings, rows indexed by slot (grown on demand); times are epoch seconds, 0 = empty
+        self.slots: Dict[str, int] = {}
+        self.devices: List[str] = []
+        self.capacity = 0
+        self.samples = np.zeros((3, 0, buffer), dtype=np.float32)  # axis x slot x position
+        self.times = np.zeros((0, buffer))
+        self.written = np.zeros(0, dtype=np.int64)  # samples ever appended; next position = written % buffer
+        
+        # End of the next window to close
+        self.next_end = math.ceil(time.time() / hop) * hop
+        
+        # Statistics
+        self.stats = {
+            "samples": 0,
+            "no_imu": 0,
+            "ticks": 0,
+            "windows": 0,
+            "sparse": 0,
+            "chunks": 0,
+            "append_ms": 0.0,
+            "max_chunk_ms": 0.0,
+            "total_tick_ms": 0.0
+        }
+    
+    def _slot(self, device_id: str) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = len(self.devices)
+            self.slots[device_id] = slot
+            self.devices.append(device_id)
+        return slot
+    
+    def _grow(self, size: int):
+        """Make room for slot indices below size (doubling)"""
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity, 64)
+        extra = capacity - self.capacity
+        self.samples = np.concatenate([self.samples, np.zeros((3, extra, self.buffer), dtype=np.float32)], axis=1)
+        self.times = np.concatenate([self.times, np.zeros((extra, self.buffer))])
+        self.written = np.concatenate([self.written, np.zeros(extra, dtype=np.int64)])
+        self.capacity = capacity
+    
+    @staticmethod
+    def _seconds(rows: List[tuple]) -> np.ndarray:
+        """Naive local ISO timestamps -> epoch seconds (one datetime conversion per batch)"""
+        try:
+            naive = np.array([row[1] for row in rows], dtype="datetime64[ms]").astype(np.int64)
+        except ValueError:
+            return np.array([to_epoch_ms(row[1]) for row in rows], dtype=np.int64) / 1000
+        offset = to_epoch_ms(rows[0][1]) - naive[0]
+        return (naive + offset) / 1000
+    
+    def append(self, rows: List[tuple]):
+        """Add a batch of rows (device_id, timestamp, *SENSOR_FIELDS) to the device rings"""
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            values = np.array([[row[column] for column in IMU_COLUMNS] for row in rows], dtype=float)
+        except (TypeError, ValueError):
+            values = np.array([[_number(row[column]) for column in IMU_COLUMNS] for row in rows])
+        valid = np.flatnonzero(~np.isnan(values).any(axis=1))
+        self.stats["no_imu"] += len(rows) - len(valid)
+        if not len(valid):
+            return
+        
+        rows = [rows[index] for index in valid.tolist()]
+        values = values[valid] / self.divisors
+        slots = np.fromiter((self._slot(row[0]) for row in rows), dtype=np.intp, count=len(rows))
+        self._grow(len(self.devices))
+        seconds = self._seconds(rows)
+        
+        # Position of each row in its device's ring: arrival order within the batch
+        order = np.argsort(slots, kind="stable")
+        slots, values, seconds = slots[order], values[order], seconds[order]
+        devices, starts, counts = np.unique(slots, return_index=True, return_counts=True)
+        rank = np.arange(len(slots)) - np.repeat(starts, counts)
+        
+        # More rows than the ring holds: only the newest fit
+        keep = rank >= np.repeat(counts, counts) - self.buffer
+        positions = (self.written[slots] + rank) % self.buffer
+        self.samples[:, slots[keep], positions[keep]] = values[keep].T
+        self.times[slots[keep], positions[keep]] = seconds[keep]
+        self.written[devices] += counts
+        
+        self.stats["samples"] += len(rows)
+        self.stats["append_ms"] += (time.perf_counter() - started) * 1000
+    
+    def seconds_to_next(self, now: float) -> float:
+        """Time until the next window can be closed"""
+        return max(0.0, self.next_end + self.lag - now)
+    
+    def due(self, now: float) -> List[float]:
+        """Ends of the windows whose end (plus lag) has passed, oldest first"""
+        ends = []
+        while self.next_end + self.lag <= now:
+            ends.append(self.next_end)
+            self.next_end += self.hop
+        
+        # After a long stall, windows older than the rings hold are skipped
+        ends = ends[-max(1, math.ceil(self.window / self.hop)):]
+        self.stats["ticks"] += len(ends)
+        return ends
+    
+    def features(self, end: float, start: int = 0, stop: Optional[int] = None) -> List[tuple]:
+        """
+        Features of window [end - window, end) for the devices in slots
+        [start, stop), all at once; rows shaped as ACTIVITY_COLUMNS
+        """
+        started = time.perf_counter()
+        rows = slice(start, min(len(self.devices), stop if stop is not None else len(self.devices)))
+        inside = (self.times[rows] >= end - self.window) & (self.times[rows] < end)
+        counts = inside.sum(axis=1)
+        active = np.flatnonzero(counts >= self.min_samples)
+        self.stats["sparse"] += int(np.count_nonzero((counts > 0) & (counts < self.min_samples)))
+        if not len(active):
+            return []
+        
+        # Computed on the rings as stored: samples outside the window are masked to zero.
+        # A ring is a circular shift of arrival order, which leaves FFT magnitudes unchanged
+        # and keeps neighbours adjacent (position 0 follows the last one).
+        k = counts[active]
+        everyone = len(active) == len(inside)
+        slots = active + start
+        mask = inside if everyone else inside[active]
+        weight = mask.astype(np.float32)
+        x, y, z = self.samples[:, rows] if everyone else self.samples[:, slots]
+        
+        # float32 throughout; einsum fuses the mask multiply with the row sum
+        magnitude = np.sqrt(x * x + y * y + z * z)
+        mean = np.einsum("ij,ij->i", magnitude, weight) / k
+        deviation = magnitude - mean[:, None]
+        deviation *= weight
+        variance = np.einsum("ij,ij->i", deviation, deviation) / k
+        
+        sma = np.zeros(len(active))
+        for axis in (x, y, z):
+            spread = axis - (np.einsum("ij,ij->i", axis, weight) / k)[:, None]
+            np.abs(spread, out=spread)
+            sma += np.einsum("ij,ij->i", spread, weight) / k
+        
+        # Bin spacing is rate / buffer for the zero-padded series
+        spectrum = np.abs(np.fft.rfft(deviation, axis=1))
+        spectrum[:, 0] = 0
+        peak = spectrum.argmax(axis=1)
+        times = self.times[rows] if everyone else self.times[slots]
+        newest = (times * weight).max(axis=1)  # masked to 0 outside the window
+        oldest = end - ((end - times) * weight).max(axis=1)
+        span = newest - oldest
+        rate = np.where(span > 0, (k - 1) / np.where(span > 0, span, 1), 0)
+        dominant_hz = np.where(spectrum.max(axis=1) > 0, peak * rate / self.buffer, 0)
+        
+        above = deviation > self.step_threshold  # zero (never above) outside the window
+        steps = np.count_nonzero(above & ~np.roll(above, 1, axis=1), axis=1)
+        
+        activity = np.where(sma < self.rest_sma, 0, np.where(sma >= self.walk_sma, 2, 1))
+        
+        window_end = int(end)
+        devices = self.devices
+        found = [
+            (devices[slot], window_end, samples, *features, step, code)
+            for slot, samples, *features, step, code in zip(
+                slots.tolist(), k.tolist(),
+                np.round(mean, 4).tolist(), np.round(variance, 4).tolist(), np.round(sma, 4).tolist(),
+                np.round(dominant_hz, 4).tolist(), steps.tolist(), activity.tolist()
+            )
+        ]
+        
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats["windows"] += len(found)
+        self.stats["chunks"] += 1
+        self.stats["max_chunk_ms"] = round(max(self.stats["max_chunk_ms"], elapsed), 3)
+        self.stats["total_tick_ms"] += elapsed
+        return found
+    
+    def describe(self) -> dict:
+        """Ring sizes and counters for /api/status"""
+        ticks = self.stats["ticks"]
+        return {
+            "devices": len(self.devices),
+            "window": self.window,
+            "hop": self.hop,
+            "buffer": self.buffer,
+            "next_window_end": from_epoch_ms(self.next_end * 1000),
+            "memory_bytes": int(self.samples.nbytes + self.times.nbytes + self.written.nbytes),
+            **self.stats,
+            "append_ms": round(self.stats["append_ms"], 3),
+            "total_tick_ms": round(self.stats["total_tick_ms"], 3),
+            "avg_tick_ms": round(self.stats["total_tick_ms"] / ticks, 3) if ticks else 0.0
+        }
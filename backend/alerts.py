@@ -0,0 +1,310 @@
+"""
+Server-side threshold and anomaly detection on ingest batches
+Runs in the writer on every batch, over a columnar NumPy view of the rows
+(rows x SENSOR_FIELDS, scaled as in sensor-config.js):
+
+  low / high   static thresholds from SENSOR_CONFIG (as checkThreshold)
+  zscore       distance from the device's exponentially weighted mean, in
+               standard deviations (temperatures and heart rate)
+  drop_rate    battery voltage falling faster than a limit, in mV/minute
+
+The same (device, field, kind) alerts at most once per cooldown. Alerts are
+stored in the alerts table and sent to dashboards as {"type": "alert"}.
+"""
+
+import logging
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from sensor_schema import SENSOR_CONFIG, SENSOR_FIELDS, SCALE_DIVISORS
+from storage import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+# Fields tracked with rolling statistics -> minimum standard deviation
+# (scaled units), so a very steady signal does not alert on tiny changes
+Z_SCORE_FIELDS = {"suhu_kaki": 0.2, "suhu_leher": 0.2, "heart_rate": 2.0}
+
+# Battery fields checked for rate of change
+RATE_FIELDS = ("vbatt_kaki", "vbatt_leher")
+
+KINDS = ("low", "high", "zscore", "drop_rate")
+
+ALERT_COLUMNS = ("device_id", "timestamp", "field", "kind", "value", "threshold", "score")
+
+
+async def create_tables(db):
+    """Alerts table (called from Database.create_tables)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            field TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value REAL,
+            threshold REAL,
+            score REAL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_alerts_device ON alerts(device_id, timestamp)")
+
+
+async def store(db, alerts: List[dict]):
+    """Insert alerts (caller commits)"""
+    await db.executemany(
+        f"INSERT INTO alerts ({', '.join(ALERT_COLUMNS)}) VALUES ({', '.join('?' * len(ALERT_COLUMNS))})",
+        [tuple(alert[column] for column in ALERT_COLUMNS) for alert in alerts]
+    )
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class AlertDetector:
+    """Vectorized per-batch checks with per-device rolling state"""
+    
+    def __init__(self, z_threshold: float, alpha: float, min_samples: int,
+                 max_drop_per_min: float, rate_window: float, cooldown: float):
+        self.z_threshold = z_threshold
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_drop_per_min = max_drop_per_min
+        self.rate_window = rate_window
+        self.cooldown = cooldown
+        
+        columns = {field: index for index, field in enumerate(SENSOR_FIELDS)}
+        self.divisors = np.array([SCALE_DIVISORS[field] for field in SENSOR_FIELDS])
+        bounded = [sensor for sensor in SENSOR_CONFIG if sensor.get("thresholds")]
+        self.threshold_cols = np.array([columns[sensor["field"]] for sensor in bounded], dtype=np.intp)
+        self.low = np.array([sensor["thresholds"]["low"] for sensor in bounded], dtype=float)
+        self.high = np.array([sensor["thresholds"]["high"] for sensor in bounded], dtype=float)
+        self.z_cols = np.array([columns[field] for field in Z_SCORE_FIELDS], dtype=np.intp)
+        self.z_min_std = np.array(list(Z_SCORE_FIELDS.values()), dtype=float)
+        self.rate_cols = np.array([columns[field] for field in RATE_FIELDS], dtype=np.intp)
+        
+        # Check columns: (field, kind), laid out as [low..., high..., zscore..., drop_rate...]
+        self.checks = (
+            [(sensor["field"], "low") for sensor in bounded]
+            + [(sensor["field"], "high") for sensor in bounded]
+            + [(field, "zscore") for field in Z_SCORE_FIELDS]
+            + [(field, "drop_rate") for field in RATE_FIELDS]
+        )
+        self.check_limits = np.concatenate([
+            self.low,
+            self.high,
+            np.full(len(self.z_cols), z_threshold),
+            np.full(len(self.rate_cols), -max_drop_per_min)
+        ])
+        self.z_offset = 2 * len(bounded)
+        self.rate_offset = self.z_offset + len(self.z_cols)
+        
+        # Per-device state, rows indexed by slot (grown on demand)
+        self.slots: Dict[str, int] = {}
+        self.devices: List[str] = []
+        self.capacity = 0
+        self.count = np.zeros((0, len(self.z_cols)))
+        self.mean = np.zeros((0, len(self.z_cols)))
+        self.var = np.zeros((0, len(self.z_cols)))
+        self.rate_value = np.zeros((0, len(self.rate_cols)))
+        self.rate_time = np.zeros((0, len(self.rate_cols)))
+        self.last_alert = np.zeros((0, len(self.checks)))
+        
+        # Statistics
+        self.stats = {
+            "batches": 0,
+            "rows": 0,
+            "alerts": 0,
+            "suppressed": 0,
+            "last_batch_ms": 0.0,
+            "total_ms": 0.0
+        }
+    
+    def _slot(self, device_id: str) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = len(self.devices)
+            self.slots[device_id] = slot
+            self.devices.append(device_id)
+        return slot
+    
+    def _grow(self, size: int):
+        """Make room for slot indices below size (doubling)"""
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity, 64)
+        extra = capacity - self.capacity
+        self.count = np.vstack([self.count, np.zeros((extra, self.count.shape[1]))])
+        self.mean = np.vstack([self.mean, np.zeros((extra, self.mean.shape[1]))])
+        self.var = np.vstack([self.var, np.zeros((extra, self.var.shape[1]))])
+        self.rate_value = np.vstack([self.rate_value, np.full((extra, self.rate_value.shape[1]), np.nan)])
+        self.rate_time = np.vstack([self.rate_time, np.full((extra, self.rate_time.shape[1]), np.nan)])
+        self.last_alert = np.vstack([self.last_alert, np.full((extra, self.last_alert.shape[1]), -np.inf)])
+        self.capacity = capacity
+    
+    @staticmethod
+    def _columns(rows: List[tuple]) -> np.ndarray:
+        """Sensor values as a float matrix, NaN where missing or not a number"""
+        values = np.array([row[2:] for row in rows], dtype=object)
+        values[np.equal(values, None)] = np.nan
+        try:
+            return values.astype(float)
+        except (TypeError, ValueError):
+            # Off-schema values (strings etc.) are skipped, like the hot cache does
+            return np.vectorize(_number, otypes=[float])(values)
+    
+    @staticmethod
+    def _seconds(rows: List[tuple]) -> np.ndarray:
+        """Row timestamps as seconds (only differences are used)"""
+        try:
+            return np.array([row[1] for row in rows], dtype="datetime64[ms]").astype(np.int64) / 1000
+        except ValueError:
+            return np.array([to_epoch_ms(row[1]) for row in rows], dtype=np.int64) / 1000
+    
+    def detect(self, rows: List[tuple]) -> List[dict]:
+        """Check a batch of rows (device_id, timestamp, *SENSOR_FIELDS) and return new alerts"""
+        if not rows:
+            return []
+        started = time.perf_counter()
+        
+        slots = np.fromiter((self._slot(row[0]) for row in rows), dtype=np.intp, count=len(rows))
+        self._grow(len(self.devices))
+        values = self._columns(rows) / self.divisors
+        seconds = self._seconds(rows)
+        hits = np.zeros((len(rows), len(self.checks)), dtype=bool)
+        scores = np.full(hits.shape, np.nan)
+        
+        # Static thresholds (NaN compares False)
+        with np.errstate(invalid="ignore"):
+            bounded = values[:, self.threshold_cols]
+            hits[:, :len(self.low)] = bounded < self.low
+            hits[:, len(self.low):self.z_offset] = bounded > self.high
+        
+        self._check_zscore(slots, values, hits, scores)
+        self._check_rate(slots, values, seconds, hits, scores)
+        found = self._emit(rows, slots, values, seconds, hits, scores)
+        
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(rows)
+        self.stats["alerts"] += len(found)
+        self.stats["last_batch_ms"] = round(elapsed, 3)
+        self.stats["total_ms"] += elapsed
+        return found
+    
+    def _check_zscore(self, slots: np.ndarray, values: np.ndarray, hits: np.ndarray, scores: np.ndarray):
+        """Score rows against each device's state before this batch, then fold the batch in"""
+        sample = values[:, self.z_cols]
+        valid = ~np.isnan(sample)
+        std = np.maximum(np.sqrt(self.var[slots]), self.z_min_std)
+        z = (sample - self.mean[slots]) / std
+        ready = valid & (self.count[slots] >= self.min_samples)
+        
+        columns = slice(self.z_offset, self.rate_offset)
+        hits[:, columns] = ready & (np.abs(np.where(ready, z, 0)) >= self.z_threshold)
+        scores[:, columns] = np.where(ready, z, np.nan)
+        
+        # Per-device batch count, mean and variance; EWMA weight for k samples is 1 - (1 - alpha)^k
+        devices, inverse = np.unique(slots, return_inverse=True)
+        filled = np.where(valid, sample, 0.0)
+        k = np.zeros((len(devices), sample.shape[1]))
+        total = np.zeros_like(k)
+        squares = np.zeros_like(k)
+        np.add.at(k, inverse, valid)
+        np.add.at(total, inverse, filled)
+        np.add.at(squares, inverse, filled * filled)
+        
+        seen = k > 0
+        safe_k = np.where(seen, k, 1)
+        batch_mean = total / safe_k
+        batch_var = np.maximum(squares / safe_k - batch_mean * batch_mean, 0)
+        
+        mean = self.mean[devices]
+        var = self.var[devices]
+        count = self.count[devices]
+        weight = np.where(count > 0, 1 - (1 - self.alpha) ** k, 1.0)
+        weight = np.where(seen, weight, 0.0)
+        delta = batch_mean - mean
+        self.mean[devices] = mean + weight * delta
+        self.var[devices] = (1 - weight) * (var + weight * delta * delta) + weight * batch_var
+        self.count[devices] = count + k
+    
+    def _check_rate(self, slots: np.ndarray, values: np.ndarray, seconds: np.ndarray,
+                    hits: np.ndarray, scores: np.ndarray):
+        """Per device, compare its last battery reading in the batch with a reference at least rate_window old"""
+        for column, field_col in enumerate(self.rate_cols):
+            rows = np.flatnonzero(~np.isnan(values[:, field_col]))
+            if not len(rows):
+                continue
+            # Last valid row per device
+            reversed_slots = slots[rows][::-1]
+            devices, first = np.unique(reversed_slots, return_index=True)
+            last_rows = rows[::-1][first]
+            
+            value = values[last_rows, field_col]
+            now = seconds[last_rows]
+            previous = self.rate_value[devices, column]
+            elapsed = now - self.rate_time[devices, column]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                ready = ~np.isnan(previous) & (elapsed >= self.rate_window)
+                rate = np.where(ready, (value - previous) / np.where(ready, elapsed, 1) * 60, np.nan)
+            
+            check = self.rate_offset + column
+            hits[last_rows, check] = ready & (rate <= -self.max_drop_per_min)
+            scores[last_rows, check] = rate
+            
+            # New reference once the window has passed (or on the first reading / clock going back)
+            reset = ready | np.isnan(previous) | (elapsed < 0)
+            self.rate_value[devices[reset], column] = value[reset]
+            self.rate_time[devices[reset], column] = now[reset]
+    
+    def _emit(self, rows: List[tuple], slots: np.ndarray, values: np.ndarray, seconds: np.ndarray,
+              hits: np.ndarray, scores: np.ndarray) -> List[dict]:
+        """Alerts for hits whose (device, check) is outside its cooldown; first hit in the batch wins"""
+        row_index, check_index = np.nonzero(hits)
+        if not len(row_index):
+            return []
+        keys = slots[row_index] * len(self.checks) + check_index
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        row_index, check_index = row_index[first], check_index[first]
+        
+        device_slots = slots[row_index]
+        allowed = seconds[row_index] - self.last_alert[device_slots, check_index] >= self.cooldown
+        self.stats["suppressed"] += int(len(keys) - allowed.sum())
+        row_index, check_index, device_slots = row_index[allowed], check_index[allowed], device_slots[allowed]
+        self.last_alert[device_slots, check_index] = seconds[row_index]
+        
+        field_cols = {field: index for index, field in enumerate(SENSOR_FIELDS)}
+        found = []
+        for row, check in zip(row_index.tolist(), check_index.tolist()):
+            field, kind = self.checks[check]
+            score = scores[row, check]
+            found.append({
+                "device_id": rows[row][0],
+                "timestamp": rows[row][1],
+                "field": field,
+                "kind": kind,
+                "value": float(values[row, field_cols[field]]),
+                "threshold": float(self.check_limits[check]),
+                "score": None if np.isnan(score) else round(float(score), 3)
+            })
+        return found
+    
+    def describe(self) -> dict:
+        """Detection counters for /api/status"""
+        batches = self.stats["batches"]
+        return {
+            "devices": len(self.devices),
+            "checks": len(self.checks),
+            **self.stats,
+            "total_ms": round(self.stats["total_ms"], 3),
+            "avg_batch_ms": round(self.stats["total_ms"] / batches, 3) if batches else 0.0
+        }
@@ -0,0 +1,219 @@
+"""
+Compressed cold archive for expired sensor readings
+One file per device per day: <ARCHIVE_DIR>/<device>/<YYYY-MM-DD>.fta
+
+File layout:
+    b"FTA1" | uint32 header length | JSON header | zlib(body)
+    body = int64 timestamp deltas (epoch microseconds, sorted; milliseconds
+           in version 1 files)
+           + per sensor field: uint8 presence flags, then values typed as
+             in the sensor schema (int16, uint8, ...; 0 where absent)
+The header's timespec records how the layout wrote timestamp text, so rows
+read back with the timestamp they were stored with. Columns of similar
+values compress far better than rows, and a day file can be range-filtered
+with bisect after one decompress.
+"""
+
+import json
+import logging
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+from sensor_schema import SENSOR_CONFIG, SENSOR_FIELDS
+from storage import to_epoch_us, from_epoch_us
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FTA1"
+HEADER_LENGTH = struct.Struct("<I")
+
+# Schema type -> array typecode
+ARRAY_CODES = {
+    "int8": "b",
+    "uint8": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I"
+}
+FIELD_CODES = [ARRAY_CODES[sensor["type"]] for sensor in SENSOR_CONFIG]
+
+
+class ColdArchive:
+    """Per-device, per-day columnar archive files"""
+    
+    def __init__(self, directory: str, timespec: str = "auto"):
+        self.directory = directory
+        # isoformat() timespec of the storage layout's timestamp text
+        self.timespec = timespec
+    
+    def _path(self, device_id: str, day: str) -> str:
+        return os.path.join(self.directory, quote(device_id, safe=""), f"{day}.fta")
+    
+    def days(self, device_id: str) -> List[str]:
+        """Archived days for a device, oldest first"""
+        device_dir = os.path.join(self.directory, quote(device_id, safe=""))
+        if not os.path.isdir(device_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(device_dir) if name.endswith(".fta"))
+    
+    # ------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------
+    
+    def _encode(self, ts: List[int], columns: List[List[Optional[int]]]) -> bytes:
+        deltas = array('q', [ts[0]] + [b - a for a, b in zip(ts, ts[1:])]) if ts else array('q')
+        body = [deltas.tobytes()]
+        for code, values in zip(FIELD_CODES, columns):
+            body.append(bytes(0 if value is None else 1 for value in values))
+            body.append(array(code, (0 if value is None else value for value in values)).tobytes())
+        
+        header = json.dumps({
+            "version": 2,
+            "timespec": self.timespec,
+            "fields": list(SENSOR_FIELDS),
+            "types": FIELD_CODES,
+            "count": len(ts)
+        }).encode()
+        return MAGIC + HEADER_LENGTH.pack(len(header)) + header + zlib.compress(b"".join(body), 6)
+    
+    @staticmethod
+    def _decode(data: bytes):
+        if data[:4] != MAGIC:
+            raise ValueError("Not an archive file")
+        (header_length,) = HEADER_LENGTH.unpack_from(data, 4)
+        header = json.loads(data[8:8 + header_length])
+        body = zlib.decompress(data[8 + header_length:])
+        count = header["count"]
+        
+        deltas = array('q')
+        deltas.frombytes(body[:8 * count])
+        ts = list(accumulate(deltas))
+        if header["version"] == 1:
+            ts = [ms * 1000 for ms in ts]
+        offset = 8 * count
+        
+        columns = {}
+        for field, code in zip(header["fields"], header["types"]):
+            presence = body[offset:offset + count]
+            offset += count
+            values = array(code)
+            size = values.itemsize * count
+            values.frombytes(body[offset:offset + size])
+            offset += size
+            columns[field] = [value if present else None for value, present in zip(values, presence)]
+        
+        return ts, columns, header.get("timespec", "auto")
+    
+    def _read_file(self, path: str):
+        with open(path, "rb") as f:
+            return self._decode(f.read())
+    
+    # ------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------
+    
+    def append(self, readings: List[dict]) -> int:
+        """
+        Archive readings (device_id, timestamp, fields), merging them into
+        existing day files; each touched day file is written once, so callers
+        should pass a device-day's readings together. Rows are kept distinct
+        with their exact timestamps; the merge keeps the larger count of each
+        identical row, so re-archiving after an interrupted purge is harmless.
+        Returns the number of files written.
+        """
+        groups: Dict[tuple, List[tuple]] = {}
+        for reading in readings:
+            key = (reading["device_id"], reading["timestamp"][:10])
+            row = (to_epoch_us(reading["timestamp"]),) + tuple(reading.get(field) for field in SENSOR_FIELDS)
+            groups.setdefault(key, []).append(row)
+        
+        for (device_id, day), new_rows in groups.items():
+            path = self._path(device_id, day)
+            rows = Counter()
+            if os.path.exists(path):
+                ts, columns, _ = self._read_file(path)
+                field_columns = [columns.get(field) or [None] * len(ts) for field in SENSOR_FIELDS]
+                rows.update((us,) + tuple(column[i] for column in field_columns) for i, us in enumerate(ts))
+            rows |= Counter(new_rows)
+            
+            ordered = sorted(rows.elements(), key=lambda row: row[0])
+            columns = [[row[i] for row in ordered] for i in range(1, len(SENSOR_FIELDS) + 1)]
+            
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._encode([row[0] for row in ordered], columns))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        
+        return len(groups)
+    
+    # ------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------
+    
+    def _rows(self, device_id: str, day: str, start_us: Optional[int], end_us: Optional[int]) -> List[dict]:
+        """Rows of one day file within [start_us, end_us), oldest first"""
+        path = self._path(device_id, day)
+        if not os.path.exists(path):
+            return []
+        ts, columns, timespec = self._read_file(path)
+        
+        low = bisect_left(ts, start_us) if start_us is not None else 0
+        high = bisect_left(ts, end_us) if end_us is not None else len(ts)
+        field_columns = [columns.get(field) or [None] * len(ts) for field in SENSOR_FIELDS]
+        
+        result = []
+        for i in range(low, high):
+            row = {"device_id": device_id, "timestamp": from_epoch_us(ts[i], timespec)}
+            for field, column in zip(SENSOR_FIELDS, field_columns):
+                row[field] = column[i]
+            result.append(row)
+        return result
+    
+    def iter_range(self, device_id: str, start: Optional[str] = None, end: Optional[str] = None):
+        """Archived readings with start <= timestamp < end, one list per day, oldest first"""
+        start_us = to_epoch_us(start) if start else None
+        end_us = to_epoch_us(end) if end else None
+        first_day = start[:10] if start else None
+        last_day = end[:10] if end else None
+        
+        for day in self.days(device_id):
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            rows = self._rows(device_id, day, start_us, end_us)
+            if rows:
+                yield rows
+    
+    def read_range(self, device_id: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        """Archived readings with start <= timestamp < end, oldest first"""
+        return [row for rows in self.iter_range(device_id, start, end) for row in rows]
+    
+    def read_latest(self, device_id: str, before: Optional[str], limit: int,
+                    after: Optional[str] = None) -> List[dict]:
+        """Up to limit archived readings with after <= timestamp < before, newest first"""
+        start_us = to_epoch_us(after) if after else None
+        end_us = to_epoch_us(before) if before else None
+        first_day = after[:10] if after else None
+        last_day = before[:10] if before else None
+        
+        result = []
+        for day in reversed(self.days(device_id)):
+            if last_day and day > last_day:
+                continue
+            if first_day and day < first_day:
+                break
+            rows = self._rows(device_id, day, start_us, end_us)
+            result.extend(reversed(rows))
+            if len(result) >= limit:
+                break
+        return result[:limit]
@@ -0,0 +1,148 @@
+"""
+Throughput of IMU ring buffering and the per-hop activity feature pass
+
+Simulates D devices (default 1000, 5000 and 20000) reporting IMU at 1 Hz,
+a third each resting, grazing and walking. Every simulated second the
+readings arrive as WRITE_BATCH_SIZE-row batches through append(); every
+ACTIVITY_HOP seconds the window that just closed is scored for all
+devices with features(), ACTIVITY_CHUNK devices per call as the writer
+does. Reports append cost per row, the tick cost (the longest chunk is
+the longest the event loop is held) and how many devices x 1 Hz one core
+could sustain at that rate.
+
+    python benchmarks/activity.py --devices 1000,5000,20000 --seconds 180
+    python benchmarks/activity.py --json > results.json
+
+Run from the backend directory.
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from activity import ACTIVITIES, ActivityTracker  # noqa: E402
+from config import Config  # noqa: E402
+from sensor_schema import SENSOR_FIELDS  # noqa: E402
+
+IMU_INDEX = [SENSOR_FIELDS.index(field) for field in ("imu_x", "imu_y", "imu_z")]
+
+
+def make_rows(devices: int, second: int, clock: datetime, rng: np.random.Generator) -> list:
+    """One reading per device for one second; device % 3 picks resting/grazing/walking"""
+    kind = np.arange(devices) % 3
+    noise = np.array([0.05, 0.4, 0.5])[kind][:, None] * rng.standard_normal((devices, 3))
+    swing = np.where(kind == 2, 3.0, 0.0)
+    phase = 2 * math.pi * 0.3 * second + np.arange(devices)
+    x = swing * np.sin(phase) + noise[:, 0]
+    y = noise[:, 1]
+    z = 9.81 + swing * np.cos(phase) + noise[:, 2]
+    scaled = np.rint(np.column_stack([x, y, z]) * 100).astype(int).tolist()
+    
+    timestamp = (clock + timedelta(seconds=second)).isoformat()
+    template = [0] * len(SENSOR_FIELDS)
+    rows = []
+    for device, imu in enumerate(scaled):
+        reading = list(template)
+        for index, value in zip(IMU_INDEX, imu):
+            reading[index] = value
+        rows.append((f"DEV{device:05d}", timestamp, *reading))
+    return rows
+
+
+def run(devices: int, args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    tracker = ActivityTracker(
+        window=Config.ACTIVITY_WINDOW,
+        hop=Config.ACTIVITY_HOP,
+        buffer=Config.ACTIVITY_BUFFER,
+        lag=Config.ACTIVITY_LAG,
+        min_samples=Config.ACTIVITY_MIN_SAMPLES,
+        rest_sma=Config.ACTIVITY_REST_SMA,
+        walk_sma=Config.ACTIVITY_WALK_SMA,
+        step_threshold=Config.ACTIVITY_STEP_THRESHOLD
+    )
+    clock = datetime(2026, 1, 1)
+    origin = clock.timestamp()
+    hop = int(Config.ACTIVITY_HOP)
+    
+    append_seconds = 0.0
+    rows_appended = 0
+    ticks = []
+    chunks = []
+    classes = dict.fromkeys(ACTIVITIES, 0)
+    for second in range(args.seconds):
+        rows = make_rows(devices, second, clock, rng)
+        started = time.perf_counter()
+        for start in range(0, len(rows), Config.WRITE_BATCH_SIZE):
+            tracker.append(rows[start:start + Config.WRITE_BATCH_SIZE])
+        append_seconds += time.perf_counter() - started
+        rows_appended += len(rows)
+        
+        # Window ending right after this second's readings
+        if (second + 1) % hop == 0 and second + 1 >= Config.ACTIVITY_WINDOW:
+            started = time.perf_counter()
+            windows = []
+            for start in range(0, devices, Config.ACTIVITY_CHUNK):
+                chunk_started = time.perf_counter()
+                windows.extend(tracker.features(origin + second + 1, start, start + Config.ACTIVITY_CHUNK))
+                chunks.append((time.perf_counter() - chunk_started) * 1000)
+            ticks.append((time.perf_counter() - started) * 1000)
+            for window in windows:
+                classes[ACTIVITIES[window[-1]]] += 1
+    
+    us_per_row = append_seconds / rows_appended * 1e6
+    tick_ms = statistics.median(ticks) if ticks else 0.0
+    
+    # One core's share per simulated second: appends for every device plus 1/hop of a tick
+    busy_per_second = devices * us_per_row / 1e6 + tick_ms / 1000 / Config.ACTIVITY_HOP
+    return {
+        "devices": devices,
+        "seconds": args.seconds,
+        "window": Config.ACTIVITY_WINDOW,
+        "hop": Config.ACTIVITY_HOP,
+        "append_us_per_row": round(us_per_row, 3),
+        "append_rows_per_sec": round(1e6 / us_per_row),
+        "tick_ms_p50": round(tick_ms, 3),
+        "tick_ms_max": round(max(ticks), 3) if ticks else 0.0,
+        "chunk_ms_max": round(max(chunks), 3) if chunks else 0.0,
+        "cpu_share": round(busy_per_second, 4),
+        "max_devices_1hz": round(devices / busy_per_second) if busy_per_second else None,
+        "windows": classes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", default="1000,5000,20000", help="comma-separated device counts")
+    parser.add_argument("--seconds", type=int, default=180, help="simulated seconds per device count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per device count")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print(f"1 Hz per device, {args.seconds} s simulated, window {Config.ACTIVITY_WINDOW:g} s, hop {Config.ACTIVITY_HOP:g} s")
+        print(f"{'devices':>8} {'us/row':>8} {'rows/s':>10} {'tick ms':>9} {'tick max':>9} {'chunk max':>10} {'cpu':>7} {'max dev@1Hz':>12}  windows")
+    for devices in (int(n) for n in args.devices.split(",")):
+        result = run(devices, args)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['devices']:>8} {result['append_us_per_row']:>8} {result['append_rows_per_sec']:>10} "
+                f"{result['tick_ms_p50']:>9} {result['tick_ms_max']:>9} {result['chunk_ms_max']:>10} {result['cpu_share']:>7} "
+                f"{result['max_devices_1hz']:>12}  {result['windows']}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Per-batch cost of server-side alert detection
+
+Builds an AlertDetector, warms its rolling statistics for every device
+(default 10k), then times detect() on batches of several sizes. Readings
+walk slowly around normal values, with a small share of injected anomalies
+(threshold breaches, heart-rate spikes, battery drops).
+
+    python benchmarks/alert_detection.py --devices 10000 --batch 500,2000,10000
+    python benchmarks/alert_detection.py --json > results.json
+
+Run from the backend directory. The writer runs detection once per group
+commit (WRITE_BATCH_SIZE rows at most), in the event loop.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import AlertDetector  # noqa: E402
+from config import Config  # noqa: E402
+from sensor_schema import SENSOR_FIELDS  # noqa: E402
+
+
+def make_rows(devices: int, batch: int, start: int, clock: datetime, anomaly_rate: float, rng: random.Random):
+    """batch readings for devices start, start+1, ... (wrapping), one second apart per round"""
+    rows = []
+    for i in range(batch):
+        device = (start + i) % devices
+        reading = {
+            "imu_x": rng.randint(-300, 300), "imu_y": rng.randint(-300, 300), "imu_z": 981,
+            "suhu_kaki": 3800 + rng.randint(-30, 30), "vbatt_kaki": 3900 - (start + i) // devices,
+            "suhu_leher": 3850 + rng.randint(-30, 30), "vbatt_leher": 3950,
+            "latitude": -69000000 + device, "longitude": 1069000000 + device,
+            "spo2": 97 + rng.randint(-2, 2), "heart_rate": 75 + rng.randint(-5, 5)
+        }
+        if rng.random() < anomaly_rate:
+            anomaly = rng.choice(("spo2", "heart_rate", "suhu_kaki", "vbatt_kaki"))
+            reading[anomaly] = {"spo2": 82, "heart_rate": 140, "suhu_kaki": 4150, "vbatt_kaki": 3300}[anomaly]
+        timestamp = (clock + timedelta(seconds=(start + i) // devices)).isoformat()
+        rows.append((f"DEV{device:05d}", timestamp) + tuple(reading[field] for field in SENSOR_FIELDS))
+    return rows
+
+
+def run(batch: int, args) -> dict:
+    rng = random.Random(args.seed)
+    detector = AlertDetector(
+        z_threshold=Config.ALERT_Z_THRESHOLD,
+        alpha=Config.ALERT_Z_ALPHA,
+        min_samples=Config.ALERT_Z_MIN_SAMPLES,
+        max_drop_per_min=Config.ALERT_BATTERY_DROP,
+        rate_window=Config.ALERT_RATE_WINDOW,
+        cooldown=Config.ALERT_COOLDOWN
+    )
+    clock = datetime(2026, 1, 1)
+    
+    # Warm-up: enough readings per device for z-scores to be active
+    position = 0
+    warm_rows = args.devices * (Config.ALERT_Z_MIN_SAMPLES + 1)
+    while position < warm_rows:
+        size = min(10000, warm_rows - position)
+        detector.detect(make_rows(args.devices, size, position, clock, 0.0, rng))
+        position += size
+    
+    timings = []
+    found = 0
+    for _ in range(args.rounds):
+        rows = make_rows(args.devices, batch, position, clock, args.anomaly_rate, rng)
+        position += batch
+        started = time.perf_counter()
+        found += len(detector.detect(rows))
+        timings.append((time.perf_counter() - started) * 1000)
+    
+    timings.sort()
+    p50 = statistics.median(timings)
+    return {
+        "devices": args.devices,
+        "batch": batch,
+        "rounds": args.rounds,
+        "ms_p50": round(p50, 3),
+        "ms_p99": round(timings[int(len(timings) * 0.99)], 3),
+        "us_per_row": round(p50 * 1000 / batch, 3),
+        "rows_per_sec": round(batch / p50 * 1000),
+        "alerts_per_batch": round(found / args.rounds, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", type=int, default=10000, help="distinct device ids")
+    parser.add_argument("--batch", default="500,2000,10000", help="comma-separated rows per batch")
+    parser.add_argument("--rounds", type=int, default=50, help="timed batches per size")
+    parser.add_argument("--anomaly-rate", type=float, default=0.001, help="share of readings with an anomaly")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per batch size")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print(f"{args.devices} devices, {args.rounds} batches per size")
+        print(f"{'batch':>7} {'p50 ms':>9} {'p99 ms':>9} {'us/row':>8} {'rows/s':>10} {'alerts':>7}")
+    for batch in (int(n) for n in args.batch.split(",")):
+        result = run(batch, args)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['batch']:>7} {result['ms_p50']:>9} {result['ms_p99']:>9} {result['us_per_row']:>8} "
+                f"{result['rows_per_sec']:>10} {result['alerts_per_batch']:>7}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Per-batch cost of GPS indexing and geofence evaluation on ingest
+
+Builds a GeoIndex with F polygon geofences (V vertices each, scattered
+over a farm-sized area), places every device (default 10k) once, then
+times observe() on batches of several sizes: grid update, point-in-polygon
+for every fence across the batch, and track segment bookkeeping.
+
+    python benchmarks/geofence.py --fences 20 --vertices 64 --batch 500,2000,10000
+    python benchmarks/geofence.py --json > results.json
+
+Run from the backend directory. The writer calls observe() once per group
+commit (WRITE_BATCH_SIZE rows at most), in the event loop.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from geo import SCALE, GeoIndex  # noqa: E402
+from sensor_schema import SENSOR_FIELDS  # noqa: E402
+
+# Farm area around the dashboard's default location
+CENTER = (-7.7956, 110.3695)
+SPAN = 0.05  # degrees
+
+
+def make_fence(rng: random.Random, vertices: int) -> list:
+    """Star-shaped polygon of about 500 m radius somewhere on the farm"""
+    lat = CENTER[0] + rng.uniform(-SPAN, SPAN)
+    lon = CENTER[1] + rng.uniform(-SPAN, SPAN)
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = 0.0045 * rng.uniform(0.6, 1.0)
+        points.append([lat + radius * math.sin(angle), lon + radius * math.cos(angle)])
+    return points
+
+
+def make_rows(positions: list, batch: int, start: int, clock: datetime, rng: random.Random):
+    """batch readings for devices start, start+1, ... (wrapping), each moving a few meters"""
+    rows = []
+    devices = len(positions)
+    for i in range(batch):
+        device = (start + i) % devices
+        lat, lon = positions[device]
+        lat += rng.uniform(-0.0002, 0.0002)
+        lon += rng.uniform(-0.0002, 0.0002)
+        positions[device] = (lat, lon)
+        reading = dict.fromkeys(SENSOR_FIELDS, 0)
+        reading["latitude"] = int(lat * SCALE)
+        reading["longitude"] = int(lon * SCALE)
+        timestamp = (clock + timedelta(seconds=(start + i) // devices)).isoformat()
+        rows.append((f"DEV{device:05d}", timestamp) + tuple(reading[field] for field in SENSOR_FIELDS))
+    return rows
+
+
+def run(batch: int, args) -> dict:
+    rng = random.Random(args.seed)
+    index = GeoIndex(cell=Config.GEO_GRID_CELL, segment_seconds=Config.TRACK_SEGMENT_SECONDS)
+    for number in range(args.fences):
+        index.set_geofence(f"fence{number}", make_fence(rng, args.vertices))
+    
+    positions = [
+        (CENTER[0] + rng.uniform(-SPAN, SPAN), CENTER[1] + rng.uniform(-SPAN, SPAN))
+        for _ in range(args.devices)
+    ]
+    clock = datetime(2026, 1, 1)
+    
+    # Warm-up: every device located once, so fence state is known
+    position = 0
+    while position < args.devices:
+        size = min(10000, args.devices - position)
+        index.observe(make_rows(positions, size, position, clock, rng))
+        position += size
+    
+    timings = []
+    events = 0
+    segments = 0
+    for _ in range(args.rounds):
+        rows = make_rows(positions, batch, position, clock, rng)
+        position += batch
+        started = time.perf_counter()
+        found, written = index.observe(rows)
+        timings.append((time.perf_counter() - started) * 1000)
+        events += len(found)
+        segments += len(written)
+    
+    timings.sort()
+    p50 = statistics.median(timings)
+    return {
+        "devices": args.devices,
+        "fences": args.fences,
+        "vertices": args.vertices,
+        "batch": batch,
+        "rounds": args.rounds,
+        "ms_p50": round(p50, 3),
+        "ms_p99": round(timings[int(len(timings) * 0.99)], 3),
+        "us_per_row": round(p50 * 1000 / batch, 3),
+        "rows_per_sec": round(batch / p50 * 1000),
+        "events_per_batch": round(events / args.rounds, 2),
+        "segments_per_batch": round(segments / args.rounds, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", type=int, default=10000, help="distinct device ids")
+    parser.add_argument("--fences", type=int, default=20, help="geofences")
+    parser.add_argument("--vertices", type=int, default=64, help="vertices per geofence")
+    parser.add_argument("--batch", default="500,2000,10000", help="comma-separated rows per batch")
+    parser.add_argument("--rounds", type=int, default=50, help="timed batches per size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per batch size")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print(f"{args.devices} devices, {args.fences} fences x {args.vertices} vertices, {args.rounds} batches per size")
+        print(f"{'batch':>7} {'p50 ms':>9} {'p99 ms':>9} {'us/row':>8} {'rows/s':>10} {'events':>7} {'segments':>9}")
+    for batch in (int(n) for n in args.batch.split(",")):
+        result = run(batch, args)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['batch']:>7} {result['ms_p50']:>9} {result['ms_p99']:>9} {result['us_per_row']:>8} "
+                f"{result['rows_per_sec']:>10} {result['events_per_batch']:>7} {result['segments_per_batch']:>9}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
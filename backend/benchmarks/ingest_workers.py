@@ -0,0 +1,177 @@
+"""
+Ingest throughput vs. number of uvicorn workers
+
+Starts server.py with WORKERS=1, 2, 4, ... (each run on a fresh database in
+a temporary directory) and drives POST /api/data/batch from several client
+processes for a fixed time. With more than one worker, followers forward
+rows to the single SQLite writer through the Unix socket broker.
+
+    python benchmarks/ingest_workers.py --workers 1,2,4 --clients 8 --duration 10
+    python benchmarks/ingest_workers.py --json > results.json
+
+Run from the backend directory. Throughput only scales while request
+parsing/validation (spread over workers) dominates the writer's cost, and
+never beyond the number of CPU cores.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def client(port: int, batch: int, devices: int, duration: float, wait: bool, client_id: int, results):
+    """POST batches back to back until the deadline; report rows accepted and latencies"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    accepted = 0
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    sequence = 0
+    path = "/api/data/batch" if wait else "/api/data/batch?wait=false"
+    while time.monotonic() < deadline:
+        now = datetime.now().isoformat()
+        body = json.dumps([
+            {
+                "device_id": f"BENCH{(client_id * batch + sequence + i) % devices:05d}",
+                "timestamp": now,
+                "imu_x": i, "imu_y": -i, "imu_z": 1000,
+                "heart_rate": 60 + i % 40, "spo2": 97
+            }
+            for i in range(batch)
+        ])
+        sequence += batch
+        started = time.perf_counter()
+        try:
+            conn.request("POST", path, body, {"Content-Type": "application/json"})
+            response = json.loads(conn.getresponse().read())
+        except Exception:
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.get("status") == "ok":
+            accepted += response["accepted"]
+        else:
+            errors += 1
+    results.put({"accepted": accepted, "latencies": latencies, "errors": errors})
+
+
+def wait_ready(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/status", timeout=2).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run(workers: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="farmtech_bench_") as tmp:
+        env = dict(
+            os.environ,
+            WORKERS=str(workers),
+            PORT=str(args.port),
+            DATABASE_PATH=os.path.join(tmp, "bench.db"),
+            BROKER_SOCKET=os.path.join(tmp, "broker.sock"),
+            ARCHIVE_DIR=os.path.join(tmp, "archive"),
+            STORAGE_LAYOUT=args.layout,
+            DATA_RETENTION_DAYS="0"
+        )
+        server = subprocess.Popen(
+            [sys.executable, "server.py"], cwd=BACKEND_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_ready(args.port)
+            time.sleep(1)  # let every worker finish startup
+            
+            results = multiprocessing.Queue()
+            clients = [
+                multiprocessing.Process(
+                    target=client,
+                    args=(args.port, args.batch, args.devices, args.duration, not args.no_wait, n, results)
+                )
+                for n in range(args.clients)
+            ]
+            started = time.perf_counter()
+            for process in clients:
+                process.start()
+            outcomes = [results.get() for _ in clients]
+            for process in clients:
+                process.join()
+            elapsed = time.perf_counter() - started
+            accepted = sum(outcome["accepted"] for outcome in outcomes)
+            
+            # With --no-wait, queued rows reach the database a little later
+            deadline = time.monotonic() + 30
+            while True:
+                stored = json.loads(urllib.request.urlopen(
+                    f"http://127.0.0.1:{args.port}/api/statistics", timeout=30
+                ).read())["total_records"]
+                if stored >= accepted or time.monotonic() > deadline:
+                    break
+                time.sleep(0.5)
+        finally:
+            server.terminate()
+            server.wait(30)
+    
+    latencies = sorted(latency for outcome in outcomes for latency in outcome["latencies"])
+    return {
+        "workers": workers,
+        "clients": args.clients,
+        "batch": args.batch,
+        "duration_s": round(elapsed, 2),
+        "rows_accepted": accepted,
+        "rows_stored": stored,
+        "rows_per_sec": round(accepted / elapsed, 1),
+        "requests": len(latencies),
+        "errors": sum(outcome["errors"] for outcome in outcomes),
+        "latency_ms_p50": round(statistics.median(latencies), 2) if latencies else None,
+        "latency_ms_p99": round(latencies[int(len(latencies) * 0.99)], 2) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--batch", type=int, default=200, help="readings per request")
+    parser.add_argument("--devices", type=int, default=500, help="distinct device ids")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument("--no-wait", action="store_true", help="do not wait for the commit (wait=false)")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--layout", default="compact", choices=("legacy", "compact"))
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print(f"{os.cpu_count()} CPUs, {args.clients} clients x {args.batch} readings/request, {args.duration}s per run")
+        print(f"{'workers':>7} {'rows/s':>10} {'stored':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for workers in (int(n) for n in args.workers.split(",")):
+        result = run(workers, args)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['workers']:>7} {result['rows_per_sec']:>10.1f} {result['rows_stored']:>9} "
+                f"{result['latency_ms_p50']:>8} {result['latency_ms_p99']:>8} {result['errors']:>6}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Cost of the liveness monitor as the number of connected devices grows
+
+Adds N devices to a LivenessMonitor with no-op callbacks, then runs its
+timer wheel for a few heartbeat intervals while a traffic task touches
+devices the way incoming messages would. Silent devices go through
+warning and offline, so pings and evictions are part of the measurement.
+
+    python benchmarks/liveness.py --devices 1000,10000,50000
+    python benchmarks/liveness.py --json > results.json
+
+Run from the backend directory. Per-tick cost should grow with the timers
+due in that tick (devices / heartbeat * tick), not with the device count.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from liveness import LivenessMonitor  # noqa: E402
+
+
+def timed(call, count: int) -> float:
+    """ns per call"""
+    started = time.perf_counter()
+    for i in range(count):
+        call(i)
+    return (time.perf_counter() - started) * 1e9 / count
+
+
+async def run(devices: int, args) -> dict:
+    events = {"ping": 0, "status": 0, "timeout": 0}
+    monitor = LivenessMonitor(
+        heartbeat=args.heartbeat,
+        timeout=args.heartbeat * 2,
+        tick=args.tick,
+        on_ping=lambda device_id, handle: events.__setitem__("ping", events["ping"] + 1),
+        on_status=lambda *status: events.__setitem__("status", events["status"] + 1),
+        on_timeout=lambda device_id, handle: events.__setitem__("timeout", events["timeout"] + 1)
+    )
+    ids = [f"DEV{i:05d}" for i in range(devices)]
+    add_ns = timed(lambda i: monitor.add(ids[i], None), devices)
+    touch_ns = timed(lambda i: monitor.touch(ids[i % devices]), max(devices, 100000))
+    
+    # Wrap the tick loop to time each tick
+    ticks = []
+    advance = monitor.wheel.advance
+    
+    def timed_advance():
+        started = time.perf_counter()
+        expired = advance()
+        for device_id in expired:
+            monitor._expire(device_id)
+        ticks.append(((time.perf_counter() - started) * 1000, len(expired)))
+        return []
+    
+    monitor.wheel.advance = timed_advance
+    
+    # Most devices keep talking; a share goes silent and ends up evicted
+    talking = ids[:int(devices * (1 - args.silent))]
+    
+    async def traffic():
+        # Every talking device sends twice per heartbeat interval
+        per_slice = max(1, int(len(talking) / args.heartbeat * 0.05 * 2))
+        order = itertools.cycle(talking)
+        while True:
+            for _ in range(per_slice):
+                monitor.touch(next(order))
+            await asyncio.sleep(0.05)
+    
+    monitor.start()
+    traffic_task = asyncio.create_task(traffic()) if talking else None
+    await asyncio.sleep(args.heartbeat * args.intervals)
+    monitor.stop()
+    if traffic_task:
+        traffic_task.cancel()
+    
+    costs = sorted(cost for cost, _ in ticks)
+    return {
+        "devices": devices,
+        "add_ns": round(add_ns),
+        "touch_ns": round(touch_ns),
+        "ticks": len(ticks),
+        "tick_ms_p50": round(statistics.median(costs), 3),
+        "tick_ms_max": round(costs[-1], 3),
+        "timers_per_tick": round(sum(fired for _, fired in ticks) / len(ticks), 1),
+        "pings": events["ping"],
+        "timeouts": events["timeout"],
+        "still_tracked": len(monitor.devices)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", default="1000,10000,50000", help="comma-separated device counts")
+    parser.add_argument("--heartbeat", type=float, default=2.0, help="WS_HEARTBEAT_INTERVAL for the run (timeout is twice that)")
+    parser.add_argument("--tick", type=float, default=0.1, help="LIVENESS_TICK for the run")
+    parser.add_argument("--intervals", type=float, default=3, help="heartbeat intervals to run for")
+    parser.add_argument("--silent", type=float, default=0.1, help="share of devices that never send")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per device count")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)  # one warning per eviction otherwise
+    
+    if not args.json:
+        print(f"heartbeat {args.heartbeat}s, tick {args.tick}s, {args.silent:.0%} silent devices")
+        print(f"{'devices':>8} {'add ns':>7} {'touch ns':>9} {'tick p50 ms':>12} {'tick max ms':>12} {'timers/tick':>12} {'timeouts':>9}")
+    for devices in (int(n) for n in args.devices.split(",")):
+        result = asyncio.run(run(devices, args))
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['devices']:>8} {result['add_ns']:>7} {result['touch_ns']:>9} {result['tick_ms_p50']:>12} "
+                f"{result['tick_ms_max']:>12} {result['timers_per_tick']:>12} {result['timeouts']:>9}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,702 @@
+"""
+Load generator and benchmark harness for the FarmTech server
+
+Starts server.py on a fresh database in a temporary directory (or targets
+a running server with --url) and drives it with simulated clients spread
+over several processes:
+
+  ESP32      WebSocket collars at --rate messages/s each, JSON or binary
+             frames; measures ack and durable latency (sequenced acks)
+  dashboard  /ws/dashboard subscribers; measures ingest -> dashboard
+             latency (reading timestamp = server receipt, same host clock)
+  http       POST /api/data/batch clients at --http-rate requests/s
+  history    clients cycling /api/devices/{id}/data, /window and
+             /api/data/recent at --history-rate requests/s
+
+Reports throughput, latency percentiles, writer commit times from
+/api/status, and server CPU and memory (Linux /proc, whole process tree).
+
+    python benchmarks/loadgen.py --devices 2000 --dashboards 20 --duration 30
+    python benchmarks/loadgen.py --format json --http-clients 4 --history-clients 4
+    python benchmarks/loadgen.py --json --output results.jsonl --label baseline
+
+--output appends one JSON object per run, so runs can be compared over time.
+Run from the backend directory.
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import sensor_schema  # noqa: E402
+
+SAMPLE_CAP = 50000  # latency samples kept per metric and process (reservoir)
+
+
+class Samples:
+    """Reservoir of latency samples (ms) with an exact count"""
+    
+    def __init__(self, cap: int = SAMPLE_CAP):
+        self.cap = cap
+        self.count = 0
+        self.values = []
+    
+    def add(self, value: float):
+        self.count += 1
+        if len(self.values) < self.cap:
+            self.values.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < self.cap:
+                self.values[index] = value
+    
+    def dump(self) -> dict:
+        return {"count": self.count, "values": self.values}
+
+
+def summarize(parts: list) -> dict:
+    """Merge dumped Samples from every process into percentiles"""
+    values = sorted(value for part in parts for value in part["values"])
+    count = sum(part["count"] for part in parts)
+    if not values:
+        return {"count": count}
+    
+    def percentile(p: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * p))], 3)
+    
+    return {
+        "count": count,
+        "mean": round(sum(values) / len(values), 3),
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "p99": percentile(0.99),
+        "max": round(values[-1], 3)
+    }
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def random_reading(rng: random.Random) -> dict:
+    """Raw values within the SENSOR_CONFIG types, around normal readings"""
+    return {
+        "imu_x": rng.randint(-500, 500), "imu_y": rng.randint(-500, 500), "imu_z": 981 + rng.randint(-50, 50),
+        "suhu_kaki": 3800 + rng.randint(-50, 50), "vbatt_kaki": 3900 + rng.randint(-20, 20),
+        "suhu_leher": 3850 + rng.randint(-50, 50), "vbatt_leher": 3950 + rng.randint(-20, 20),
+        "latitude": -69000000 + rng.randint(-1000, 1000), "longitude": 1069000000 + rng.randint(-1000, 1000),
+        "spo2": 97 + rng.randint(-1, 1), "heart_rate": 75 + rng.randint(-5, 5)
+    }
+
+
+# ============================================================
+# CLIENTS (run inside client processes)
+# ============================================================
+
+class ClientStats:
+    """Counters and samples of one client process"""
+    
+    def __init__(self):
+        self.counters = {
+            "esp32_connected": 0,
+            "esp32_connect_errors": 0,
+            "esp32_messages": 0,
+            "esp32_readings": 0,
+            "esp32_acks": 0,
+            "esp32_errors": 0,
+            "esp32_slow_down": 0,
+            "esp32_disconnects": 0,
+            "dashboards_connected": 0,
+            "dashboard_connect_errors": 0,
+            "dashboard_readings": 0,
+            "dashboard_frames": 0,
+            "http_requests": 0,
+            "http_readings": 0,
+            "http_errors": 0,
+            "history_requests": 0,
+            "history_errors": 0
+        }
+        self.samples = {}
+    
+    def sample(self, name: str, value: float):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = Samples()
+        samples.add(value)
+    
+    def dump(self) -> dict:
+        return {
+            "counters": self.counters,
+            "samples": {name: samples.dump() for name, samples in self.samples.items()}
+        }
+
+
+async def esp32_client(spec: dict, device_id: str, stats: ClientStats, rng: random.Random):
+    """One collar: send at a fixed rate, match acks/durable notices by sequence number"""
+    uri = f"{spec['ws_url']}/ws/esp32/{device_id}"
+    try:
+        ws = await websockets.connect(uri, compression=None, ping_interval=None, open_timeout=60, max_queue=None)
+    except Exception:
+        stats.counters["esp32_connect_errors"] += 1
+        return
+    stats.counters["esp32_connected"] += 1
+    measure_from, stop_at = spec["measure_from"], spec["stop_at"]
+    sent_at = {}
+    
+    async def read_replies():
+        async for text in ws:
+            now = time.time()
+            reply = json.loads(text)
+            status = reply.get("status")
+            if status == "ok":
+                stats.counters["esp32_acks"] += 1
+                started = sent_at.get(reply.get("seq"))
+                if started is not None and started >= measure_from:
+                    stats.sample("ack_ms", (now - started) * 1000)
+            elif status == "durable":
+                for seq in [seq for seq in sent_at if seq <= reply["seq"]]:
+                    started = sent_at.pop(seq)
+                    if started >= measure_from:
+                        stats.sample("durable_ms", (now - started) * 1000)
+            elif status == "slow_down":
+                stats.counters["esp32_slow_down"] += 1
+            elif status == "error":
+                stats.counters["esp32_errors"] += 1
+    
+    reader = asyncio.create_task(read_replies())
+    interval = 1 / spec["rate"]
+    per_frame = spec["readings_per_frame"]
+    # Spread the first sends over one interval so collars are not in lockstep
+    next_send = spec["start_at"] + rng.random() * interval
+    seq = 0
+    try:
+        while True:
+            delay = next_send - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if time.time() >= stop_at:
+                break
+            if spec["format"] == "binary":
+                readings = [random_reading(rng) for _ in range(per_frame)]
+                payload = sensor_schema.encode_frame(readings, [int(interval * 1000 * (per_frame - 1 - i)) for i in range(per_frame)])
+            else:
+                readings = [random_reading(rng)]
+                payload = json.dumps(readings[0])
+            seq += 1
+            sent_at[seq] = time.time()
+            await ws.send(payload)
+            stats.counters["esp32_messages"] += 1
+            stats.counters["esp32_readings"] += len(readings)
+            next_send += interval
+        # Give the last acks and durable notices time to arrive
+        await asyncio.sleep(spec["drain"])
+    except websockets.ConnectionClosed:
+        stats.counters["esp32_disconnects"] += 1
+    finally:
+        reader.cancel()
+        await ws.close()
+
+
+async def dashboard_client(spec: dict, stats: ClientStats):
+    """One dashboard: ingest -> dashboard latency of every sensor_data message"""
+    uri = f"{spec['ws_url']}/ws/dashboard"
+    try:
+        ws = await websockets.connect(uri, ping_interval=None, open_timeout=60, max_size=None, max_queue=None)
+    except Exception:
+        stats.counters["dashboard_connect_errors"] += 1
+        return
+    stats.counters["dashboards_connected"] += 1
+    measure_from, stop_at = spec["measure_from"], spec["stop_at"] + spec["drain"]
+    try:
+        while True:
+            remaining = stop_at - time.time()
+            if remaining <= 0:
+                break
+            try:
+                text = await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                break
+            now = time.time()
+            message = json.loads(text)
+            if message.get("type") != "sensor_data":
+                continue
+            stats.counters["dashboard_readings"] += message.get("batch", {}).get("count", 1)
+            stats.counters["dashboard_frames"] += 1
+            received = datetime.fromisoformat(message["data"]["timestamp"]).timestamp()
+            if received >= measure_from:
+                stats.sample("e2e_ms", (now - received) * 1000)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        await ws.close()
+
+
+def http_call(conn_box: list, host: str, port: int, method: str, path: str, body=None) -> dict:
+    """Blocking request on a kept-alive connection (reconnects once on failure)"""
+    for attempt in (0, 1):
+        if conn_box[0] is None:
+            conn_box[0] = http.client.HTTPConnection(host, port, timeout=60)
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn_box[0].request(method, path, body, headers)
+            response = conn_box[0].getresponse()
+            data = response.read()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            return json.loads(data)
+        except (http.client.HTTPException, ConnectionError, OSError):
+            conn_box[0].close()
+            conn_box[0] = None
+            if attempt:
+                raise
+
+
+async def rate_loop(spec: dict, rate: float, rng: random.Random, call):
+    """Run call() at rate per second (back to back if it is slower) inside the run window"""
+    interval = 1 / rate
+    next_call = spec["start_at"] + rng.random() * interval
+    while True:
+        delay = next_call - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if time.time() >= spec["stop_at"]:
+            return
+        await call()
+        next_call = max(next_call + interval, time.time() - interval)
+
+
+async def http_client(spec: dict, client_id: int, stats: ClientStats, executor, rng: random.Random):
+    """POST /api/data/batch with --http-batch readings"""
+    loop = asyncio.get_running_loop()
+    conn_box = [None]
+    path = "/api/data/batch" if spec["http_wait"] else "/api/data/batch?wait=false"
+    
+    async def call():
+        body = json.dumps([
+            {"device_id": f"HTTP{client_id:03d}_{i % 50:02d}", **random_reading(rng)}
+            for i in range(spec["http_batch"])
+        ])
+        started = time.time()
+        try:
+            result = await loop.run_in_executor(executor, http_call, conn_box, spec["host"], spec["port"], "POST", path, body)
+        except Exception:
+            stats.counters["http_errors"] += 1
+            return
+        stats.counters["http_requests"] += 1
+        stats.counters["http_readings"] += result.get("accepted", 0)
+        if started >= spec["measure_from"]:
+            stats.sample("http_ingest_ms", (time.time() - started) * 1000)
+    
+    await rate_loop(spec, spec["http_rate"], rng, call)
+
+
+async def history_client(spec: dict, stats: ClientStats, executor, rng: random.Random):
+    """Cycle through the read endpoints dashboards use"""
+    loop = asyncio.get_running_loop()
+    conn_box = [None]
+    queries = [
+        ("history_device_data_ms", lambda device: f"/api/devices/{device}/data?limit=100"),
+        ("history_window_ms", lambda device: f"/api/devices/{device}/window?size=120"),
+        ("history_recent_ms", lambda device: "/api/data/recent?limit=100")
+    ]
+    turn = [0]
+    
+    async def call():
+        name, build = queries[turn[0] % len(queries)]
+        turn[0] += 1
+        device = urllib.parse.quote(f"{spec['device_prefix']}{rng.randrange(max(1, spec['devices_total'])):05d}")
+        started = time.time()
+        try:
+            await loop.run_in_executor(executor, http_call, conn_box, spec["host"], spec["port"], "GET", build(device))
+        except Exception:
+            stats.counters["history_errors"] += 1
+            return
+        stats.counters["history_requests"] += 1
+        if started >= spec["measure_from"]:
+            stats.sample(name, (time.time() - started) * 1000)
+    
+    await rate_loop(spec, spec["history_rate"], rng, call)
+
+
+async def client_main(spec: dict) -> dict:
+    stats = ClientStats()
+    rng = random.Random(spec["seed"])
+    workers = spec["http_clients"] + spec["history_clients"]
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    tasks = [dashboard_client(spec, stats) for _ in range(spec["dashboards"])]
+    # Dashboards connect first so they see the first readings
+    dashboards = [asyncio.create_task(task) for task in tasks]
+    await asyncio.sleep(0.5)
+    tasks = [
+        esp32_client(spec, f"{spec['device_prefix']}{n:05d}", stats, random.Random(rng.random()))
+        for n in spec["device_numbers"]
+    ]
+    tasks += [http_client(spec, n, stats, executor, random.Random(rng.random())) for n in spec["http_ids"]]
+    tasks += [history_client(spec, stats, executor, random.Random(rng.random())) for _ in range(spec["history_clients"])]
+    await asyncio.gather(*tasks, *dashboards)
+    executor.shutdown(wait=False)
+    return stats.dump()
+
+
+def client_process(spec: dict, results):
+    raise_fd_limit()
+    try:
+        results.put(asyncio.run(client_main(spec)))
+    except Exception as e:
+        results.put({"error": repr(e)})
+
+
+# ============================================================
+# SERVER SIDE
+# ============================================================
+
+def process_tree(pid: int) -> list:
+    """pid and its descendants (uvicorn workers)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def sample_resources(pid: int) -> dict:
+    """CPU seconds and RSS of a process tree (None where /proc is unavailable)"""
+    cpu = 0.0
+    rss = 0
+    ticks = os.sysconf("SC_CLK_TCK")
+    page = resource.getpagesize()
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{current}/statm") as f:
+                rss += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            return {"cpu_s": None, "rss_mb": None}
+    return {"cpu_s": cpu, "rss_mb": round(rss / 1024 / 1024, 1)}
+
+
+def get_json(base_url: str, path: str) -> dict:
+    return json.loads(urllib.request.urlopen(base_url + path, timeout=30).read())
+
+
+def writer_status(base_url: str, workers: int) -> dict:
+    """/api/status from the SQLite writer (with several workers, any worker may answer)"""
+    best = None
+    for _ in range(max(1, workers * 4)):
+        status = get_json(base_url, "/api/status")
+        if status.get("cluster", {}).get("broker", {}).get("writer", True):
+            return status
+        best = best or status
+    return best
+
+
+def wait_ready(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            get_json(base_url, "/api/status")
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def start_server(args, tmp: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        WORKERS=str(args.workers),
+        PORT=str(args.port),
+        DATABASE_PATH=os.path.join(tmp, "bench.db"),
+        BROKER_SOCKET=os.path.join(tmp, "broker.sock"),
+        ARCHIVE_DIR=os.path.join(tmp, "archive"),
+        STORAGE_LAYOUT=args.layout,
+        DATA_RETENTION_DAYS="0"
+    )
+    for assignment in args.env:
+        name, _, value = assignment.partition("=")
+        env[name] = value
+    log = open(os.path.join(tmp, "server.log"), "w") if args.server_log else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, "server.py"], cwd=BACKEND_DIR, env=env, stdout=log, stderr=log)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ============================================================
+# RUN
+# ============================================================
+
+def client_specs(args, base_url: str, start_at: float) -> list:
+    parsed = urllib.parse.urlparse(base_url)
+    common = {
+        "ws_url": ("wss://" if parsed.scheme == "https" else "ws://") + parsed.netloc,
+        "host": parsed.hostname,
+        "port": parsed.port or 80,
+        "start_at": start_at,
+        "measure_from": start_at + args.warmup,
+        "stop_at": start_at + args.duration,
+        "drain": args.drain,
+        "rate": args.rate,
+        "format": args.format,
+        "readings_per_frame": args.readings_per_frame if args.format == "binary" else 1,
+        "http_rate": args.http_rate,
+        "http_batch": args.http_batch,
+        "http_wait": not args.http_no_wait,
+        "history_rate": args.history_rate,
+        "devices_total": args.devices,
+        "device_prefix": args.device_prefix
+    }
+    procs = max(1, args.procs)
+    specs = []
+    for n in range(procs):
+        specs.append({
+            **common,
+            "seed": args.seed + n,
+            "device_numbers": list(range(n, args.devices, procs)),
+            "dashboards": len(range(n, args.dashboards, procs)),
+            "http_ids": list(range(n, args.http_clients, procs)),
+            "http_clients": len(range(n, args.http_clients, procs)),
+            "history_clients": len(range(n, args.history_clients, procs))
+        })
+    return specs
+
+
+def run(args) -> dict:
+    raise_fd_limit()
+    with tempfile.TemporaryDirectory(prefix="farmtech_loadgen_") as tmp:
+        server = None
+        base_url = args.url
+        if base_url is None:
+            base_url = f"http://127.0.0.1:{args.port}"
+            server = start_server(args, tmp)
+        try:
+            wait_ready(base_url)
+            time.sleep(1 if server else 0)  # let every worker finish startup
+            before = writer_status(base_url, args.workers)
+            stored_before = get_json(base_url, "/api/statistics").get("total_records", 0)
+            
+            # Clients connect during the lead time, then all start sending at start_at
+            start_at = time.time() + args.connect_time
+            results = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=client_process, args=(spec, results))
+                for spec in client_specs(args, base_url, start_at)
+            ]
+            for process in processes:
+                process.start()
+            
+            usage = []
+            while time.time() < start_at + args.duration + args.drain:
+                if server:
+                    usage.append((time.time(), sample_resources(server.pid)))
+                time.sleep(1)
+            outcomes = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            
+            after = writer_status(base_url, args.workers)
+            stored_after = get_json(base_url, "/api/statistics").get("total_records", 0)
+        finally:
+            if server:
+                server.terminate()
+                server.wait(30)
+    
+    failures = [outcome["error"] for outcome in outcomes if "error" in outcome]
+    outcomes = [outcome for outcome in outcomes if "error" not in outcome]
+    counters = {}
+    samples = {}
+    for outcome in outcomes:
+        for name, value in outcome["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, dumped in outcome["samples"].items():
+            samples.setdefault(name, []).append(dumped)
+    
+    def latency(name: str) -> dict:
+        return summarize(samples.get(name, []))
+    
+    window = args.duration
+    writer_before, writer_after = before.get("writer", {}), after.get("writer", {})
+    batches = writer_after.get("batches_written", 0) - writer_before.get("batches_written", 0)
+    commit_ms = writer_after.get("total_commit_ms", 0) - writer_before.get("total_commit_ms", 0)
+    rows = writer_after.get("rows_written", 0) - writer_before.get("rows_written", 0)
+    
+    resources = {}
+    measured = [(t, sample) for t, sample in usage if sample["cpu_s"] is not None]
+    if len(measured) >= 2:
+        (t0, first), (t1, last) = measured[0], measured[-1]
+        resources = {
+            "cpu_percent_avg": round((last["cpu_s"] - first["cpu_s"]) / (t1 - t0) * 100, 1),
+            "rss_mb_max": max(sample["rss_mb"] for _, sample in measured),
+            "rss_mb_end": last["rss_mb"]
+        }
+    
+    return {
+        "run": {
+            "label": args.label,
+            "started": datetime.fromtimestamp(start_at).isoformat(),
+            "git_commit": git_commit(),
+            "host": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+            "config": {name: value for name, value in vars(args).items() if name not in ("json", "output")},
+            "client_failures": failures
+        },
+        "esp32": {
+            "devices": args.devices,
+            "connected": counters.get("esp32_connected", 0),
+            "connect_errors": counters.get("esp32_connect_errors", 0),
+            "disconnects": counters.get("esp32_disconnects", 0),
+            "messages": counters.get("esp32_messages", 0),
+            "readings": counters.get("esp32_readings", 0),
+            "readings_per_sec": round(counters.get("esp32_readings", 0) / window, 1),
+            "acks": counters.get("esp32_acks", 0),
+            "errors": counters.get("esp32_errors", 0),
+            "slow_down": counters.get("esp32_slow_down", 0),
+            "ack_latency_ms": latency("ack_ms"),
+            "durable_latency_ms": latency("durable_ms")
+        },
+        "dashboards": {
+            "count": args.dashboards,
+            "connected": counters.get("dashboards_connected", 0),
+            "readings": counters.get("dashboard_readings", 0),
+            "messages_per_sec_per_dashboard": round(
+                counters.get("dashboard_frames", 0) / window / max(1, counters.get("dashboards_connected", 0)), 1
+            ),
+            "e2e_latency_ms": latency("e2e_ms")
+        },
+        "http_ingest": {
+            "clients": args.http_clients,
+            "requests": counters.get("http_requests", 0),
+            "readings": counters.get("http_readings", 0),
+            "readings_per_sec": round(counters.get("http_readings", 0) / window, 1),
+            "errors": counters.get("http_errors", 0),
+            "latency_ms": latency("http_ingest_ms")
+        },
+        "history": {
+            "clients": args.history_clients,
+            "requests": counters.get("history_requests", 0),
+            "errors": counters.get("history_errors", 0),
+            "device_data_ms": latency("history_device_data_ms"),
+            "window_ms": latency("history_window_ms"),
+            "recent_ms": latency("history_recent_ms")
+        },
+        "server": {
+            "rows_stored": stored_after - stored_before,
+            "rows_per_sec": round((stored_after - stored_before) / window, 1),
+            "batches": batches,
+            "avg_batch_rows": round(rows / batches, 1) if batches else None,
+            "commit_ms_avg": round(commit_ms / batches, 3) if batches else None,
+            "commit_ms_max": writer_after.get("max_commit_ms"),
+            "write_queue_depth_end": writer_after.get("queue_depth"),
+            "ingest_pipeline": after.get("ingest_pipeline"),
+            "dashboard_dropped": sum(queue.get("dropped", 0) for queue in after.get("connections", {}).get("dashboard_queues", [])),
+            **resources
+        }
+    }
+
+
+def print_report(result: dict):
+    def line(name: str, stats: dict) -> str:
+        if "p50" not in stats:
+            return f"  {name:<22} no samples"
+        return (f"  {name:<22} p50 {stats['p50']:>9} p90 {stats['p90']:>9} p99 {stats['p99']:>9} "
+                f"max {stats['max']:>9} ms  (n={stats['count']})")
+    
+    esp32, dashboards, http_ingest, history, server = (
+        result[key] for key in ("esp32", "dashboards", "http_ingest", "history", "server")
+    )
+    print(f"ESP32: {esp32['connected']}/{esp32['devices']} connected, {esp32['readings_per_sec']} readings/s, "
+          f"{esp32['acks']} acks, {esp32['errors']} errors, {esp32['slow_down']} slow_down")
+    print(line("ack", esp32["ack_latency_ms"]))
+    print(line("durable", esp32["durable_latency_ms"]))
+    print(f"Dashboards: {dashboards['connected']}/{dashboards['count']} connected, "
+          f"{dashboards['messages_per_sec_per_dashboard']} msg/s each")
+    print(line("ingest -> dashboard", dashboards["e2e_latency_ms"]))
+    if http_ingest["clients"]:
+        print(f"HTTP ingest: {http_ingest['readings_per_sec']} readings/s, {http_ingest['errors']} errors")
+        print(line("POST /api/data/batch", http_ingest["latency_ms"]))
+    if history["clients"]:
+        print(f"History: {history['requests']} requests, {history['errors']} errors")
+        print(line("device data", history["device_data_ms"]))
+        print(line("window", history["window_ms"]))
+        print(line("recent", history["recent_ms"]))
+    print(f"Server: {server['rows_per_sec']} rows/s stored, {server['batches']} commits, "
+          f"avg {server['avg_batch_rows']} rows, commit avg {server['commit_ms_avg']} ms / max {server['commit_ms_max']} ms")
+    if "cpu_percent_avg" in server:
+        print(f"  CPU {server['cpu_percent_avg']}%  RSS max {server['rss_mb_max']} MB, end {server['rss_mb_end']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", type=int, default=500, help="simulated ESP32 WebSocket clients")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per device")
+    parser.add_argument("--format", default="binary", choices=("binary", "json"), help="ESP32 payload format")
+    parser.add_argument("--readings-per-frame", type=int, default=1, help="readings per binary frame")
+    parser.add_argument("--device-prefix", default="LOAD", help="device id prefix")
+    parser.add_argument("--dashboards", type=int, default=5, help="dashboard subscribers")
+    parser.add_argument("--http-clients", type=int, default=0, help="POST /api/data/batch clients")
+    parser.add_argument("--http-rate", type=float, default=2.0, help="requests per second per HTTP client")
+    parser.add_argument("--http-batch", type=int, default=100, help="readings per HTTP request")
+    parser.add_argument("--http-no-wait", action="store_true", help="do not wait for the commit (wait=false)")
+    parser.add_argument("--history-clients", type=int, default=0, help="history/read query clients")
+    parser.add_argument("--history-rate", type=float, default=2.0, help="queries per second per history client")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds at the start excluded from latencies")
+    parser.add_argument("--drain", type=float, default=3, help="seconds after the load to collect replies")
+    parser.add_argument("--connect-time", type=float, default=10, help="seconds allowed for clients to connect")
+    parser.add_argument("--procs", type=int, default=os.cpu_count() or 1, help="client processes")
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started server")
+    parser.add_argument("--layout", default="compact", choices=("legacy", "compact"))
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra server setting")
+    parser.add_argument("--server-log", action="store_true", help="keep server output in the temp dir log")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="free-form run label stored with the results")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--output", default=None, help="append the result as one JSON line to this file")
+    args = parser.parse_args()
+    
+    result = run(args)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
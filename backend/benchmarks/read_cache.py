@@ -0,0 +1,124 @@
+"""
+Dashboard reconnect storm against the read cache
+
+C dashboards (default 50, 200 and 1000) ask for the initial snapshot at
+the same moment: 100 recent readings, the device list and statistics, as
+send_initial_data builds it. The loader waits --query-ms (the database
+round trip) and then builds the rows. Each count is run with the cache
+off, then on. Reports loads executed, time until every caller has its
+encoded bytes, and the cost of a warm hit.
+
+    python benchmarks/read_cache.py --callers 50,200,1000 --devices 500
+    python benchmarks/read_cache.py --json > results.json
+
+Run from the backend directory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from read_cache import INGEST_TAGS, ReadCache  # noqa: E402
+from sensor_schema import SENSOR_FIELDS  # noqa: E402
+
+
+def make_snapshot(devices: int, rng: random.Random) -> dict:
+    clock = datetime(2026, 1, 1)
+    readings = [
+        {
+            "id": i,
+            "device_id": f"DEV{rng.randrange(devices):05d}",
+            "timestamp": (clock + timedelta(seconds=i)).isoformat(),
+            **{field: rng.randint(0, 1000) for field in SENSOR_FIELDS}
+        }
+        for i in range(100)
+    ]
+    registry = [
+        {
+            "id": i + 1,
+            "device_id": f"DEV{i:05d}",
+            "cow_id": None,
+            "status": "active",
+            "last_seen": clock.isoformat(),
+            "firmware_version": None,
+            "created_at": "2026-01-01 00:00:00",
+            "updated_at": "2026-01-01 00:00:00"
+        }
+        for i in range(devices)
+    ]
+    return {
+        "sensor_readings": readings,
+        "devices": registry,
+        "statistics": {"total_records": 1000000, "total_devices": devices, "records_today": 5000,
+                       "records_last_hour": 200, "timestamp": clock.isoformat()}
+    }
+
+
+async def storm(callers: int, enabled: bool, args) -> dict:
+    rng = random.Random(args.seed)
+    cache = ReadCache(ttl=2.0, max_bytes=8 * 1024 * 1024, max_entries=256, enabled=enabled)
+    loads = 0
+    
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(args.query_ms / 1000)
+        return make_snapshot(args.devices, rng)
+    
+    started = time.perf_counter()
+    bodies = await asyncio.gather(*[
+        cache.get(("snapshot",), load, tags=INGEST_TAGS) for _ in range(callers)
+    ])
+    storm_ms = (time.perf_counter() - started) * 1000
+    
+    # Warm hits (cache on) or repeated loads (cache off), one at a time
+    repeats = 200 if enabled else 20
+    started = time.perf_counter()
+    for _ in range(repeats):
+        await cache.get(("snapshot",), load, tags=INGEST_TAGS)
+    per_call_us = (time.perf_counter() - started) / repeats * 1e6
+    return {
+        "callers": callers,
+        "cache": enabled,
+        "loads": loads - repeats * (not enabled),
+        "storm_ms": round(storm_ms, 2),
+        "per_call_us": round(per_call_us, 1),
+        "body_bytes": len(bodies[0]),
+        **({"coalesced": cache.stats["coalesced"], "hits": cache.stats["hits"]} if enabled else {})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--callers", default="50,200,1000", help="comma-separated concurrent dashboards")
+    parser.add_argument("--devices", type=int, default=500, help="devices in the snapshot's device list")
+    parser.add_argument("--query-ms", type=float, default=5.0, help="simulated database round trip")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per run")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print(f"{args.devices} devices, {args.query_ms:g} ms per load")
+        print(f"{'callers':>8} {'cache':>6} {'loads':>6} {'storm ms':>9} {'us/call':>9} {'bytes':>8}")
+    for callers in (int(n) for n in args.callers.split(",")):
+        for enabled in (False, True):
+            result = asyncio.run(storm(callers, enabled, args))
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                print(
+                    f"{result['callers']:>8} {'on' if enabled else 'off':>6} {result['loads']:>6} "
+                    f"{result['storm_ms']:>9} {result['per_call_us']:>9} {result['body_bytes']:>8}",
+                    flush=True
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Message bus between server worker processes
+With several uvicorn workers, each one holds only its own ESP32 and
+dashboard sockets. The broker carries what has to cross workers: dashboard
+broadcasts, device presence, device commands, per-worker stats, and writes
+forwarded to the single SQLite writer.
+
+Two backends, chosen with Config.BROKER:
+  inprocess  one worker, nothing to forward (publish is a no-op, requests
+             are handled locally)
+  unix       local multi-process bus over a Unix domain socket. The worker
+             that wins an exclusive lock on the writer lock file is the SQLite
+             writer and hosts the hub; the others connect to it. The hub
+             relays published messages to every other worker and answers
+             requests (ingest, statistics, ...) itself. When the hub goes
+             away the followers run the election again: the lock of a dead
+             writer is free, and the worker that takes it is promoted
+             (the "promoted" handler opens the database for writing and
+             starts the hub), the rest reconnect to it.
+
+Frames are a 4-byte big-endian length followed by a JSON object:
+  {"c": channel, "w": worker, "m": message}               published event
+  {"c": channel, "w": worker, "m": message, "q": id}      request to the writer
+  {"r": id, "m": result} / {"r": id, "e": error}          reply
+"""
+
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import struct
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024 * 1024
+
+Handler = Callable[[object], Awaitable[object]]
+
+
+class BrokerError(Exception):
+    """A request to the writer failed or could not be delivered"""
+
+
+class Broker:
+    """In-process broker (single worker): no peers, requests handled locally"""
+    
+    name = "inprocess"
+    
+    def __init__(self):
+        self.worker_id = str(os.getpid())
+        self.is_writer = True
+        self.handlers: Dict[str, Handler] = {}
+        
+        # Statistics
+        self.stats = {
+            "published": 0,
+            "received": 0,
+            "requests": 0,
+            "request_errors": 0
+        }
+    
+    def on(self, channel: str, handler: Handler):
+        """Register the async handler for a channel (events from other workers, or requests)"""
+        self.handlers[channel] = handler
+    
+    def elect(self):
+        """Decide whether this worker is the SQLite writer"""
+        self.is_writer = True
+    
+    async def start(self):
+        pass
+    
+    async def stop(self):
+        pass
+    
+    async def publish(self, channel: str, message):
+        """Send an event to every other worker"""
+        self.stats["published"] += 1
+    
+    async def request(self, channel: str, message=None):
+        """Run a request on the writer and return its result"""
+        self.stats["requests"] += 1
+        return await self.handlers[channel](message)
+    
+    async def dispatch(self, channel: str, message):
+        handler = self.handlers.get(channel)
+        if handler is None:
+            return
+        self.stats["received"] += 1
+        try:
+            await handler(message)
+        except Exception as e:
+            logger.error(f"Broker handler for {channel} failed: {e}")
+    
+    def describe(self) -> dict:
+        """Broker role and counters for /api/status"""
+        return {
+            "backend": self.name,
+            "worker": self.worker_id,
+            "writer": self.is_writer,
+            **self.stats
+        }
+
+
+class Peer:
+    """One connected worker, as seen from the hub"""
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.worker_id: Optional[str] = None
+
+
+class UnixSocketBroker(Broker):
+    """Hub-and-spoke bus over a Unix domain socket; the hub is the SQLite writer"""
+    
+    name = "unix"
+    
+    def __init__(self, socket_path: str, lock_path: str, timeout: float):
+        super().__init__()
+        self.socket_path = socket_path
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.lock_file = None
+        
+        # Hub side
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.peers: Set[Peer] = set()
+        self.answers: Set[asyncio.Task] = set()  # requests being answered, referenced until done
+        
+        # Worker side
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count(1)
+        self.stopping = False
+        self.hub_worker: Optional[str] = None
+        
+        self.stats["reconnects"] = 0
+        self.stats["promotions"] = 0
+    
+    def elect(self):
+        """The worker holding the lock file is the writer (lock released when the process exits)"""
+        self.lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.is_writer = True
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            self.is_writer = False
+        logger.info(f"Worker {self.worker_id} is the {'writer' if self.is_writer else 'follower'}")
+    
+    async def start(self):
+        """Writer: open the hub (call once the database is ready). Others: connect to it"""
+        self.stopping = False
+        if self.is_writer:
+            # Holding the lock means any existing socket file is stale
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.server = await asyncio.start_unix_server(self._serve_peer, path=self.socket_path)
+            logger.info(f"Broker hub listening on {self.socket_path}")
+        else:
+            await self._connect(self.timeout)
+            self.reader_task = asyncio.create_task(self._read_hub())
+    
+    async def stop(self):
+        self.stopping = True
+        if self.server:
+            self.server.close()
+            for task in list(self.answers):
+                task.cancel()
+            for peer in list(self.peers):
+                peer.writer.close()
+            await self.server.wait_closed()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self.reader_task:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+    
+    # ------------------------------------------------------------
+    # Framing
+    # ------------------------------------------------------------
+    
+    @staticmethod
+    def _encode(frame: dict) -> bytes:
+        data = json.dumps(frame, separators=(",", ":")).encode()
+        return HEADER.pack(len(data)) + data
+    
+    @staticmethod
+    async def _read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+        try:
+            header = await reader.readexactly(HEADER.size)
+            (length,) = HEADER.unpack(header)
+            if length > MAX_FRAME:
+                raise BrokerError(f"Frame of {length} bytes exceeds the limit")
+            return await reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+    
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(data)
+        await writer.drain()
+    
+    # ------------------------------------------------------------
+    # Hub (writer worker)
+    # ------------------------------------------------------------
+    
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = Peer(reader, writer)
+        self.peers.add(peer)
+        try:
+            # Lets the worker tell other workers' dashboards if this one dies
+            await self._write(writer, self._encode({"c": "hello", "w": self.worker_id, "m": None}))
+            while True:
+                data = await self._read_frame(reader)
+                if data is None:
+                    break
+                frame = json.loads(data)
+                peer.worker_id = frame.get("w", peer.worker_id)
+                if "q" in frame:
+                    task = asyncio.create_task(self._answer(peer, frame))
+                    self.answers.add(task)
+                    task.add_done_callback(self.answers.discard)
+                    continue
+                
+                # Relay the original bytes to the other workers, then handle here
+                await self._relay(HEADER.pack(len(data)) + data, exclude=peer)
+                await self.dispatch(frame["c"], frame["m"])
+        except Exception as e:
+            logger.error(f"Broker peer {peer.worker_id} failed: {e}")
+        finally:
+            self.peers.discard(peer)
+            writer.close()
+            if peer.worker_id and not self.stopping:
+                logger.warning(f"Worker {peer.worker_id} left the broker")
+                event = {"worker": peer.worker_id}
+                await self._relay(self._encode({"c": "worker_left", "w": self.worker_id, "m": event}))
+                await self.dispatch("worker_left", event)
+    
+    async def _answer(self, peer: Peer, frame: dict):
+        self.stats["requests"] += 1
+        try:
+            result = await self.handlers[frame["c"]](frame["m"])
+            reply = {"r": frame["q"], "m": result}
+        except Exception as e:
+            self.stats["request_errors"] += 1
+            reply = {"r": frame["q"], "e": str(e) or type(e).__name__}
+        try:
+            await self._write(peer.writer, self._encode(reply))
+        except Exception as e:
+            logger.error(f"Error replying to worker {peer.worker_id}: {e}")
+    
+    async def _relay(self, data: bytes, exclude: Optional[Peer] = None):
+        for peer in list(self.peers):
+            if peer is exclude:
+                continue
+            try:
+                await self._write(peer.writer, data)
+            except Exception as e:
+                logger.error(f"Error relaying to worker {peer.worker_id}: {e}")
+    
+    # ------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------
+    
+    async def _connect(self, timeout: float):
+        """Connect to the hub, retrying until it is up (the writer opens it after initializing)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise BrokerError(f"No broker hub at {self.socket_path}")
+                await asyncio.sleep(0.1)
+        await self._write(self.writer, self._encode({"c": "hello", "w": self.worker_id, "m": None}))
+        logger.info(f"Worker {self.worker_id} connected to broker hub")
+    
+    async def _read_hub(self):
+        while True:
+            data = await self._read_frame(self.reader)
+            if data is None:
+                if self.stopping:
+                    return
+                logger.error("Lost connection to broker hub")
+                self.writer = None
+                self._fail_pending(BrokerError("Broker hub connection lost"))
+                if self.hub_worker:
+                    await self.dispatch("worker_left", {"worker": self.hub_worker})
+                    self.hub_worker = None
+                if await self._take_over():
+                    return
+                try:
+                    await self._connect(self.timeout)
+                    self.stats["reconnects"] += 1
+                except BrokerError as e:
+                    logger.error(str(e))
+                continue
+            
+            frame = json.loads(data)
+            if frame.get("c") == "hello" and self.hub_worker is None:
+                self.hub_worker = frame["w"]
+            if "r" in frame:
+                future = self.pending.pop(frame["r"], None)
+                if future is not None and not future.done():
+                    if "e" in frame:
+                        future.set_exception(BrokerError(frame["e"]))
+                    else:
+                        future.set_result(frame.get("m"))
+                continue
+            await self.dispatch(frame["c"], frame["m"])
+    
+    async def _take_over(self) -> bool:
+        """Run the election again; a dead writer's lock is free and the winner is promoted"""
+        self.elect()
+        if not self.is_writer:
+            return False
+        self.stats["promotions"] += 1
+        logger.warning(f"Worker {self.worker_id} takes over as the writer")
+        await self.dispatch("promoted", None)
+        return True
+    
+    def _fail_pending(self, error: Exception):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+    
+    # ------------------------------------------------------------
+    # Broker interface
+    # ------------------------------------------------------------
+    
+    async def publish(self, channel: str, message):
+        self.stats["published"] += 1
+        data = self._encode({"c": channel, "w": self.worker_id, "m": message})
+        if self.is_writer:
+            await self._relay(data)
+            return
+        if self.writer is None:
+            return
+        try:
+            await self._write(self.writer, data)
+        except Exception as e:
+            logger.error(f"Error publishing {channel}: {e}")
+    
+    async def request(self, channel: str, message=None):
+        if self.is_writer:
+            return await super().request(channel, message)
+        if self.writer is None:
+            raise BrokerError("Not connected to the broker hub")
+        
+        self.stats["requests"] += 1
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await self._write(self.writer, self._encode({"c": channel, "w": self.worker_id, "m": message, "q": request_id}))
+            return await asyncio.wait_for(future, self.timeout)
+        except Exception:
+            self.stats["request_errors"] += 1
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+    
+    def describe(self) -> dict:
+        description = super().describe()
+        description["socket"] = self.socket_path
+        if self.is_writer:
+            description["peers"] = sorted(peer.worker_id or "?" for peer in self.peers)
+        else:
+            description["connected"] = self.writer is not None
+        return description
+
+
+BACKENDS = ("inprocess", "unix")
+
+
+def get_broker(name: str, workers: int, socket_path: str, lock_path: str, timeout: float) -> Broker:
+    """Broker backend by name ("auto": unix with more than one worker)"""
+    if name == "auto":
+        name = "unix" if workers > 1 else "inprocess"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown broker backend: {name} (expected {', '.join(BACKENDS)})")
+    if name == "unix":
+        return UnixSocketBroker(socket_path, lock_path, timeout)
+    return Broker()
@@ -13,16 +13,130 @@ class Config:
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", 8000))
     DEBUG = os.getenv("DEBUG", "True").lower() == "true"
+    WORKERS = int(os.getenv("WORKERS", 1))  # uvicorn worker processes
+    
+    # Broker between workers: "inprocess", "unix" (Unix domain socket hub
+    # hosted by the SQLite writer worker) or "auto" (unix when WORKERS > 1)
+    BROKER = os.getenv("BROKER", "auto")
+    BROKER_SOCKET = os.getenv("BROKER_SOCKET", "farmtech_broker.sock")
+    BROKER_TIMEOUT = float(os.getenv("BROKER_TIMEOUT", 30))  # seconds, requests to the writer and hub connect
+    BROKER_STATS_INTERVAL = float(os.getenv("BROKER_STATS_INTERVAL", 5))  # seconds between worker stats
     
     # Database settings
     DATABASE_PATH = os.getenv("DATABASE_PATH", "farmtech_data.db")
     
+    # Sensor table layout: "legacy" (sensor_data) or "compact" (sensor_readings,
+    # integer device keys + epoch ms, WITHOUT ROWID). Convert with migrate_storage.py
+    STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "legacy")
+    
+    # SQLite tuning (WAL mode, one writer connection + read-only pool)
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # durable per WAL checkpoint
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 65536))  # per connection
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # bytes
+    SQLITE_PAGE_SIZE = int(os.getenv("SQLITE_PAGE_SIZE", 4096))  # only applies to new databases
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", 4))  # read-only connections
+    READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", 5.0))  # seconds per query, incl. pool wait
+    READ_FETCH_SIZE = int(os.getenv("READ_FETCH_SIZE", 256))  # rows per fetch when streaming a cursor
+    HISTORY_MAX_PAGE = int(os.getenv("HISTORY_MAX_PAGE", 1000))  # rows per history/recent page
+    EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", 5000))  # rows per export read
+    EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))  # simultaneous /api/export streams
+    
+    # Hot cache: latest readings per device kept in memory (ring buffer capacity)
+    HOT_CACHE_SIZE = int(os.getenv("HOT_CACHE_SIZE", 256))  # readings per device
+    
+    # Read cache: encoded JSON of snapshot reads (devices, recent, statistics, dashboard
+    # initial data), one load shared by concurrent callers, invalidated by ingest
+    READ_CACHE_ENABLED = os.getenv("READ_CACHE_ENABLED", "True").lower() == "true"
+    READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", 2.0))  # seconds an entry may be served
+    READ_CACHE_MAX_BYTES = int(os.getenv("READ_CACHE_MAX_BYTES", 8 * 1024 * 1024))  # encoded bytes kept (LRU)
+    READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", 256))
+    
+    # Ingest write pipeline (group commit)
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 500))  # rows per transaction
+    WRITE_BATCH_INTERVAL = float(os.getenv("WRITE_BATCH_INTERVAL", 0.2))  # seconds
+    WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", 10000))  # pending rows
+    
+    # ESP32 ingest pipeline: per-device parse stage, acks, durability notices, backpressure
+    PIPELINE_DEVICE_QUEUE = int(os.getenv("PIPELINE_DEVICE_QUEUE", 64))  # received messages awaiting parse, per device
+    PIPELINE_PUBLISH_QUEUE = int(os.getenv("PIPELINE_PUBLISH_QUEUE", 10000))  # messages awaiting dashboard fan-out
+    PIPELINE_MAX_INFLIGHT = int(os.getenv("PIPELINE_MAX_INFLIGHT", 32))  # acked, not yet durable messages per device before slow_down
+    PIPELINE_SLOW_DOWN_FILL = float(os.getenv("PIPELINE_SLOW_DOWN_FILL", 0.5))  # write queue fill that triggers slow_down
+    PIPELINE_RESUME_FILL = float(os.getenv("PIPELINE_RESUME_FILL", 0.2))  # write queue fill below which devices resume
+    
+    # Device registry: how often in-memory last_seen is written back
+    DEVICE_FLUSH_INTERVAL = float(os.getenv("DEVICE_FLUSH_INTERVAL", 10))  # seconds
+    
+    # Statistics engine: how often counters are snapshotted (the journal since is replayed after a crash)
+    STATS_PERSIST_INTERVAL = float(os.getenv("STATS_PERSIST_INTERVAL", 60))  # seconds
+    
+    # Server-side alerts: static thresholds (sensor-config.js), z-score, battery drop rate
+    ALERTS_ENABLED = os.getenv("ALERTS_ENABLED", "True").lower() == "true"
+    ALERT_Z_THRESHOLD = float(os.getenv("ALERT_Z_THRESHOLD", 4.0))  # standard deviations
+    ALERT_Z_ALPHA = float(os.getenv("ALERT_Z_ALPHA", 0.02))  # EWMA weight per reading
+    ALERT_Z_MIN_SAMPLES = int(os.getenv("ALERT_Z_MIN_SAMPLES", 60))  # readings before z-scores are used
+    ALERT_BATTERY_DROP = float(os.getenv("ALERT_BATTERY_DROP", 20))  # mV per minute
+    ALERT_RATE_WINDOW = float(os.getenv("ALERT_RATE_WINDOW", 300))  # seconds between battery samples compared
+    ALERT_COOLDOWN = float(os.getenv("ALERT_COOLDOWN", 600))  # seconds between alerts per device/field/kind
+    
+    # GPS: latest-position grid, track R*Tree, geofences evaluated on ingest
+    GEO_ENABLED = os.getenv("GEO_ENABLED", "True").lower() == "true"
+    GEO_GRID_CELL = float(os.getenv("GEO_GRID_CELL", 0.01))  # degrees per grid cell (~1.1 km)
+    TRACK_SEGMENT_SECONDS = float(os.getenv("TRACK_SEGMENT_SECONDS", 600))  # time span of one track box per device
+    GEOFENCE_MAX_VERTICES = int(os.getenv("GEOFENCE_MAX_VERTICES", 1000))
+    GEO_MAX_RADIUS_M = float(os.getenv("GEO_MAX_RADIUS_M", 50000))  # radius query limit
+    GEO_MAX_POINTS = int(os.getenv("GEO_MAX_POINTS", 10000))  # track points per response
+    
+    # IMU activity: sliding windows of imu_x/y/z per device, scored once per hop
+    ACTIVITY_ENABLED = os.getenv("ACTIVITY_ENABLED", "True").lower() == "true"
+    ACTIVITY_WINDOW = float(os.getenv("ACTIVITY_WINDOW", 60))  # seconds per window
+    ACTIVITY_HOP = float(os.getenv("ACTIVITY_HOP", 30))  # seconds between window ends (overlap when < window)
+    ACTIVITY_BUFFER = int(os.getenv("ACTIVITY_BUFFER", 128))  # samples kept per device (>= window x sample rate)
+    ACTIVITY_LAG = float(os.getenv("ACTIVITY_LAG", 5))  # seconds a window waits for late readings
+    ACTIVITY_MIN_SAMPLES = int(os.getenv("ACTIVITY_MIN_SAMPLES", 10))  # samples for a window to be scored
+    ACTIVITY_CHUNK = int(os.getenv("ACTIVITY_CHUNK", 2000))  # devices scored per event loop slice
+    ACTIVITY_REST_SMA = float(os.getenv("ACTIVITY_REST_SMA", 0.3))  # m/s², below: resting
+    ACTIVITY_WALK_SMA = float(os.getenv("ACTIVITY_WALK_SMA", 1.5))  # m/s², at or above: walking
+    ACTIVITY_STEP_THRESHOLD = float(os.getenv("ACTIVITY_STEP_THRESHOLD", 1.0))  # m/s² above mean |a| per step
+    
+    # Metrics & profiling
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"  # GET /metrics
+    # The profiler endpoints are unauthenticated: set PROFILER_ENABLED=true only while profiling a worker
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "False").lower() == "true"  # allow /api/profiler/start
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))  # default sampling interval
+    PROFILER_MAX_DURATION = float(os.getenv("PROFILER_MAX_DURATION", 300))  # seconds per profiling run
+    
     # WebSocket settings
-    WS_HEARTBEAT_INTERVAL = 30  # seconds
-    WS_TIMEOUT = 60  # seconds
+    WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 30))  # seconds of silence before a device is pinged
+    WS_TIMEOUT = float(os.getenv("WS_TIMEOUT", 60))  # seconds of silence before its socket is closed
+    LIVENESS_TICK = float(os.getenv("LIVENESS_TICK", 1.0))  # timer wheel resolution, seconds
+    
+    # Dashboard fan-out: per-connection outbound queue and slow consumer policy
+    # Policies: "drop_oldest", "coalesce" (latest reading per device), "disconnect"
+    DASHBOARD_QUEUE_SIZE = int(os.getenv("DASHBOARD_QUEUE_SIZE", 256))  # messages
+    DASHBOARD_SLOW_POLICY = os.getenv("DASHBOARD_SLOW_POLICY", "drop_oldest")
+    DASHBOARD_MAX_LAG = float(os.getenv("DASHBOARD_MAX_LAG", 10))  # seconds, "disconnect" policy
+    
+    # Dashboard stream mode (opt-in): throttled, delta-encoded sensor frames
+    STREAM_INTERVAL_MS = int(os.getenv("STREAM_INTERVAL_MS", 250))  # default frame interval
+    STREAM_MIN_INTERVAL_MS = int(os.getenv("STREAM_MIN_INTERVAL_MS", 50))  # floor for per-connection intervals
+    STREAM_KEYFRAME_EVERY = int(os.getenv("STREAM_KEYFRAME_EVERY", 40))  # frames between full keyframes
+    STREAM_MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", 100))  # readings per device per frame, keep="all"
+    WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "True").lower() == "true"
+    
+    # HTTP batch / NDJSON ingest
+    INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", 10000))  # records per /api/data/batch
+    INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", 65536))  # per NDJSON line
+    INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", 100))  # rejected records listed per response
+    INGEST_MAX_FUTURE_SKEW = float(os.getenv("INGEST_MAX_FUTURE_SKEW", 300))  # seconds ahead of server clock
+    INGEST_MAX_PAST_AGE = float(os.getenv("INGEST_MAX_PAST_AGE", 7 * 24 * 3600))  # seconds behind
     
     # Data retention
-    DATA_RETENTION_DAYS = int(os.getenv("DATA_RETENTION_DAYS", 30))
+    DATA_RETENTION_DAYS = int(os.getenv("DATA_RETENTION_DAYS", 30))  # 0 disables the purge
+    RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))  # seconds between purge runs
+    RETENTION_CHUNK = int(os.getenv("RETENTION_CHUNK", 2000))  # rows per delete transaction
+    RETENTION_PAUSE = float(os.getenv("RETENTION_PAUSE", 0.05))  # seconds to yield between chunks
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")  # compressed per-device, per-day files
     
     # Logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -6,53 +6,512 @@ Supports both SQLite (development) and PostgreSQL (production)
 import asyncio
 import aiosqlite
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import math
+import time
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Iterable, Tuple
 import logging
 
 from config import Config
+from sensor_schema import SENSOR_FIELDS
+import rollups
+from storage import from_epoch_ms, get_storage, to_epoch_ms
+from stats_engine import StatisticsEngine, count_days
+from archive import ColdArchive
+from retention import RetentionManager
+from history import HistoryQuery
+from export import ExportService
+from hot_cache import HotCache
+from read_cache import INGEST_TAGS
+import activity
+import alerts
+import geo
+from broker import Broker
+import metrics
 
 logger = logging. getLogger(__name__)
 
+class BatchWriter:
+    """
+    Background writer that group-commits sensor readings.
+    Rows from all connections are collected from a bounded queue and written
+    in one transaction when the batch is full or the batch interval elapses.
+    """
+    
+    def __init__(self, database, batch_size: int, flush_interval: float, queue_size: int):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        
+        # Statistics
+        self.stats = {
+            "batches_written": 0,
+            "rows_written": 0,
+            "duplicates": 0,
+            "failed_batches": 0,
+            "last_batch_size": 0,
+            "last_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+            "max_commit_ms": 0.0
+        }
+    
+    def start(self):
+        """Start the writer task"""
+        if self.task is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush pending rows and stop the writer task"""
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+    
+    async def submit(self, row: tuple, wait: bool = False) -> Optional[bool]:
+        """
+        Queue a row for writing. Blocks while the queue is full.
+        With wait=True, return once the row's batch has been committed:
+        True if the row was stored, False if it duplicated a stored reading.
+        """
+        future = asyncio.get_running_loop().create_future() if wait else None
+        await self.queue.put((row, future))
+        if future is not None:
+            return await future
+        return None
+    
+    async def submit_many(self, rows: List[tuple], wait: bool = False) -> Optional[int]:
+        """Queue several rows; with wait=True, return the number stored once all are committed"""
+        if not wait:
+            for row in rows:
+                await self.queue.put((row, None))
+            return None
+        return await (await self.enqueue(rows))
+    
+    async def enqueue(self, rows: List[tuple]) -> asyncio.Future:
+        """
+        Queue rows (blocking while the queue is full) and return a future
+        that resolves to the number stored once all of them are committed,
+        without waiting for it.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            future = loop.create_future()
+            futures.append(future)
+            await self.queue.put((row, future))
+        return asyncio.ensure_future(self._count_stored(futures))
+    
+    @staticmethod
+    async def _count_stored(futures: List[asyncio.Future]) -> int:
+        return sum(await asyncio.gather(*futures))
+    
+    async def _run(self):
+        """Collect queued rows into batches and write them"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            
+            while len(batch) < self.batch_size:
+                # Drain whatever is already queued before waiting
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[tuple]):
+        """Write one batch and resolve its waiters"""
+        rows = [row for row, _ in batch]
+        started = time.perf_counter()
+        
+        try:
+            stored = await self.database.write_batch(rows)
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(rows)} rows: {e}")
+            self.stats["failed_batches"] += 1
+            metrics.DB_FAILED_BATCHES.inc()
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.stats["batches_written"] += 1
+        self.stats["rows_written"] += len(stored)
+        self.stats["duplicates"] += len(rows) - len(stored)
+        self.stats["last_batch_size"] = len(rows)
+        elapsed = time.perf_counter() - started
+        metrics.DB_COMMIT_SECONDS.observe(elapsed)
+        metrics.DB_BATCH_ROWS.observe(len(rows))
+        commit_ms = round(elapsed * 1000, 3)
+        self.stats["last_commit_ms"] = commit_ms
+        self.stats["total_commit_ms"] = round(self.stats["total_commit_ms"] + commit_ms, 3)
+        self.stats["max_commit_ms"] = max(self.stats["max_commit_ms"], commit_ms)
+        
+        # Waiters learn whether their row was stored or was a duplicate
+        kept = set(stored) if len(stored) < len(rows) else None
+        for index, (_, future) in enumerate(batch):
+            if future is not None and not future.done():
+                future.set_result(kept is None or index in kept)
+
+
+class DeviceRegistry:
+    """
+    In-memory copy of the devices table.
+    SQL is only needed when a new device_id appears; last_seen/updated_at are
+    kept here and written back in bulk by Database.flush_devices().
+    """
+    
+    def __init__(self):
+        self.devices: Dict[str, Dict] = {}
+        self.dirty: set = set()
+    
+    def load(self, rows: Iterable) -> None:
+        """Replace cache contents with rows from the devices table"""
+        self.devices = {row['device_id']: dict(row) for row in rows}
+        self.dirty.clear()
+    
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self.devices
+    
+    def __len__(self) -> int:
+        return len(self.devices)
+    
+    def key(self, device_id: str) -> Optional[int]:
+        """Interned integer key (devices.id) of a device"""
+        device = self.devices.get(device_id)
+        return device['id'] if device else None
+    
+    def unknown(self, device_ids: Iterable[str]) -> List[str]:
+        """Return device ids that are not registered yet"""
+        return [device_id for device_id in device_ids if device_id not in self.devices]
+    
+    def touch(self, device_id: str, timestamp: str) -> None:
+        """Record that a device was seen at timestamp"""
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        if not device.get('last_seen') or timestamp > device['last_seen']:
+            device['last_seen'] = timestamp
+        device['updated_at'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self.dirty.add(device_id)
+    
+    def take_dirty(self) -> List[tuple]:
+        """Return (last_seen, updated_at, device_id) for changed devices and reset"""
+        updates = [
+            (self.devices[device_id]['last_seen'], self.devices[device_id]['updated_at'], device_id)
+            for device_id in self.dirty
+        ]
+        self.dirty.clear()
+        return updates
+    
+    def snapshot(self) -> List[Dict]:
+        """All devices ordered by device_id"""
+        return [dict(self.devices[device_id]) for device_id in sorted(self.devices)]
+
+
+class ReaderPool:
+    """
+    Pool of read-only SQLite connections.
+    In WAL mode readers never block the writer (or each other), so history
+    queries and snapshots run beside ingest instead of queueing on its lock.
+    """
+    
+    def __init__(self, db_path: str, size: int, timeout: float):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.connections: List[aiosqlite.Connection] = []
+        self.idle: Optional[asyncio.Queue] = None
+        
+        # Metrics
+        self.stats = {
+            "queries": 0,
+            "waits": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0
+        }
+    
+    async def open(self):
+        """Open the read-only connections"""
+        self.idle = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            conn.row_factory = aiosqlite.Row
+            await conn.execute(f"PRAGMA cache_size = -{Config.SQLITE_CACHE_SIZE_KB}")
+            await conn.execute(f"PRAGMA mmap_size = {Config.SQLITE_MMAP_SIZE}")
+            await conn.execute(f"PRAGMA busy_timeout = {Config.SQLITE_BUSY_TIMEOUT_MS}")
+            self.connections.append(conn)
+            self.idle.put_nowait(conn)
+        logger.info(f"Read pool opened: {self.size} connections")
+    
+    async def close(self):
+        """Close all connections"""
+        for conn in self.connections:
+            await conn.close()
+        self.connections = []
+    
+    @asynccontextmanager
+    async def reader(self):
+        """Check out a connection, waiting at most the pool timeout"""
+        started = time.perf_counter()
+        if self.idle.empty():
+            self.stats["waits"] += 1
+        try:
+            conn = await asyncio.wait_for(self.idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        
+        wait_ms = (time.perf_counter() - started) * 1000
+        self.stats["wait_ms_total"] = round(self.stats["wait_ms_total"] + wait_ms, 3)
+        self.stats["wait_ms_max"] = round(max(self.stats["wait_ms_max"], wait_ms), 3)
+        try:
+            yield conn
+        finally:
+            self.idle.put_nowait(conn)
+    
+    async def fetchall(self, sql: str, args=()) -> List[aiosqlite.Row]:
+        """Run a read query on a pooled connection with the per-query timeout"""
+        async with self.reader() as conn:
+            self.stats["queries"] += 1
+            try:
+                return await asyncio.wait_for(conn.execute_fetchall(sql, args), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                await conn.interrupt()
+                raise
+    
+    async def stream(self, sql: str, args=(), fetch_size: int = 256):
+        """
+        Yield rows from a pooled connection in fetch_size chunks instead of
+        materialising the whole result; the connection is held until the
+        generator finishes.
+        """
+        async with self.reader() as conn:
+            self.stats["queries"] += 1
+            async with conn.execute(sql, args) as cursor:
+                while True:
+                    try:
+                        rows = await asyncio.wait_for(cursor.fetchmany(fetch_size), self.timeout)
+                    except asyncio.TimeoutError:
+                        self.stats["timeouts"] += 1
+                        await conn.interrupt()
+                        raise
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+    
+    def describe(self) -> dict:
+        """Pool metrics for /api/status"""
+        return {
+            "size": self.size,
+            "idle": self.idle.qsize() if self.idle else 0,
+            **self.stats
+        }
+
 
 class Database:
     """Async database handler"""
     
-    def __init__(self):
+    def __init__(self, broker: Optional[Broker] = None):
         self.db_path = Config.DATABASE_PATH
         self.db = None
+        
+        # With several workers only the broker-elected writer opens the
+        # write connection; the others forward writes to it
+        self.broker = broker or Broker()
+        self.storage = get_storage(Config.STORAGE_LAYOUT)
+        self.readers = ReaderPool(self.db_path, Config.READ_POOL_SIZE, Config.READ_TIMEOUT)
+        self.devices = DeviceRegistry()
+        self.statistics = StatisticsEngine()
+        self.archive = ColdArchive(Config.ARCHIVE_DIR, self.storage.timespec)
+        self.retention = RetentionManager(
+            self,
+            self.archive,
+            retention_days=Config.DATA_RETENTION_DAYS,
+            chunk_size=Config.RETENTION_CHUNK,
+            pause=Config.RETENTION_PAUSE
+        )
+        self.exports = ExportService(self, Config.EXPORT_MAX_CONCURRENT, Config.EXPORT_CHUNK)
+        self.hot_cache = HotCache(Config.HOT_CACHE_SIZE)
+        self.alerts = alerts.AlertDetector(
+            z_threshold=Config.ALERT_Z_THRESHOLD,
+            alpha=Config.ALERT_Z_ALPHA,
+            min_samples=Config.ALERT_Z_MIN_SAMPLES,
+            max_drop_per_min=Config.ALERT_BATTERY_DROP,
+            rate_window=Config.ALERT_RATE_WINDOW,
+            cooldown=Config.ALERT_COOLDOWN
+        )
+        self.geo = geo.GeoIndex(cell=Config.GEO_GRID_CELL, segment_seconds=Config.TRACK_SEGMENT_SECONDS)
+        self.activity = activity.ActivityTracker(
+            window=Config.ACTIVITY_WINDOW,
+            hop=Config.ACTIVITY_HOP,
+            buffer=Config.ACTIVITY_BUFFER,
+            lag=Config.ACTIVITY_LAG,
+            min_samples=Config.ACTIVITY_MIN_SAMPLES,
+            rest_sma=Config.ACTIVITY_REST_SMA,
+            walk_sma=Config.ACTIVITY_WALK_SMA,
+            step_threshold=Config.ACTIVITY_STEP_THRESHOLD
+        )
+        self.activity_task: Optional[asyncio.Task] = None
+        
+        # Alerts/segments of committed batches whose own write failed (see _store_observed)
+        self.unsaved_alerts: List[dict] = []
+        self.unsaved_segments: List[tuple] = []
+        self.write_lock = asyncio.Lock()
+        self.device_flush_task: Optional[asyncio.Task] = None
+        self.stats_persist_task: Optional[asyncio.Task] = None
+        self.writer = BatchWriter(
+            self,
+            batch_size=Config.WRITE_BATCH_SIZE,
+            flush_interval=Config.WRITE_BATCH_INTERVAL,
+            queue_size=Config.WRITE_QUEUE_SIZE
+        )
     
     async def initialize(self):
         """Initialize database and create tables"""
+        self.broker.elect()
+        if not self.broker.is_writer:
+            await self.initialize_follower()
+            return
+        await self.initialize_writer()
+    
+    async def initialize_writer(self):
+        """Open the write connection, load state and start the writer and the broker hub"""
         self.db = await aiosqlite.connect(self.db_path)
         self.db.row_factory = aiosqlite.Row
+        await self.configure_writer()
         
         await self.create_tables()
-        logger.info(f"Database initialized:  {self.db_path}")
+        
+        cursor = await self.db.execute("SELECT * FROM devices")
+        self.devices.load(await cursor.fetchall())
+        
+        # Databases created before rollups existed: backfill once
+        cursor = await self.db.execute(f"""
+            SELECT EXISTS(SELECT 1 FROM {self.storage.table}) AS has_data,
+                   EXISTS(SELECT 1 FROM rollup_1d) AS has_rollups
+        """)
+        row = await cursor.fetchone()
+        if row['has_data'] and not row['has_rollups']:
+            await self.rebuild_rollups()
+        
+        if self.storage.name != "legacy":
+            cursor = await self.db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sensor_data'"
+            )
+            if await cursor.fetchone():
+                logger.warning("Legacy sensor_data table still present; run migrate_storage.py to copy remaining rows")
+        
+        await self.statistics.seed(self.db)
+        await self.db.commit()
+        logger.info(f"Device registry loaded: {len(self.devices)} devices")
+        
+        await self.warm_hot_cache()
+        self.geo.load(
+            fences=await geo.load_geofences(self.db),
+            positions=[row for device_id in self.devices.devices for row in self.hot_cache.device_data(device_id, 1)],
+            next_id=await geo.next_track_id(self.db)
+        )
+        self.activity.append([
+            (row['device_id'], row['timestamp']) + tuple(row.get(field) for field in SENSOR_FIELDS)
+            for device_id in self.devices.devices
+            for row in self.hot_cache.device_data(device_id, Config.ACTIVITY_BUFFER)
+        ])
+        if not self.readers.connections:
+            await self.readers.open()
+        
+        self.writer.start()
+        self.device_flush_task = asyncio.create_task(self._device_flush_loop())
+        self.stats_persist_task = asyncio.create_task(self._stats_persist_loop())
+        if Config.ACTIVITY_ENABLED:
+            self.activity_task = asyncio.create_task(self._activity_loop())
+        self.retention.start(Config.RETENTION_INTERVAL)
+        
+        # Requests forwarded by other workers
+        self.broker.on("ingest", self._ingest_rows)
+        self.broker.on("statistics", lambda message: self.get_statistics())
+        self.broker.on("devices.list", lambda message: self.get_all_devices())
+        self.broker.on("window", lambda message: self.get_device_window(**message))
+        self.broker.on("groups.set", lambda message: self.set_device_group(**message))
+        self.broker.on("groups.delete", lambda message: self.delete_device_group(**message))
+        self.broker.on("rollups.rebuild", lambda message: self.rebuild_rollups(**message))
+        self.broker.on("geo.box", lambda message: self.get_devices_in_box(**message))
+        self.broker.on("geo.near", lambda message: self.get_devices_near(**message))
+        self.broker.on("geofences.list", lambda message: self.get_geofences())
+        self.broker.on("geofences.members", lambda message: self.get_geofence_members(**message))
+        self.broker.on("geofences.set", lambda message: self.set_geofence(**message))
+        self.broker.on("geofences.delete", lambda message: self.delete_geofence(**message))
+        await self.broker.start()
+        logger.info(f"Database initialized:  {self.db_path} ({self.storage.name} layout)")
+    
+    async def initialize_follower(self):
+        """Another worker is the writer: read connections only, writes go through the broker"""
+        self.broker.on("devices.new", self._on_new_devices)
+        self.broker.on("promoted", lambda message: self._promote())
+        await self.broker.start()  # returns once the writer has initialized the database
+        await self.readers.open()
+        self.devices.load(await self.readers.fetchall("SELECT * FROM devices"))
+        logger.info(f"Database initialized as follower: {self.db_path} ({self.storage.name} layout)")
+    
+    async def _promote(self):
+        """The writer died and this worker won the new election"""
+        await self.initialize_writer()
+        logger.warning(f"Worker {self.broker.worker_id} promoted to writer")
+    
+    async def _ingest_rows(self, message: dict) -> int:
+        rows = [tuple(row) for row in message["rows"]]
+        stored = await self.writer.submit_many(rows, wait=message["wait"])
+        return len(rows) if stored is None else stored
+    
+    async def _on_new_devices(self, devices: List[Dict]):
+        for device in devices:
+            self.devices.devices[device["device_id"]] = device
+    
+    async def configure_writer(self):
+        """WAL mode and tuning for the single writer connection"""
+        await self.db.execute(f"PRAGMA page_size = {Config.SQLITE_PAGE_SIZE}")
+        cursor = await self.db.execute("PRAGMA journal_mode = WAL")
+        journal_mode = (await cursor.fetchone())[0]
+        await self.db.execute(f"PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS}")
+        await self.db.execute(f"PRAGMA cache_size = -{Config.SQLITE_CACHE_SIZE_KB}")
+        await self.db.execute(f"PRAGMA mmap_size = {Config.SQLITE_MMAP_SIZE}")
+        await self.db.execute(f"PRAGMA busy_timeout = {Config.SQLITE_BUSY_TIMEOUT_MS}")
+        await self.db.execute("PRAGMA temp_store = MEMORY")
+        logger.info(f"SQLite journal_mode={journal_mode}, synchronous={Config.SQLITE_SYNCHRONOUS}")
     
     async def create_tables(self):
         """Create necessary tables"""
         
-        # Sensor data table
-        await self.db.execute("""
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_id TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                imu_x INTEGER,
-                imu_y INTEGER,
-                imu_z INTEGER,
-                suhu_kaki INTEGER,
-                vbatt_kaki INTEGER,
-                suhu_leher INTEGER,
-                vbatt_leher INTEGER,
-                latitude INTEGER,
-                longitude INTEGER,
-                spo2 INTEGER,
-                heart_rate INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        # Sensor data table (layout-specific)
+        await self.storage.create_tables(self.db)
         
         # Device registry table
         await self.db. execute("""
@@ -68,175 +527,608 @@ class Database:
             )
         """)
         
-        # Create indexes for faster queries
+        # Named device groups for dashboard subscriptions
         await self.db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sensor_device_timestamp 
-            ON sensor_data(device_id, timestamp DESC)
+            CREATE TABLE IF NOT EXISTS device_groups (
+                name TEXT NOT NULL,
+                device_id TEXT NOT NULL,
+                PRIMARY KEY (name, device_id)
+            ) WITHOUT ROWID
         """)
         
-        await self.db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sensor_timestamp 
-            ON sensor_data(timestamp DESC)
-        """)
+        await rollups.create_tables(self.db)
+        await alerts.create_tables(self.db)
+        await geo.create_tables(self.db)
+        await activity.create_tables(self.db)
+        await self.statistics.create_tables(self.db)
+        await self.retention.create_tables(self.db)
         
         await self.db. commit()
         logger.info("Database tables created/verified")
     
-    async def save_sensor_data(self, data: dict):
-        """Save sensor data to database"""
-        try: 
-            device_id = data.get('device_id')
-            timestamp = data.get('timestamp', datetime.now().isoformat())
-            
-            # Register device if not exists
-            await self.register_device(device_id)
-            
-            # Insert sensor data
-            await self.db. execute("""
-                INSERT INTO sensor_data (
-                    device_id, timestamp, imu_x, imu_y, imu_z,
-                    suhu_kaki, vbatt_kaki, suhu_leher, vbatt_leher,
-                    latitude, longitude, spo2, heart_rate
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                device_id,
-                timestamp,
-                data.get('imu_x'),
-                data.get('imu_y'),
-                data.get('imu_z'),
-                data.get('suhu_kaki'),
-                data.get('vbatt_kaki'),
-                data.get('suhu_leher'),
-                data.get('vbatt_leher'),
-                data.get('latitude'),
-                data.get('longitude'),
-                data.get('spo2'),
-                data.get('heart_rate')
-            ))
-            
-            await self.db.commit()
-            
-            # Update device last seen
-            await self.update_device_last_seen(device_id, timestamp)
-            
-            logger.debug(f"Saved sensor data for device {device_id}")
-            
-        except Exception as e:
-            logger.error(f"Error saving sensor data: {e}")
-            raise
+    async def save_sensor_data(self, data: dict, wait: bool = False) -> Optional[bool]:
+        """
+        Queue sensor data for the background writer.
+        With wait=True, return only after the batch holding it is committed:
+        False if the device already has a reading at that timestamp.
+        """
+        device_id = data.get('device_id')
+        timestamp = data.get('timestamp') or datetime.now().isoformat()
+        row = (device_id, timestamp) + tuple(data.get(field) for field in SENSOR_FIELDS)
+        
+        if not self.broker.is_writer:
+            stored = await self.broker.request("ingest", {"rows": [row], "wait": wait})
+            return stored == 1 if wait else None
+        logger.debug(f"Queued sensor data for device {device_id}")
+        return await self.writer.submit(row, wait=wait)
+    
+    async def save_sensor_batch(self, readings: List[dict], wait: bool = False) -> Optional[int]:
+        """
+        Queue many validated readings (each with device_id and timestamp).
+        With wait=True, return the number stored (duplicates are not).
+        """
+        rows = [
+            (reading['device_id'], reading['timestamp']) + tuple(reading.get(field) for field in SENSOR_FIELDS)
+            for reading in readings
+        ]
+        if not self.broker.is_writer:
+            stored = await self.broker.request("ingest", {"rows": rows, "wait": wait})
+            return stored if wait else None
+        logger.debug(f"Queued {len(rows)} sensor readings")
+        return await self.writer.submit_many(rows, wait=wait)
+    
+    async def submit_readings(self, readings: List[dict]) -> asyncio.Future:
+        """
+        Queue validated readings and return a future for their commit (the
+        number stored), so the caller can ack now and report durability
+        later (ingest pipeline)
+        """
+        rows = [
+            (reading['device_id'], reading['timestamp']) + tuple(reading.get(field) for field in SENSOR_FIELDS)
+            for reading in readings
+        ]
+        if not self.broker.is_writer:
+            return asyncio.ensure_future(self.broker.request("ingest", {"rows": rows, "wait": True}))
+        return await self.writer.enqueue(rows)
+    
+    async def write_batch(self, rows: List[tuple]) -> List[int]:
+        """
+        Write a batch of sensor rows in a single transaction. Returns the
+        positions of the rows stored: a reading repeating a stored (device,
+        timestamp) is left out (compact layout), and so is everything derived
+        from it. Alert, geo and activity state moves forward only once the
+        rows are committed.
+        """
+        # Latest timestamp per device in this batch
+        last_seen = {}
+        for row in rows:
+            device_id, timestamp = row[0], row[1]
+            if device_id not in last_seen or timestamp > last_seen[device_id]:
+                last_seen[device_id] = timestamp
+        
+        async with self.write_lock:
+            new_devices = self.devices.unknown(last_seen)
+            try:
+                if new_devices:
+                    await self._insert_devices(new_devices)
+                
+                device_keys = {device_id: self.devices.key(device_id) for device_id in last_seen}
+                params = self.storage.insert_params(rows, device_keys)
+                stored, row_keys = await self.storage.insert(self.db, params)
+                if len(stored) < len(rows):
+                    rows = [rows[index] for index in stored]
+                
+                await rollups.apply(self.db, rows)
+                await self.statistics.journal(self.db, count_days(row[1] for row in rows))
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                for device_id in new_devices:
+                    self.devices.devices.pop(device_id, None)
+                raise
+            # Counted under the lock, so a snapshot never misses a journaled batch
+            self.statistics.record(row[1] for row in rows)
+        
+        found, fence_events, segments = self._observe(rows)
+        if found or segments or self.unsaved_alerts or self.unsaved_segments:
+            await self._store_observed(found, segments)
+        
+        if new_devices:
+            await self.broker.publish("devices.new", [self.devices.devices[device_id] for device_id in new_devices])
+        if found:
+            # Other workers' dashboards via the broker, this worker's via the local handler
+            await self.broker.publish("alerts", found)
+            await self.broker.dispatch("alerts", found)
+        if fence_events:
+            await self.broker.publish("geofence", fence_events)
+            await self.broker.dispatch("geofence", fence_events)
+        for device_id, timestamp in last_seen.items():
+            self.devices.touch(device_id, timestamp)
+        stored_timestamp = self.storage.stored_timestamp
+        self.hot_cache.add(((row[0], stored_timestamp(row[1])) + tuple(row[2:]) for row in rows), row_keys)
+        
+        # Cached snapshot reads on every worker are stale now
+        await self.broker.publish("invalidate", INGEST_TAGS)
+        await self.broker.dispatch("invalidate", INGEST_TAGS)
+        return stored
+    
+    def _observe(self, rows: List[tuple]) -> Tuple[List[dict], List[dict], List[tuple]]:
+        """Committed rows -> (alerts, geofence events, track segments); feeds the activity rings"""
+        found = []
+        if Config.ALERTS_ENABLED:
+            try:
+                found = self.alerts.detect(rows)
+            except Exception as e:
+                logger.error(f"Alert detection failed: {e}")
+        
+        fence_events, segments = [], []
+        if Config.GEO_ENABLED:
+            try:
+                fence_events, segments = self.geo.observe(rows)
+            except Exception as e:
+                logger.error(f"Geo indexing failed: {e}")
+        
+        if Config.ACTIVITY_ENABLED:
+            try:
+                self.activity.append(rows)
+            except Exception as e:
+                logger.error(f"Activity buffering failed: {e}")
+        return found, fence_events, segments
+    
+    async def _store_observed(self, found: List[dict], segments: List[tuple]):
+        """
+        Store alerts and track segments of a committed batch. If that fails they
+        are kept and written with the next batch's, so the segment boxes GeoIndex
+        holds in memory still reach track_index.
+        """
+        found = self.unsaved_alerts + found
+        segments = self.unsaved_segments + segments
+        async with self.write_lock:
+            try:
+                if found:
+                    await alerts.store(self.db, found)
+                if segments:
+                    await geo.store_tracks(self.db, segments)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                self.unsaved_alerts, self.unsaved_segments = found, segments
+                logger.error(f"Error storing {len(found)} alerts and {len(segments)} track segments, retrying with the next batch: {e}")
+                return
+        self.unsaved_alerts, self.unsaved_segments = [], []
+    
+    async def _insert_devices(self, device_ids: List[str], cow_id: str = None):
+        """Insert new devices and add them to the registry (caller commits)"""
+        await self.db.executemany("""
+            INSERT OR IGNORE INTO devices (device_id, cow_id, status)
+            VALUES (?, ?, 'active')
+        """, [(device_id, cow_id) for device_id in device_ids])
+        
+        placeholders = ', '.join('?' * len(device_ids))
+        cursor = await self.db.execute(
+            f"SELECT * FROM devices WHERE device_id IN ({placeholders})", device_ids
+        )
+        for row in await cursor.fetchall():
+            self.devices.devices[row['device_id']] = dict(row)
     
     async def register_device(self, device_id: str, cow_id: str = None):
-        """Register or update device"""
+        """Register device if not already known"""
+        if device_id in self.devices:
+            return
         try:
-            await self.db.execute("""
-                INSERT OR IGNORE INTO devices (device_id, cow_id, status)
-                VALUES (?, ?, 'active')
-            """, (device_id, cow_id))
-            await self.db.commit()
+            async with self.write_lock:
+                await self._insert_devices([device_id], cow_id)
+                await self.db.commit()
+            await self.broker.publish("invalidate", ["devices"])
+            await self.broker.dispatch("invalidate", ["devices"])
         except Exception as e:
             logger.error(f"Error registering device: {e}")
     
     async def update_device_last_seen(self, device_id: str, timestamp: str):
-        """Update device last seen timestamp"""
-        try:
-            await self.db.execute("""
-                UPDATE devices 
-                SET last_seen = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE device_id = ?
-            """, (timestamp, device_id))
-            await self.db.commit()
-        except Exception as e:
-            logger.error(f"Error updating device last seen: {e}")
+        """Update device last seen timestamp (written back by flush_devices)"""
+        self.devices.touch(device_id, timestamp)
+    
+    async def flush_devices(self):
+        """Write in-memory last_seen/updated_at back to the devices table"""
+        async with self.write_lock:
+            updates = self.devices.take_dirty()
+            if not updates:
+                return
+            try:
+                await self.db.executemany("""
+                    UPDATE devices 
+                    SET last_seen = ?, updated_at = ?
+                    WHERE device_id = ?
+                """, updates)
+                await self.db.commit()
+                logger.debug(f"Flushed last_seen for {len(updates)} devices")
+            except Exception as e:
+                await self.db.rollback()
+                self.devices.dirty.update(device_id for _, _, device_id in updates)
+                logger.error(f"Error flushing device registry: {e}")
+    
+    async def persist_statistics(self, clean: bool = False):
+        """Save statistics counters"""
+        async with self.write_lock:
+            try:
+                await self.statistics.persist(self.db, clean)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                logger.error(f"Error persisting statistics: {e}")
+    
+    async def _stats_persist_loop(self):
+        """Periodically snapshot statistics counters (bounds the journal replayed after a crash)"""
+        while True:
+            await asyncio.sleep(Config.STATS_PERSIST_INTERVAL)
+            await self.persist_statistics()
+    
+    async def _activity_loop(self):
+        """Score IMU activity windows as they close (once per hop)"""
+        while True:
+            await asyncio.sleep(self.activity.seconds_to_next(time.time()))
+            try:
+                await self.flush_activity()
+            except Exception as e:
+                logger.error(f"Activity windows failed: {e}")
+    
+    async def flush_activity(self) -> int:
+        """Score and store the windows that have closed; number of rows written"""
+        windows = []
+        for end in self.activity.due(time.time()):
+            for start in range(0, len(self.activity.devices), Config.ACTIVITY_CHUNK):
+                windows.extend(self.activity.features(end, start, start + Config.ACTIVITY_CHUNK))
+                await asyncio.sleep(0)  # ingest and dashboards run between chunks
+        if not windows:
+            return 0
+        async with self.write_lock:
+            try:
+                await activity.store(self.db, windows)
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+        return len(windows)
+    
+    async def _device_flush_loop(self):
+        """Periodically flush the device registry"""
+        while True:
+            await asyncio.sleep(Config.DEVICE_FLUSH_INTERVAL)
+            await self.flush_devices()
+    
+    async def warm_hot_cache(self):
+        """Load the latest readings of every device into the hot cache"""
+        started = time.perf_counter()
+        capacity = self.hot_cache.capacity
+        self.hot_cache.clear()
+        for device_id in list(self.devices.devices):
+            cursor = await self.db.execute(self.storage.select(f"""
+                WHERE {self.storage.device_column} = ?
+                ORDER BY {self.storage.time_column} DESC
+                LIMIT ?
+            """), (self.storage.device_arg(device_id, self.devices.key(device_id)), capacity))
+            rows = await cursor.fetchall()
+            keys = [self.storage.row_key(row) for row in rows]
+            self.hot_cache.load(device_id, rows, keys, complete=not self.archive.days(device_id))
+        self.hot_cache.warm = True
+        logger.info(
+            f"Hot cache warmed: {len(self.hot_cache.rings)} devices in "
+            f"{(time.perf_counter() - started) * 1000:.0f} ms"
+        )
     
     async def get_recent_data(self, limit: int = 100) -> List[Dict]:
         """Get recent sensor data from all devices"""
+        if self.hot_cache.covers_recent(limit):
+            return self.hot_cache.recent(limit)
+        self.hot_cache.miss()
         try:
-            cursor = await self.db.execute("""
-                SELECT * FROM sensor_data
-                ORDER BY timestamp DESC
+            rows = await self.readers.fetchall(self.storage.select(f"""
+                ORDER BY {self.storage.time_column} DESC
                 LIMIT ?
-            """, (limit,))
-            
-            rows = await cursor.fetchall()
+            """), (max(1, min(limit, Config.HISTORY_MAX_PAGE)),))
             return [dict(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting recent data:  {e}")
             return []
     
+    def history(self, device_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                fields=None, cursor: Optional[str] = None, limit: int = 100) -> HistoryQuery:
+        """Keyset-paginated history page (raises ValueError on bad parameters)"""
+        return HistoryQuery(self, device_id, start, end, fields, cursor, limit)
+    
     async def get_device_data(self, device_id: str, limit: int = 100) -> List[Dict]:
-        """Get sensor data for specific device"""
+        """Get the latest sensor data for specific device, continuing into the archive"""
         try:
-            cursor = await self.db.execute("""
-                SELECT * FROM sensor_data
-                WHERE device_id = ? 
-                ORDER BY timestamp DESC
-                LIMIT ?
-            """, (device_id, limit))
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            page = await self.history(device_id, limit=limit).fetch()
+            return page["data"]
         except Exception as e: 
             logger.error(f"Error getting device data: {e}")
             return []
     
+    async def get_device_window(self, device_id: str, fields: List[str], size: int) -> Optional[Dict]:
+        """Latest readings of a device as per-field columns (chart window), from the hot cache"""
+        if not self.broker.is_writer:
+            return await self.broker.request("window", {"device_id": device_id, "fields": fields, "size": size})
+        return self.hot_cache.window(device_id, fields, size)
+    
     async def get_all_devices(self) -> List[Dict]:
-        """Get all registered devices"""
+        """Get all registered devices (served from the registry cache)"""
+        if not self.broker.is_writer:
+            return await self.broker.request("devices.list")
+        return self.devices.snapshot()
+    
+    async def get_alerts(self, device_id: Optional[str] = None, field: Optional[str] = None,
+                         kind: Optional[str] = None, start: Optional[str] = None,
+                         end: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Stored alerts, newest first"""
+        conditions, args = [], []
+        for column, value in (("device_id", device_id), ("field", field), ("kind", kind)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                args.append(value)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            args.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            args.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.readers.fetchall(
+            f"SELECT * FROM alerts {where} ORDER BY timestamp DESC, id DESC LIMIT ?", (*args, limit)
+        )
+        return [dict(row) for row in rows]
+    
+    async def get_activity(self, device_id: Optional[str] = None, kind: Optional[str] = None,
+                           start: Optional[str] = None, end: Optional[str] = None,
+                           limit: int = 100) -> List[Dict]:
+        """Stored activity windows, newest first"""
+        conditions, args = self._activity_conditions(device_id, kind, start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.readers.fetchall(
+            f"SELECT * FROM activity {where} ORDER BY window_end DESC, device_id LIMIT ?", (*args, limit)
+        )
+        return [activity.describe_row(row) for row in rows]
+    
+    async def get_activity_summary(self, device_id: Optional[str] = None, start: Optional[str] = None,
+                                   end: Optional[str] = None) -> List[Dict]:
+        """Per device: windows in each activity, steps (overlap removed) and mean SMA over a time range"""
+        conditions, args = self._activity_conditions(device_id, None, start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.readers.fetchall(f"""
+            SELECT device_id, activity, COUNT(*) AS windows, SUM(steps) AS steps, AVG(sma) AS sma
+            FROM activity {where}
+            GROUP BY device_id, activity
+            ORDER BY device_id
+        """, args)
+        summary: Dict[str, Dict] = {}
+        for row in rows:
+            device = summary.setdefault(row["device_id"], {
+                "device_id": row["device_id"],
+                "windows": dict.fromkeys(activity.ACTIVITIES, 0),
+                "steps": 0,
+                "sma": 0.0
+            })
+            device["windows"][activity.ACTIVITIES[row["activity"]]] = row["windows"]
+            device["steps"] += row["steps"] or 0
+            device["sma"] += (row["sma"] or 0.0) * row["windows"]
+        
+        # Windows overlap when the hop is shorter than the window: each step is in window / hop of them
+        overlap = min(1.0, Config.ACTIVITY_HOP / Config.ACTIVITY_WINDOW)
+        for device in summary.values():
+            device["steps"] = round(device["steps"] * overlap)
+            device["sma"] = round(device["sma"] / max(1, sum(device["windows"].values())), 4)
+        return list(summary.values())
+    
+    @staticmethod
+    def _activity_conditions(device_id: Optional[str], kind: Optional[str],
+                             start: Optional[str], end: Optional[str]) -> tuple:
+        conditions, args = [], []
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            args.append(device_id)
+        if kind is not None:
+            conditions.append("activity = ?")
+            args.append(activity.ACTIVITIES.index(kind))
+        if start is not None:
+            conditions.append("window_end >= ?")
+            args.append(to_epoch_ms(start) // 1000)
+        if end is not None:
+            conditions.append("window_end <= ?")
+            args.append(to_epoch_ms(end) // 1000)
+        return conditions, args
+    
+    async def get_device_groups(self) -> Dict[str, List[str]]:
+        """All device groups: name -> device ids"""
+        groups: Dict[str, List[str]] = {}
+        for row in await self.readers.fetchall("SELECT name, device_id FROM device_groups ORDER BY name, device_id"):
+            groups.setdefault(row["name"], []).append(row["device_id"])
+        return groups
+    
+    async def set_device_group(self, name: str, device_ids: List[str]):
+        """Create or replace a device group"""
+        if not self.broker.is_writer:
+            await self.broker.request("groups.set", {"name": name, "device_ids": device_ids})
+            return
+        async with self.write_lock:
+            try:
+                await self.db.execute("DELETE FROM device_groups WHERE name = ?", (name,))
+                await self.db.executemany(
+                    "INSERT OR IGNORE INTO device_groups (name, device_id) VALUES (?, ?)",
+                    [(name, device_id) for device_id in device_ids]
+                )
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+    
+    async def delete_device_group(self, name: str) -> bool:
+        """Delete a device group; False if it did not exist"""
+        if not self.broker.is_writer:
+            return await self.broker.request("groups.delete", {"name": name})
+        async with self.write_lock:
+            cursor = await self.db.execute("DELETE FROM device_groups WHERE name = ?", (name,))
+            await self.db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_devices_in_box(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Dict]:
+        """Devices whose latest GPS fix is inside a box (degrees)"""
+        if not self.broker.is_writer:
+            return await self.broker.request("geo.box", {
+                "min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon
+            })
+        return self.geo.grid.within_box(min_lat, min_lon, max_lat, max_lon)
+    
+    async def get_devices_near(self, lat: float, lon: float, radius_m: float, limit: int) -> List[Dict]:
+        """Devices whose latest GPS fix is within radius_m, nearest first"""
+        if not self.broker.is_writer:
+            return await self.broker.request("geo.near", {"lat": lat, "lon": lon, "radius_m": radius_m, "limit": limit})
+        return self.geo.grid.near(lat, lon, radius_m, limit)
+    
+    async def get_geofences(self) -> List[Dict]:
+        if not self.broker.is_writer:
+            return await self.broker.request("geofences.list")
+        return self.geo.geofences()
+    
+    async def get_geofence_members(self, name: str) -> Optional[Dict]:
+        """Devices inside/outside a geofence; None if it does not exist"""
+        if not self.broker.is_writer:
+            return await self.broker.request("geofences.members", {"name": name})
+        if name not in self.geo.fences.names:
+            return None
+        return {**self.geo.fences.describe(name), **self.geo.fences.members(name)}
+    
+    async def set_geofence(self, name: str, polygon: List[List[float]]) -> Dict:
+        """Create or replace a geofence (polygon already validated)"""
+        if not self.broker.is_writer:
+            return await self.broker.request("geofences.set", {"name": name, "polygon": polygon})
+        async with self.write_lock:
+            try:
+                await geo.save_geofence(self.db, name, polygon)
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+        self.geo.set_geofence(name, polygon)
+        return self.geo.fences.describe(name)
+    
+    async def delete_geofence(self, name: str) -> bool:
+        """Delete a geofence; False if it did not exist"""
+        if not self.broker.is_writer:
+            return await self.broker.request("geofences.delete", {"name": name})
+        async with self.write_lock:
+            deleted = await geo.delete_geofence(self.db, name)
+            await self.db.commit()
+        self.geo.fences.remove(name)
+        return deleted
+    
+    async def get_tracks(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                         start: Optional[str] = None, end: Optional[str] = None,
+                         device_id: Optional[str] = None, limit: int = 1000) -> Dict:
+        """
+        GPS points inside a box (and time range): the track R*Tree narrows the
+        search to devices and periods whose segments overlap, then only those
+        rows are read and checked exactly
+        """
+        conditions = ["max_lat >= ?", "min_lat <= ?", "max_lon >= ?", "min_lon <= ?"]
+        args: list = [min_lat, max_lat, min_lon, max_lon]
+        start_s = to_epoch_ms(start) / 1000 if start else None
+        end_s = to_epoch_ms(end) / 1000 if end else None
+        if start_s is not None:
+            conditions.append("max_t >= ?")
+            args.append(start_s)
+        if end_s is not None:
+            conditions.append("min_t <= ?")
+            args.append(end_s)
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            args.append(device_id)
+        segments = await self.readers.fetchall(
+            f"SELECT device_id, min_t, max_t FROM track_index WHERE {' AND '.join(conditions)}", args
+        )
+        
+        windows: Dict[str, list] = {}
+        for segment in segments:
+            windows.setdefault(segment["device_id"], []).append((segment["min_t"], segment["max_t"]))
+        
+        storage = self.storage
+        points = []
+        for device, spans in sorted(windows.items()):
+            key = self.devices.key(device)
+            if key is None and storage.name != "legacy":
+                continue
+            for low, high in geo.merge_windows(spans):
+                if start_s is not None:
+                    low = max(low, start_s)
+                if end_s is not None:
+                    high = min(high, end_s)
+                rows = await self.readers.fetchall(storage.select(f"""
+                    WHERE {storage.device_column} = ?
+                      AND {storage.time_column} >= ? AND {storage.time_column} <= ?
+                      AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+                    ORDER BY {storage.time_column}
+                    LIMIT ?
+                """, ["latitude", "longitude"]), (
+                    storage.device_arg(device, key),
+                    storage.time_arg(from_epoch_ms(int(low * 1000))),
+                    storage.time_arg(from_epoch_ms(math.ceil(high * 1000))),
+                    geo.scaled(min_lat), geo.scaled(max_lat), geo.scaled(min_lon), geo.scaled(max_lon),
+                    limit - len(points) + 1
+                ))
+                points.extend({
+                    "device_id": row["device_id"],
+                    "timestamp": row["timestamp"],
+                    "latitude": row["latitude"] / geo.SCALE,
+                    "longitude": row["longitude"] / geo.SCALE
+                } for row in rows)
+                if len(points) > limit:
+                    return {"points": points[:limit], "segments": len(segments), "truncated": True}
+        return {"points": points, "segments": len(segments), "truncated": False}
+    
+    async def get_aggregates(self, device_id: str, bucket: str, start: Optional[str] = None,
+                             end: Optional[str] = None) -> List[Dict]:
+        """Get time-bucket rollups for a device"""
         try:
-            cursor = await self.db.execute("""
-                SELECT * FROM devices
-                ORDER BY device_id
-            """)
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
-        except Exception as e: 
-            logger.error(f"Error getting devices: {e}")
+            async with self.readers.reader() as conn:
+                return await rollups.query(conn, device_id, bucket, start, end)
+        except Exception as e:
+            logger.error(f"Error getting aggregates: {e}")
             return []
     
+    async def rebuild_rollups(self, device_id: str = None):
+        """Regenerate rollups from raw sensor data (days already archived are kept)"""
+        if not self.broker.is_writer:
+            await self.broker.request("rollups.rebuild", {"device_id": device_id})
+            return
+        async with self.write_lock:
+            try:
+                since = await self.retention.archived_until(self.db)
+                await rollups.rebuild(self.db, device_id, source=self.storage.source, since=since)
+                await self.db.commit()
+                logger.info(f"Rollups rebuilt for {device_id or 'all devices'}")
+            except Exception as e:
+                await self.db.rollback()
+                logger.error(f"Error rebuilding rollups: {e}")
+    
     async def get_statistics(self) -> Dict:
-        """Get system statistics"""
-        try:
-            # Total records
-            cursor = await self.db.execute("SELECT COUNT(*) as count FROM sensor_data")
-            row = await cursor.fetchone()
-            total_records = row['count']
-            
-            # Total devices
-            cursor = await self. db.execute("SELECT COUNT(*) as count FROM devices")
-            row = await cursor.fetchone()
-            total_devices = row['count']
-            
-            # Records today
-            today = datetime.now().date().isoformat()
-            cursor = await self.db.execute("""
-                SELECT COUNT(*) as count FROM sensor_data
-                WHERE DATE(timestamp) = ?
-            """, (today,))
-            row = await cursor.fetchone()
-            records_today = row['count']
-            
-            # Records last hour
-            one_hour_ago = (datetime.now() - timedelta(hours=1)).isoformat()
-            cursor = await self.db.execute("""
-                SELECT COUNT(*) as count FROM sensor_data
-                WHERE timestamp >= ?
-            """, (one_hour_ago,))
-            row = await cursor.fetchone()
-            records_last_hour = row['count']
-            
-            return {
-                "total_records":  total_records,
-                "total_devices": total_devices,
-                "records_today": records_today,
-                "records_last_hour": records_last_hour,
-                "timestamp": datetime.now().isoformat()
-            }
-        except Exception as e:
-            logger.error(f"Error getting statistics: {e}")
-            return {}
+        """Get system statistics (constant time, from the statistics engine)"""
+        if not self.broker.is_writer:
+            return await self.broker.request("statistics")
+        return self.statistics.snapshot(len(self.devices))
     
     async def close(self):
-        """Close database connection"""
+        """Flush pending writes and close database connection"""
+        await self.broker.stop()
+        await self.retention.stop()
+        await self.writer.stop()
+        for task in (self.device_flush_task, self.stats_persist_task, self.activity_task):
+            if task:
+                task.cancel()
+        self.device_flush_task = None
+        self.stats_persist_task = None
+        self.activity_task = None
+        await self.readers.close()
         if self.db:
+            await self.flush_devices()
+            await self.persist_statistics(clean=True)
             await self.db.close()
             logger.info("Database connection closed")
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Streaming export of sensor history (CSV or NDJSON, optionally gzip)
+Readings are pulled per device in large keyset chunks (archive first, then
+the hot table), scaled column by column with the SENSOR_CONFIG divisors and
+encoded chunk by chunk, so memory stays flat whatever the export size. Each
+chunk is a separate short read on the pool, and a semaphore caps concurrent
+exports so they cannot take every reader from dashboards and history.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import zlib
+from typing import List, Optional
+
+from history import parse_fields, parse_time
+from sensor_schema import SENSOR_FIELDS, SENSORS_BY_FIELD, SCALE_DIVISORS
+from storage import to_epoch_ms, from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson")
+}
+
+
+class ExportRequest:
+    """Validated export parameters"""
+    
+    def __init__(self, devices, start: Optional[str], end: Optional[str], fields, fmt: str, compress: bool):
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        self.devices = devices
+        self.start = parse_time(start, "from")
+        self.end = parse_time(end, "to", end=True)
+        self.fields = parse_fields(fields) or list(SENSOR_FIELDS)
+        self.format = fmt
+        self.compress = compress
+    
+    @property
+    def media_type(self) -> str:
+        return "application/gzip" if self.compress else FORMATS[self.format][0]
+    
+    def filename(self, stamp: str) -> str:
+        name = f"farmtech_export_{stamp}.{FORMATS[self.format][1]}"
+        return name + ".gz" if self.compress else name
+
+
+class ExportService:
+    """Runs exports against the read pool with a concurrency cap"""
+    
+    def __init__(self, database, max_concurrent: int, chunk_size: int):
+        self.database = database
+        self.chunk_size = chunk_size
+        self.slots = asyncio.Semaphore(max_concurrent)
+        
+        # Statistics
+        self.stats = {
+            "active": 0,
+            "completed": 0,
+            "failed": 0,
+            "rows_exported": 0,
+            "bytes_sent": 0
+        }
+    
+    async def _device_chunks(self, device_id: str, request: ExportRequest):
+        """Row chunks for one device, oldest first: archive, then hot table"""
+        archive = self.database.archive
+        last_archived = None
+        if archive.days(device_id):
+            end = from_epoch_ms(to_epoch_ms(request.end) + 1) if request.end else None
+            days = archive.iter_range(device_id, request.start, end)
+            while True:
+                rows = await asyncio.to_thread(next, days, None)
+                if rows is None:
+                    break
+                last_archived = rows[-1]["timestamp"]
+                yield rows
+        
+        storage = self.database.storage
+        device_arg = storage.device_arg(device_id, self.database.devices.key(device_id))
+        key_columns = ", ".join(storage.key_columns)
+        order = ", ".join(f"{column} ASC" for column in storage.key_columns)
+        key = None
+        
+        while True:
+            conditions = [f"{storage.device_column} = ?"]
+            args = [device_arg]
+            if key:
+                conditions.append(f"({key_columns}) > ({', '.join('?' * len(key))})")
+                args.extend(key)
+            elif last_archived:
+                conditions.append(f"{storage.time_column} > ?")
+                args.append(storage.time_arg(last_archived))
+            elif request.start:
+                conditions.append(f"{storage.time_column} >= ?")
+                args.append(storage.time_arg(request.start))
+            if request.end:
+                conditions.append(f"{storage.time_column} <= ?")
+                args.append(storage.time_arg(request.end))
+            
+            rows = await self.database.readers.fetchall(storage.select(f"""
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {order}
+                LIMIT ?
+            """, request.fields), args + [self.chunk_size])
+            if not rows:
+                break
+            yield rows
+            if len(rows) < self.chunk_size:
+                break
+            key = storage.cursor_key(rows[-1])
+    
+    @staticmethod
+    def _columns(rows, fields: List[str]) -> List[list]:
+        """Transpose a chunk and apply each field's scale to the whole column"""
+        columns = [[row["device_id"] for row in rows], [row["timestamp"] for row in rows]]
+        for field in fields:
+            column = [row[field] for row in rows]
+            divisor = SCALE_DIVISORS[field]
+            if divisor != 1:
+                column = [None if value is None else value / divisor for value in column]
+            columns.append(column)
+        return columns
+    
+    @staticmethod
+    def _header(request: ExportRequest) -> str:
+        if request.format != "csv":
+            return ""
+        names = ["device_id", "timestamp"] + [
+            f"{SENSORS_BY_FIELD[field]['displayName']} ({SENSORS_BY_FIELD[field]['unit']})"
+            for field in request.fields
+        ]
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(names)
+        return buffer.getvalue()
+    
+    @staticmethod
+    def _encode(columns: List[list], request: ExportRequest) -> str:
+        if request.format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(zip(*columns))
+            return buffer.getvalue()
+        keys = ["device_id", "timestamp"] + request.fields
+        return "".join(json.dumps(dict(zip(keys, values))) + "\n" for values in zip(*columns))
+    
+    async def stream(self, request: ExportRequest):
+        """Encoded (and optionally gzip-compressed) export body"""
+        async with self.slots:
+            self.stats["active"] += 1
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if request.compress else None
+            devices = request.devices or [device["device_id"] for device in self.database.devices.snapshot()]
+            
+            def output(text: str) -> bytes:
+                data = text.encode()
+                if compressor:
+                    data = compressor.compress(data)
+                self.stats["bytes_sent"] += len(data)
+                return data
+            
+            try:
+                header = output(self._header(request))
+                if header:
+                    yield header
+                for device_id in devices:
+                    async for rows in self._device_chunks(device_id, request):
+                        data = output(self._encode(self._columns(rows, request.fields), request))
+                        self.stats["rows_exported"] += len(rows)
+                        if data:
+                            yield data
+                if compressor:
+                    tail = compressor.flush()
+                    self.stats["bytes_sent"] += len(tail)
+                    yield tail
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Export failed: {e}")
+                raise
+            finally:
+                self.stats["active"] -= 1
+    
+    def describe(self) -> dict:
+        """Export counters for /api/status"""
+        return dict(self.stats)
@@ -0,0 +1,633 @@
+"""
+Spatial index of collar GPS positions and polygon geofences
+Readings carry latitude/longitude as int32 degrees x 1e7 (0/0 or null =
+no fix). The writer feeds every ingest batch through GeoIndex.observe:
+
+  grid         latest position per device in uniform cells of
+               GEO_GRID_CELL degrees; box and radius queries visit only
+               the cells they overlap
+  geofences    named polygons; the batch is tested against each fence at
+               once (ray casting over points x edges in NumPy, after a
+               bounding box filter) and enter/exit transitions become
+               {"type": "geofence"} events
+  track_index  SQLite R*Tree over (latitude, longitude, time): one box per
+               device per TRACK_SEGMENT_SECONDS, rewritten only when a
+               reading falls outside it, so "who was here when" reads just
+               the overlapping segments before the exact row check
+"""
+
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from sensor_schema import SENSOR_FIELDS
+from storage import to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+SCALE = 1e7  # stored integer units per degree
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0  # of latitude; of longitude times cos(latitude)
+
+# Column of latitude/longitude in writer rows (device_id, timestamp, *SENSOR_FIELDS)
+LAT_COLUMN = 2 + SENSOR_FIELDS.index("latitude")
+LON_COLUMN = 2 + SENSOR_FIELDS.index("longitude")
+
+# Points x edges per ray-casting chunk (bounds temporary arrays)
+CHUNK_CELLS = 1 << 20
+
+TRACK_COLUMNS = ("id", "min_lat", "max_lat", "min_lon", "max_lon", "min_t", "max_t", "device_id")
+
+
+async def create_tables(db):
+    """Track R*Tree and geofences table (called from Database.create_tables)"""
+    await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS track_index USING rtree(
+            id,
+            min_lat, max_lat,
+            min_lon, max_lon,
+            min_t, max_t,
+            +device_id TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS geofences (
+            name TEXT PRIMARY KEY,
+            polygon TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def load_geofences(db) -> Dict[str, list]:
+    cursor = await db.execute("SELECT name, polygon FROM geofences ORDER BY name")
+    return {row["name"]: json.loads(row["polygon"]) for row in await cursor.fetchall()}
+
+
+async def save_geofence(db, name: str, polygon: list):
+    """Insert or replace a geofence (caller commits)"""
+    await db.execute("""
+        INSERT INTO geofences (name, polygon, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET polygon = excluded.polygon, updated_at = excluded.updated_at
+    """, (name, json.dumps(polygon)))
+
+
+async def delete_geofence(db, name: str) -> bool:
+    """Delete a geofence (caller commits)"""
+    cursor = await db.execute("DELETE FROM geofences WHERE name = ?", (name,))
+    return cursor.rowcount > 0
+
+
+async def next_track_id(db) -> int:
+    cursor = await db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM track_index")
+    return (await cursor.fetchone())[0]
+
+
+async def store_tracks(db, segments: List[tuple]):
+    """Insert or grow track segments (caller commits)"""
+    await db.executemany(
+        f"INSERT OR REPLACE INTO track_index ({', '.join(TRACK_COLUMNS)}) VALUES ({', '.join('?' * len(TRACK_COLUMNS))})",
+        segments
+    )
+
+
+async def purge_tracks(db, before: str) -> int:
+    """Drop segments that end before a timestamp (retention; caller commits)"""
+    cursor = await db.execute("DELETE FROM track_index WHERE max_t < ?", (to_epoch_ms(before) / 1000,))
+    return cursor.rowcount
+
+
+def validate_polygon(polygon, max_vertices: int) -> List[List[float]]:
+    """[[lat, lon], ...] in degrees -> validated list (closing vertex optional)"""
+    if not isinstance(polygon, list):
+        raise ValueError("Polygon must be a list of [latitude, longitude] pairs")
+    try:
+        vertices = [[float(lat), float(lon)] for lat, lon in polygon]
+    except (TypeError, ValueError):
+        raise ValueError("Polygon must be a list of [latitude, longitude] pairs")
+    if len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    if len(vertices) < 3:
+        raise ValueError("Polygon needs at least 3 vertices")
+    if len(vertices) > max_vertices:
+        raise ValueError(f"Polygon has more than {max_vertices} vertices")
+    for lat, lon in vertices:
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Vertex out of range: {lat}, {lon}")
+    return vertices
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters (degrees in; NumPy arrays broadcast)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class GridIndex:
+    """Latest position per device (columns by device slot) in uniform lat/lon cells"""
+    
+    def __init__(self, cell: float):
+        self.cell = cell
+        
+        # Per-device columns, indexed by slot (grown on demand); seconds = -inf until located
+        self.slots: Dict[str, int] = {}
+        self.devices: List[str] = []
+        self.capacity = 0
+        self.lat = np.zeros(0)
+        self.lon = np.zeros(0)
+        self.seconds = np.zeros(0)
+        self.keys = np.zeros((0, 2), dtype=np.int64)
+        self.timestamps: List[Optional[str]] = []
+        self.located = 0
+        
+        # Cell -> slots of the devices in it
+        self.cells: Dict[Tuple[int, int], Set[int]] = {}
+    
+    def __len__(self) -> int:
+        return self.located
+    
+    def slot(self, device_id: str) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = len(self.devices)
+            self.slots[device_id] = slot
+            self.devices.append(device_id)
+            self.timestamps.append(None)
+        return slot
+    
+    def grow(self):
+        """Make room for every slot handed out (doubling)"""
+        size = len(self.devices)
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity, 64)
+        extra = capacity - self.capacity
+        self.lat = np.concatenate([self.lat, np.zeros(extra)])
+        self.lon = np.concatenate([self.lon, np.zeros(extra)])
+        self.seconds = np.concatenate([self.seconds, np.full(extra, -np.inf)])
+        self.keys = np.vstack([self.keys, np.zeros((extra, 2), dtype=np.int64)])
+        self.capacity = capacity
+    
+    def _key(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+    
+    def update(self, slots: np.ndarray, lat: np.ndarray, lon: np.ndarray, seconds: np.ndarray, timestamps: List[str]):
+        """Move devices (distinct slots); positions older than the current one are ignored"""
+        self.grow()
+        newer = seconds >= self.seconds[slots]
+        if not newer.all():
+            slots, lat, lon, seconds = slots[newer], lat[newer], lon[newer], seconds[newer]
+            timestamps = [timestamp for timestamp, keep in zip(timestamps, newer.tolist()) if keep]
+        
+        # Only devices that change cell touch the cell sets
+        keys = np.floor(np.column_stack([lat, lon]) / self.cell).astype(np.int64)
+        fresh = self.seconds[slots] == -np.inf
+        moved = fresh | (keys != self.keys[slots]).any(axis=1)
+        for slot, old, new, first in zip(slots[moved].tolist(), self.keys[slots[moved]].tolist(),
+                                         keys[moved].tolist(), fresh[moved].tolist()):
+            if not first:
+                members = self.cells[tuple(old)]
+                members.discard(slot)
+                if not members:
+                    del self.cells[tuple(old)]
+            self.cells.setdefault(tuple(new), set()).add(slot)
+        self.located += int(np.count_nonzero(fresh))
+        
+        self.lat[slots] = lat
+        self.lon[slots] = lon
+        self.seconds[slots] = seconds
+        self.keys[slots] = keys
+        for slot, timestamp in zip(slots.tolist(), timestamps):
+            self.timestamps[slot] = timestamp
+    
+    def located_slots(self) -> np.ndarray:
+        return np.flatnonzero(self.seconds[:len(self.devices)] > -np.inf)
+    
+    def _candidates(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        low_lat, low_lon = self._key(min_lat, min_lon)
+        high_lat, high_lon = self._key(max_lat, max_lon)
+        span = (high_lat - low_lat + 1) * (high_lon - low_lon + 1)
+        found: List[int] = []
+        if span > len(self.cells):
+            # Box larger than the occupied area: walk occupied cells instead
+            for (cell_lat, cell_lon), members in self.cells.items():
+                if low_lat <= cell_lat <= high_lat and low_lon <= cell_lon <= high_lon:
+                    found.extend(members)
+        else:
+            for cell_lat in range(low_lat, high_lat + 1):
+                for cell_lon in range(low_lon, high_lon + 1):
+                    found.extend(self.cells.get((cell_lat, cell_lon), ()))
+        return np.array(found, dtype=np.intp)
+    
+    def _describe(self, slot: int) -> dict:
+        return {
+            "device_id": self.devices[slot],
+            "latitude": round(float(self.lat[slot]), 7),
+            "longitude": round(float(self.lon[slot]), 7),
+            "timestamp": self.timestamps[slot]
+        }
+    
+    def within_box(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[dict]:
+        """Devices whose latest position is inside the box"""
+        slots = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lat, lon = self.lat[slots], self.lon[slots]
+        slots = slots[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)]
+        return sorted((self._describe(slot) for slot in slots.tolist()), key=lambda position: position["device_id"])
+    
+    def near(self, lat: float, lon: float, radius_m: float, limit: int) -> List[dict]:
+        """Devices within radius_m of a point, nearest first"""
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        slots = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = distance_m(lat, lon, self.lat[slots], self.lon[slots])
+        inside = distances <= radius_m
+        slots, distances = slots[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return [
+            {**self._describe(slot), "distance_m": round(distance, 1)}
+            for slot, distance in zip(slots[order].tolist(), distances[order].tolist())
+        ]
+
+
+class GeofenceSet:
+    """Polygons and which devices are inside each (state columns by grid slot)"""
+    
+    def __init__(self, grid: GridIndex):
+        self.grid = grid
+        self.names: List[str] = []
+        self.polygons: List[np.ndarray] = []  # (vertices, 2) lat/lon degrees
+        self.edges: List[Tuple[np.ndarray, ...]] = []  # per fence: start lat, start lon, end lat, lon step per lat
+        self.boxes = np.zeros((0, 4))  # min_lat, min_lon, max_lat, max_lon per fence
+        
+        # slot x fence: 1 inside, 0 outside, -1 unknown
+        self.state = np.zeros((0, 0), dtype=np.int8)
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def _grow(self):
+        if len(self.state) < self.grid.capacity:
+            extra = np.full((self.grid.capacity - len(self.state), len(self.names)), -1, dtype=np.int8)
+            self.state = np.vstack([self.state, extra])
+    
+    def set(self, name: str, polygon: List[List[float]]):
+        """Add or replace a fence; membership starts from the current positions (no events)"""
+        self._grow()
+        vertices = np.array(polygon, dtype=float)
+        box = np.array([vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max()])
+        if name in self.names:
+            column = self.names.index(name)
+            self.polygons[column] = vertices
+            self.edges[column] = self._edges(vertices)
+            self.boxes[column] = box
+        else:
+            column = len(self.names)
+            self.names.append(name)
+            self.polygons.append(vertices)
+            self.edges.append(self._edges(vertices))
+            self.boxes = np.vstack([self.boxes, box])
+            self.state = np.hstack([self.state, np.full((len(self.state), 1), -1, dtype=np.int8)])
+        
+        self.state[:, column] = -1
+        slots = self.grid.located_slots()
+        lat, lon = self.grid.lat[slots], self.grid.lon[slots]
+        candidates = np.flatnonzero(self._candidates(lat, lon)[:, column])
+        self.state[slots, column] = self._contains(column, lat, lon, candidates)
+    
+    def remove(self, name: str) -> bool:
+        if name not in self.names:
+            return False
+        column = self.names.index(name)
+        del self.names[column]
+        del self.polygons[column]
+        del self.edges[column]
+        self.boxes = np.delete(self.boxes, column, axis=0)
+        self.state = np.delete(self.state, column, axis=1)
+        return True
+    
+    @staticmethod
+    def _edges(vertices: np.ndarray) -> Tuple[np.ndarray, ...]:
+        y1, x1 = vertices[:, 0], vertices[:, 1]
+        y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (x2 - x1) / (y2 - y1)  # horizontal edges never straddle, their slope is unused
+        return y1, x1, y2, slope
+    
+    def _candidates(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """points x fences: inside the fence's bounding box"""
+        min_lat, min_lon, max_lat, max_lon = self.boxes.T
+        return (
+            (lat[:, None] >= min_lat) & (lat[:, None] <= max_lat)
+            & (lon[:, None] >= min_lon) & (lon[:, None] <= max_lon)
+        )
+    
+    def _contains(self, column: int, lat: np.ndarray, lon: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Point-in-polygon (even-odd ray casting) of the candidate points against one fence"""
+        result = np.zeros(len(lat), dtype=bool)
+        y1, x1, y2, slope = self.edges[column]
+        step = max(1, CHUNK_CELLS // len(y1))
+        for start in range(0, len(candidates), step):
+            index = candidates[start:start + step]
+            py, px = lat[index, None], lon[index, None]
+            straddles = (y1 > py) != (y2 > py)
+            with np.errstate(invalid="ignore"):
+                crossing = x1 + (py - y1) * slope
+            result[index] = np.count_nonzero(straddles & (px < crossing), axis=1) % 2 == 1
+        return result
+    
+    def evaluate(self, slots: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> List[Tuple[int, str, str]]:
+        """
+        Transitions for points sorted by device, then time:
+        (position, fence, "enter"/"exit"). A device's first known position
+        sets its state without an event.
+        """
+        if not self.names or not len(slots):
+            return []
+        self._grow()
+        inside = np.zeros((len(slots), len(self.names)), dtype=np.int8)
+        candidates = self._candidates(lat, lon)
+        for column in np.flatnonzero(candidates.any(axis=0)).tolist():
+            inside[:, column] = self._contains(column, lat, lon, np.flatnonzero(candidates[:, column]))
+        
+        # Previous state: the row before for the same device, else the stored state
+        first = np.ones(len(slots), dtype=bool)
+        first[1:] = slots[1:] != slots[:-1]
+        previous = np.empty_like(inside)
+        previous[1:] = inside[:-1]
+        previous[first] = self.state[slots[first]]
+        
+        last = np.ones(len(slots), dtype=bool)
+        last[:-1] = first[1:]
+        self.state[slots[last]] = inside[last]
+        
+        changed = (previous != -1) & (previous != inside)
+        return [
+            (position, self.names[column], "enter" if inside[position, column] else "exit")
+            for position, column in zip(*(axis.tolist() for axis in np.nonzero(changed)))
+        ]
+    
+    def members(self, name: str) -> Dict[str, List[str]]:
+        """Devices inside and outside a fence (by latest position)"""
+        column = self.names.index(name)
+        state = self.state[:len(self.grid.devices), column]
+        devices = self.grid.devices
+        return {
+            "inside": sorted(devices[slot] for slot in np.flatnonzero(state == 1).tolist()),
+            "outside": sorted(devices[slot] for slot in np.flatnonzero(state == 0).tolist())
+        }
+    
+    def describe(self, name: str) -> dict:
+        column = self.names.index(name)
+        return {
+            "name": name,
+            "polygon": self.polygons[column].tolist(),
+            "bbox": self.boxes[column].tolist(),
+            "inside": int(np.count_nonzero(self.state[:, column] == 1))
+        }
+
+
+class GeoIndex:
+    """Latest positions, geofences and open track segments (writer only)"""
+    
+    def __init__(self, cell: float, segment_seconds: float):
+        self.grid = GridIndex(cell)
+        self.fences = GeofenceSet(self.grid)
+        self.segment_seconds = segment_seconds
+        
+        # Newest track segment per device slot: id (0 = none), period, box (min/max lat, min/max lon)
+        self.segment_id = np.zeros(0, dtype=np.int64)
+        self.segment_bucket = np.zeros(0, dtype=np.int64)
+        self.segment_box = np.zeros((0, 4))
+        self.next_id = 1
+        
+        # Statistics
+        self.stats = {
+            "batches": 0,
+            "points": 0,
+            "no_fix": 0,
+            "segments_written": 0,
+            "events": 0,
+            "total_ms": 0.0
+        }
+    
+    def load(self, fences: Dict[str, list], positions: List[dict], next_id: int):
+        """Startup: stored fences, latest readings (hot cache) and the next segment id"""
+        self.next_id = next_id
+        if positions:
+            lat = self._column(positions, "latitude")
+            lon = self._column(positions, "longitude")
+            valid = np.flatnonzero(self._valid(lat, lon)).tolist()
+            if valid:
+                slots = np.array([self.grid.slot(positions[index]["device_id"]) for index in valid], dtype=np.intp)
+                seconds = np.array([to_epoch_ms(positions[index]["timestamp"]) / 1000 for index in valid])
+                self.grid.update(slots, lat[valid], lon[valid], seconds, [positions[index]["timestamp"] for index in valid])
+        for name, polygon in fences.items():
+            self.fences.set(name, polygon)
+    
+    @staticmethod
+    def _column(rows, column) -> np.ndarray:
+        """Coordinate column in degrees (NaN where missing)"""
+        try:
+            values = np.array([row[column] for row in rows], dtype=float)
+        except (TypeError, ValueError):
+            values = np.array([_number(row[column]) for row in rows])
+        return values / SCALE
+    
+    @staticmethod
+    def _valid(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        return (
+            ~np.isnan(lat) & ~np.isnan(lon) & ((lat != 0) | (lon != 0))
+            & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        )
+    
+    def set_geofence(self, name: str, polygon: List[List[float]]):
+        self.fences.set(name, polygon)
+    
+    def observe(self, rows: List[tuple]) -> Tuple[List[dict], List[tuple]]:
+        """One ingest batch -> (geofence events, track segments to write)"""
+        started = time.perf_counter()
+        lat = self._column(rows, LAT_COLUMN)
+        lon = self._column(rows, LON_COLUMN)
+        valid = np.flatnonzero(self._valid(lat, lon))
+        self.stats["batches"] += 1
+        self.stats["points"] += len(valid)
+        self.stats["no_fix"] += len(rows) - len(valid)
+        if not len(valid):
+            return [], []
+        
+        valid_rows = valid.tolist()
+        slots = np.array([self.grid.slot(rows[index][0]) for index in valid_rows], dtype=np.intp)
+        seconds = np.array([to_epoch_ms(rows[index][1]) / 1000 for index in valid_rows])
+        self.grid.grow()
+        
+        # Points by device, then time (stable: arrival order breaks ties)
+        order = np.lexsort((seconds, slots))
+        rows_sorted = valid[order]
+        slots, seconds = slots[order], seconds[order]
+        lat, lon = lat[rows_sorted], lon[rows_sorted]
+        
+        # Fences only follow points not older than the device's known position
+        current = np.flatnonzero(seconds >= self.grid.seconds[slots])
+        transitions = self.fences.evaluate(slots[current], lat[current], lon[current])
+        
+        # Grid: each device's newest point in the batch
+        newest = np.ones(len(slots), dtype=bool)
+        newest[:-1] = slots[1:] != slots[:-1]
+        self.grid.update(slots[newest], lat[newest], lon[newest], seconds[newest],
+                         [rows[index][1] for index in rows_sorted[newest].tolist()])
+        
+        events = []
+        for position, name, event in transitions:
+            position = current[position]
+            row = rows[rows_sorted[position]]
+            events.append({
+                "device_id": row[0],
+                "geofence": name,
+                "event": event,
+                "latitude": round(float(lat[position]), 7),
+                "longitude": round(float(lon[position]), 7),
+                "timestamp": row[1]
+            })
+        segments = self._segments(slots, lat, lon, seconds)
+        
+        self.stats["events"] += len(events)
+        self.stats["segments_written"] += len(segments)
+        self.stats["total_ms"] += (time.perf_counter() - started) * 1000
+        return events, segments
+    
+    def _grow(self):
+        extra = self.grid.capacity - len(self.segment_id)
+        if extra > 0:
+            self.segment_id = np.concatenate([self.segment_id, np.zeros(extra, dtype=np.int64)])
+            self.segment_bucket = np.concatenate([self.segment_bucket, np.zeros(extra, dtype=np.int64)])
+            self.segment_box = np.vstack([self.segment_box, np.zeros((extra, 4))])
+    
+    def _new_ids(self, count: int) -> np.ndarray:
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        return ids
+    
+    def _segments(self, slots: np.ndarray, lat: np.ndarray, lon: np.ndarray, seconds: np.ndarray) -> List[tuple]:
+        """Grow each device's open segment; rows only for segments that are new or grew"""
+        self._grow()
+        buckets = np.floor(seconds / self.segment_seconds).astype(np.int64)
+        
+        # Bounding box of each (device, period) run of the sorted points
+        boundary = np.ones(len(slots), dtype=bool)
+        boundary[1:] = (slots[1:] != slots[:-1]) | (buckets[1:] != buckets[:-1])
+        starts = np.flatnonzero(boundary)
+        group_slots, group_buckets = slots[starts], buckets[starts]
+        boxes = np.column_stack([
+            np.minimum.reduceat(lat, starts), np.maximum.reduceat(lat, starts),
+            np.minimum.reduceat(lon, starts), np.maximum.reduceat(lon, starts)
+        ])
+        
+        ids, out_boxes, out_buckets, out_slots = [], [], [], []
+        
+        # Earlier periods of a device in this batch (batch straddles a period boundary): rare, one at a time
+        last = np.ones(len(starts), dtype=bool)
+        last[:-1] = group_slots[1:] != group_slots[:-1]
+        for group in np.flatnonzero(~last).tolist():
+            slot, bucket, box = group_slots[group], group_buckets[group], boxes[group]
+            if self.segment_id[slot] and bucket == self.segment_bucket[slot]:
+                grown = self._union(self.segment_box[slot][None], box[None])[0]
+                self.segment_box[slot] = grown
+                ids.append(self.segment_id[slot:slot + 1])
+                out_boxes.append(grown[None])
+            else:
+                new_id = self._new_ids(1)
+                if not self.segment_id[slot] or bucket > self.segment_bucket[slot]:
+                    self.segment_id[slot], self.segment_bucket[slot], self.segment_box[slot] = new_id[0], bucket, box
+                ids.append(new_id)
+                out_boxes.append(box[None])
+            out_buckets.append(group_buckets[group:group + 1])
+            out_slots.append(group_slots[group:group + 1])
+        
+        # Each device's newest period, all at once
+        group_slots, group_buckets, boxes = group_slots[last], group_buckets[last], boxes[last]
+        current_id = self.segment_id[group_slots]
+        current_bucket = self.segment_bucket[group_slots]
+        current_box = self.segment_box[group_slots]
+        opened = (current_id == 0) | (group_buckets > current_bucket)
+        late = (current_id != 0) & (group_buckets < current_bucket)
+        grown = self._union(current_box, boxes)
+        extended = ~opened & ~late & (grown != current_box).any(axis=1)
+        
+        opened_ids = self._new_ids(int(np.count_nonzero(opened)))
+        self.segment_id[group_slots[opened]] = opened_ids
+        self.segment_bucket[group_slots[opened]] = group_buckets[opened]
+        self.segment_box[group_slots[opened]] = boxes[opened]
+        self.segment_box[group_slots[extended]] = grown[extended]
+        
+        for mask, mask_ids, mask_boxes in (
+            (opened, opened_ids, boxes[opened]),
+            (extended, current_id[extended], grown[extended]),
+            (late, self._new_ids(int(np.count_nonzero(late))), boxes[late])  # closed segments of their own
+        ):
+            ids.append(mask_ids)
+            out_boxes.append(mask_boxes)
+            out_buckets.append(group_buckets[mask])
+            out_slots.append(group_slots[mask])
+        
+        begins = np.concatenate(out_buckets) * self.segment_seconds
+        devices = self.grid.devices
+        return [
+            (segment_id, min_lat, max_lat, min_lon, max_lon, begin, begin + self.segment_seconds, devices[slot])
+            for segment_id, (min_lat, max_lat, min_lon, max_lon), begin, slot in zip(
+                np.concatenate(ids).tolist(), np.concatenate(out_boxes).tolist(),
+                begins.tolist(), np.concatenate(out_slots).tolist()
+            )
+        ]
+    
+    @staticmethod
+    def _union(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Row-wise union of (min_lat, max_lat, min_lon, max_lon) boxes"""
+        return np.column_stack([
+            np.minimum(a[:, 0], b[:, 0]), np.maximum(a[:, 1], b[:, 1]),
+            np.minimum(a[:, 2], b[:, 2]), np.maximum(a[:, 3], b[:, 3])
+        ])
+    
+    def geofences(self) -> List[dict]:
+        return [self.fences.describe(name) for name in self.fences.names]
+    
+    def describe(self) -> dict:
+        """Index sizes and counters for /api/status"""
+        batches = self.stats["batches"]
+        return {
+            "devices_located": len(self.grid),
+            "grid_cells": len(self.grid.cells),
+            "geofences": len(self.fences),
+            "open_segments": int(np.count_nonzero(self.segment_id)),
+            **self.stats,
+            "total_ms": round(self.stats["total_ms"], 3),
+            "avg_batch_ms": round(self.stats["total_ms"] / batches, 3) if batches else 0.0
+        }
+
+
+def merge_windows(windows: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Sorted, non-overlapping union of (start, end) intervals"""
+    merged: List[List[float]] = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def scaled(value: Optional[float]) -> Optional[int]:
+    """Degrees -> stored integer units"""
+    return None if value is None else int(round(value * SCALE))
@@ -0,0 +1,208 @@
+"""
+Keyset-paginated device history
+Pages run newest first over the hot table and continue into the cold
+archive. The opaque cursor holds the sort key of the last row returned, so
+every page is an index seek from that key (no OFFSET): fetching page 1000
+costs the same as page 1. Rows are read from a streaming cursor and can be
+sent as they arrive (json_chunks).
+"""
+
+import asyncio
+import base64
+import json
+import logging
+from datetime import date, datetime, time
+from typing import List, Optional
+
+from config import Config
+from ingest import ValidationError, normalize_timestamp
+from sensor_schema import SENSOR_FIELDS
+from storage import to_epoch_ms, from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(state: dict) -> str:
+    data = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded))
+        datetime.fromisoformat(state["t"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if "a" not in state and not isinstance(state.get("k"), list):
+        raise ValueError("Invalid cursor")
+    return state
+
+
+def parse_fields(value) -> Optional[List[str]]:
+    """Comma-separated (or list of) sensor fields -> validated list, None for all"""
+    if not value:
+        return None
+    fields = value.split(",") if isinstance(value, str) else list(value)
+    fields = [field.strip() for field in fields if field.strip()]
+    unknown = [field for field in fields if field not in SENSOR_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def parse_time(value: Optional[str], name: str, end: bool = False) -> Optional[str]:
+    """
+    Query bound -> naive local ISO-8601, comparable with stored timestamps
+    (Z and UTC offsets converted). Bounds are inclusive, so a date-only end
+    bound covers that whole day.
+    """
+    if not value:
+        return None
+    try:
+        moment = normalize_timestamp(value)
+    except ValidationError:
+        raise ValueError(f"'{name}' must be an ISO-8601 timestamp")
+    if end and _is_date(value):
+        moment = datetime.combine(moment.date(), time.max)
+    return moment.isoformat()
+
+
+def _is_date(value: str) -> bool:
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+class HistoryQuery:
+    """One page of readings for a device, newest first"""
+    
+    def __init__(self, database, device_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                 fields=None, cursor: Optional[str] = None, limit: int = 100):
+        self.database = database
+        self.device_id = device_id
+        self.start = parse_time(start, "from")
+        self.end = parse_time(end, "to", end=True)
+        self.fields = parse_fields(fields)
+        self.state = decode_cursor(cursor) if cursor else None
+        self.limit = max(1, min(int(limit), Config.HISTORY_MAX_PAGE))
+        
+        self.count = 0
+        self.next_cursor: Optional[str] = None
+    
+    def _project(self, row: dict) -> dict:
+        if self.fields is None:
+            return row
+        result = {"device_id": row["device_id"], "timestamp": row["timestamp"]}
+        for field in self.fields:
+            result[field] = row.get(field)
+        return result
+    
+    def _hot_query(self):
+        storage = self.database.storage
+        conditions = [f"{storage.device_column} = ?"]
+        args = [storage.device_arg(self.device_id, self.database.devices.key(self.device_id))]
+        if self.start:
+            conditions.append(f"{storage.time_column} >= ?")
+            args.append(storage.time_arg(self.start))
+        if self.end:
+            conditions.append(f"{storage.time_column} <= ?")
+            args.append(storage.time_arg(self.end))
+        if self.state:
+            key = storage.key_columns
+            conditions.append(f"({', '.join(key)}) < ({', '.join('?' * len(key))})")
+            args.extend(self.state["k"])
+        
+        order = ", ".join(f"{column} DESC" for column in storage.key_columns)
+        sql = storage.select(f"""
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order}
+            LIMIT ?
+        """, self.fields)
+        return sql, args + [self.limit]
+    
+    async def rows(self):
+        """Yield the page's rows; next_cursor is set once exhausted"""
+        storage = self.database.storage
+        last = None
+        
+        # First page of the latest readings: straight from the hot cache
+        cache = self.database.hot_cache
+        if not (self.start or self.end or self.state):
+            if cache.covers_device(self.device_id, self.limit):
+                for row in cache.device_data(self.device_id, self.limit):
+                    last = row
+                    self.count += 1
+                    yield self._project(row)
+                if self.count == self.limit:
+                    key = storage.key_from(last["timestamp"], cache.last_key(self.device_id, self.limit))
+                    self.next_cursor = encode_cursor({"t": last["timestamp"], "k": key})
+                return
+            cache.miss()
+        
+        if not (self.state and self.state.get("a")):
+            sql, args = self._hot_query()
+            async for row in self.database.readers.stream(sql, args, Config.READ_FETCH_SIZE):
+                last = dict(row)
+                self.count += 1
+                yield self._project(last)
+            if self.count == self.limit:
+                self.next_cursor = encode_cursor({"t": last["timestamp"], "k": storage.cursor_key(last)})
+                return
+        
+        # Older than anything left in the hot table: continue in the archive
+        if not self.database.archive.days(self.device_id):
+            return
+        if last:
+            before = last["timestamp"]
+        elif self.state:
+            before = self.state["t"]
+        elif self.end:
+            before = from_epoch_ms(to_epoch_ms(self.end) + 1)
+        else:
+            before = None
+        
+        archived = await asyncio.to_thread(
+            self.database.archive.read_latest, self.device_id, before, self.limit - self.count, self.start
+        )
+        for row in archived:
+            last = row
+            self.count += 1
+            yield self._project(row)
+        if archived and self.count == self.limit:
+            self.next_cursor = encode_cursor({"t": last["timestamp"], "a": 1})
+    
+    async def fetch(self) -> dict:
+        """Whole page as a response dict"""
+        data = [row async for row in self.rows()]
+        return {
+            "device_id": self.device_id,
+            "data": data,
+            "count": self.count,
+            "next_cursor": self.next_cursor
+        }
+    
+    async def json_chunks(self):
+        """The fetch() response encoded incrementally, for StreamingResponse"""
+        yield f'{{"device_id": {json.dumps(self.device_id)}, "data": ['
+        chunk = []
+        error = None
+        try:
+            async for row in self.rows():
+                chunk.append(json.dumps(row))
+                if len(chunk) >= Config.READ_FETCH_SIZE:
+                    yield ("," if self.count > len(chunk) else "") + ",".join(chunk)
+                    chunk = []
+        except Exception as e:
+            logger.error(f"Error streaming device history: {e}")
+            error = str(e) or type(e).__name__
+            self.next_cursor = None
+        if chunk:
+            yield ("," if self.count > len(chunk) else "") + ",".join(chunk)
+        
+        tail = f'], "count": {self.count}, "next_cursor": {json.dumps(self.next_cursor)}'
+        if error:
+            tail += f', "error": {json.dumps(error)}'
+        yield tail + "}"
@@ -0,0 +1,261 @@
+"""
+Hot cache of the latest readings per device
+Each device gets a fixed-capacity ring buffer preallocated as typed arrays:
+one column per sensor field (typed as in the sensor schema), timestamps as
+int64 microseconds for ordering, the storage row key (legacy id or compact
+ts) for pagination cursors, and a null bitmask per slot. The stored
+timestamp text is kept as is so cached rows match the database exactly.
+The batch writer appends committed rows; the cache is warmed from the
+database at startup. Recent data, first history pages, the dashboard
+snapshot and chart windows are served from here without SQL.
+"""
+
+import heapq
+import logging
+import sys
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+from sensor_schema import SENSOR_CONFIG, SENSOR_FIELDS, STRUCT_CODES
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Struct codes double as array typecodes
+FIELD_CODES = [STRUCT_CODES[sensor["type"]] for sensor in SENSOR_CONFIG]
+FIELD_INDEX = {field: i for i, field in enumerate(SENSOR_FIELDS)}
+
+
+def to_micros(timestamp: str) -> int:
+    """Naive local ISO-8601 timestamp -> microseconds (exact, no tz conversion)"""
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return (moment - EPOCH) // MICROSECOND
+
+
+class DeviceRing:
+    """Ring buffer of one device's latest readings, ordered by timestamp"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.head = 0  # next slot to write
+        self.ts = array('q', bytes(8 * capacity))
+        self.row_keys = array('q', bytes(8 * capacity))
+        self.nulls = array('H', bytes(2 * capacity))  # bit i set = field i is NULL
+        self.columns = [array(code, bytes(array(code).itemsize * capacity)) for code in FIELD_CODES]
+        self.stamps: List[Optional[str]] = [None] * capacity
+        
+        # slot -> {field index: value} for values that do not fit the column
+        # type (e.g. a float sent for an int32 field); kept so rows match SQLite
+        self.extras: Dict[int, Dict[int, object]] = {}
+        
+        # True while the ring holds every stored reading of the device
+        self.complete = True
+    
+    def _write(self, slot: int, micros: int, stamp: str, key: int, values: tuple):
+        self.ts[slot] = micros
+        self.stamps[slot] = stamp
+        self.row_keys[slot] = key
+        mask = 0
+        extras = None
+        for i, value in enumerate(values):
+            if value is None:
+                mask |= 1 << i
+                self.columns[i][slot] = 0
+                continue
+            try:
+                self.columns[i][slot] = value
+            except (TypeError, OverflowError):
+                self.columns[i][slot] = 0
+                extras = extras or {}
+                extras[i] = value
+        self.nulls[slot] = mask
+        if extras:
+            self.extras[slot] = extras
+        else:
+            self.extras.pop(slot, None)
+    
+    def _copy(self, source: int, target: int):
+        self.ts[target] = self.ts[source]
+        self.stamps[target] = self.stamps[source]
+        self.row_keys[target] = self.row_keys[source]
+        self.nulls[target] = self.nulls[source]
+        for column in self.columns:
+            column[target] = column[source]
+        if source in self.extras:
+            self.extras[target] = self.extras[source]
+        else:
+            self.extras.pop(target, None)
+    
+    def _slot(self, age: int) -> int:
+        """Slot of the age-th newest reading (0 = newest)"""
+        return (self.head - 1 - age) % self.capacity
+    
+    def append(self, stamp: str, key: int, values: tuple):
+        """Add a reading, keeping timestamp order for late arrivals"""
+        micros = to_micros(stamp)
+        if self.size == self.capacity:
+            self.complete = False
+            if micros < self.ts[self._slot(self.size - 1)]:
+                return  # older than everything kept
+        
+        # Shift newer readings up one slot (only for out-of-order readings)
+        age = 0
+        while age < self.size and self.ts[self._slot(age)] > micros:
+            age += 1
+        
+        slot = self.head
+        for step in range(age):
+            source = self._slot(step)
+            self._copy(source, slot)
+            slot = source
+        self._write(slot, micros, stamp, key, values)
+        
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def order_keys(self, device_id: str):
+        """(timestamp, device_id, age) newest first, for merging devices"""
+        for age in range(self.size):
+            yield self.ts[self._slot(age)], device_id, age
+    
+    def row(self, device_id: str, age: int) -> dict:
+        slot = self._slot(age)
+        mask = self.nulls[slot]
+        row = {"device_id": device_id, "timestamp": self.stamps[slot]}
+        for i, field in enumerate(SENSOR_FIELDS):
+            row[field] = None if mask & (1 << i) else self.columns[i][slot]
+        if slot in self.extras:
+            for i, value in self.extras[slot].items():
+                row[SENSOR_FIELDS[i]] = value
+        return row
+    
+    def newest(self, device_id: str, limit: int) -> List[dict]:
+        return [self.row(device_id, age) for age in range(min(limit, self.size))]
+    
+    def key(self, age: int) -> int:
+        return self.row_keys[self._slot(age)]
+    
+    def window(self, fields: List[str], size: int) -> dict:
+        """Latest size readings as columns, oldest first"""
+        slots = [self._slot(age) for age in range(min(size, self.size) - 1, -1, -1)]
+        columns = {}
+        for field in fields:
+            i = FIELD_INDEX[field]
+            bit = 1 << i
+            column = self.columns[i]
+            values = [None if self.nulls[slot] & bit else column[slot] for slot in slots]
+            if self.extras:
+                for n, slot in enumerate(slots):
+                    if i in self.extras.get(slot, ()):
+                        values[n] = self.extras[slot][i]
+            columns[field] = values
+        return {
+            "timestamps": [self.stamps[slot] for slot in slots],
+            "fields": columns
+        }
+    
+    def nbytes(self) -> int:
+        """Preallocated bytes, excluding the timestamp strings themselves"""
+        arrays = [self.ts, self.row_keys, self.nulls] + self.columns
+        return sum(sys.getsizeof(a) for a in arrays) + sys.getsizeof(self.stamps) + sys.getsizeof(self)
+
+
+class HotCache:
+    """Ring buffers for every known device"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rings: Dict[str, DeviceRing] = {}
+        self.warm = False
+        
+        # Statistics
+        self.stats = {
+            "hits": 0,
+            "misses": 0
+        }
+    
+    def _ring(self, device_id: str) -> DeviceRing:
+        ring = self.rings.get(device_id)
+        if ring is None:
+            ring = DeviceRing(self.capacity)
+            self.rings[device_id] = ring
+        return ring
+    
+    def clear(self):
+        self.rings = {}
+        self.warm = False
+    
+    def add(self, rows: Iterable[tuple], keys: Iterable[int]):
+        """Append committed rows (device_id, timestamp, *SENSOR_FIELDS) with their row keys"""
+        for row, key in zip(rows, keys):
+            self._ring(row[0]).append(row[1], key, row[2:])
+    
+    def load(self, device_id: str, rows: List, keys: List[int], complete: bool):
+        """Warm one device from database rows, newest first"""
+        ring = self._ring(device_id)
+        for row, key in zip(reversed(rows), reversed(keys)):
+            ring.append(row["timestamp"], key, tuple(row[field] for field in SENSOR_FIELDS))
+        ring.complete = complete and len(rows) < self.capacity
+    
+    def covers_device(self, device_id: str, limit: int) -> bool:
+        """Can the latest limit readings of the device be served from the cache?"""
+        if not self.warm or limit > self.capacity:
+            return False
+        ring = self.rings.get(device_id)
+        if ring is None:
+            return False
+        return ring.size >= limit or ring.complete
+    
+    def covers_recent(self, limit: int) -> bool:
+        """
+        The newest limit readings overall are among every device's newest
+        limit, so the cache is exact when each ring holds that many (or all)
+        """
+        if not self.warm or limit > self.capacity:
+            return False
+        return all(ring.size >= limit or ring.complete for ring in self.rings.values())
+    
+    def miss(self):
+        self.stats["misses"] += 1
+    
+    def device_data(self, device_id: str, limit: int) -> List[dict]:
+        self.stats["hits"] += 1
+        return self.rings[device_id].newest(device_id, limit)
+    
+    def last_key(self, device_id: str, limit: int) -> int:
+        """Row key of the oldest row in device_data(device_id, limit)"""
+        ring = self.rings[device_id]
+        return ring.key(min(limit, ring.size) - 1)
+    
+    def recent(self, limit: int) -> List[dict]:
+        """Newest readings across all devices"""
+        self.stats["hits"] += 1
+        streams = [ring.order_keys(device_id) for device_id, ring in self.rings.items()]
+        merged = islice(heapq.merge(*streams, reverse=True), limit)
+        return [self.rings[device_id].row(device_id, age) for _, device_id, age in merged]
+    
+    def window(self, device_id: str, fields: List[str], size: int) -> Optional[dict]:
+        ring = self.rings.get(device_id)
+        if ring is None:
+            return None
+        self.stats["hits"] += 1
+        return ring.window(fields, min(size, self.capacity))
+    
+    def describe(self) -> dict:
+        """Cache size and memory for /api/status"""
+        per_device = DeviceRing(self.capacity).nbytes()
+        return {
+            "capacity_per_device": self.capacity,
+            "devices": len(self.rings),
+            "bytes_per_device": per_device,
+            "total_bytes": per_device * len(self.rings),
+            "warm": self.warm,
+            **self.stats
+        }
@@ -0,0 +1,594 @@
+"""
+Offline bulk import of sensor readings: SD-card logs, exports, other farms
+Streams a CSV or NDJSON file (optionally .gz, e.g. from /api/export) or
+another farmtech_data.db into this database in large executemany
+transactions, bypassing the per-reading API path. While loading, the
+writer PRAGMAs are relaxed (synchronous=OFF, exclusive locking, a large
+page cache) and the sensor table's secondary indexes are dropped; they
+are rebuilt once at the end, followed by rollups, device last_seen and a
+statistics reseed. Rows are deduplicated on (device_id, timestamp) and
+devices are upserted once each. The position in the source is
+checkpointed in statistics_state with every transaction, so an
+interrupted import resumes where it stopped (and a grown log file only
+loads its new records).
+
+Run it with the server stopped.
+
+Usage:
+    python importer.py sdcard_2026-03.csv
+    python importer.py farmtech_export_20260301.ndjson.gz
+    python importer.py ../other_farm/farmtech_data.db --batch 200000
+    python importer.py sdcard_2026-03.csv --restart   # ignore the checkpoint
+
+CSV needs a header row with device_id, timestamp and any of the sensor
+fields. Columns named like the export ("Suhu Kaki (°C)") and floats in
+NDJSON are scaled values and are converted back to raw integers.
+"""
+
+import argparse
+import asyncio
+import csv
+import fcntl
+import gzip
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+from operator import itemgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import aiosqlite
+
+import rollups
+from config import Config
+from database import Database
+from ingest import ValidationError, normalize_timestamp
+from sensor_schema import FIELD_RANGES, SCALE_DIVISORS, SENSOR_FIELDS, SENSORS_BY_FIELD
+from storage import LAYOUTS, get_storage
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = "import.{source}"
+
+FORMATS = ("csv", "ndjson", "sqlite")
+SUFFIXES = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".db": "sqlite",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite"
+}
+
+RANGES = [(field, *FIELD_RANGES[field]) for field in SENSOR_FIELDS]
+
+# CSV header -> (field, divisor); raw field names carry raw integers (divisor None)
+CSV_COLUMNS = {field: (field, None) for field in SENSOR_FIELDS}
+CSV_COLUMNS.update({
+    f"{SENSORS_BY_FIELD[field]['displayName']} ({SENSORS_BY_FIELD[field]['unit']})": (field, SCALE_DIVISORS[field])
+    for field in SENSOR_FIELDS
+})
+
+
+class Batch(NamedTuple):
+    """Source records converted for one transaction"""
+    rows: List[tuple]  # (device_id, timestamp, *SENSOR_FIELDS)
+    records: int  # source records consumed, including rejected and skipped ones
+    errors: List[tuple]  # (record number, message)
+    archived: int  # rows older than the archive horizon, skipped
+    latest: Dict[str, str]  # device_id -> newest timestamp
+    earliest: Optional[str]
+
+
+def detect_format(path: str) -> str:
+    """Format from the file name (.gz stripped), else from the SQLite header"""
+    name = path[:-3] if path.endswith(".gz") else path
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix in SUFFIXES:
+        return SUFFIXES[suffix]
+    with open(path, "rb") as stream:
+        if stream.read(16) == b"SQLite format 3\x00":
+            return "sqlite"
+    raise SystemExit(f"Cannot tell the format of {path}, pass --format")
+
+
+def open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def check_ranges(values: list) -> tuple:
+    for (field, low, high), value in zip(RANGES, values):
+        if value is not None and not low <= value <= high:
+            raise ValidationError(f"{field} out of range")
+    return tuple(values)
+
+
+def convert_record(record) -> tuple:
+    """NDJSON object (API or export shape) -> row; floats are scaled values"""
+    if not isinstance(record, dict):
+        raise ValidationError("Record must be an object")
+    device_id = record.get("device_id")
+    if not isinstance(device_id, str) or not device_id:
+        raise ValidationError("Missing device_id")
+    if record.get("timestamp") is None:
+        raise ValidationError("Missing timestamp")
+    timestamp = normalize_timestamp(record["timestamp"]).isoformat()
+    
+    values = []
+    for field in SENSOR_FIELDS:
+        value = record.get(field)
+        if isinstance(value, float):
+            try:
+                value = round(value * SCALE_DIVISORS[field])
+            except (ValueError, OverflowError):
+                raise ValidationError(f"{field} must be a number")
+        elif value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            raise ValidationError(f"{field} must be a number")
+        values.append(value)
+    return (device_id, timestamp) + check_ranges(values)
+
+
+def read_csv(path: str, skip: int) -> Iterator:
+    """One row, None (blank line) or ValidationError per data line"""
+    with open_text(path) as stream:
+        reader = csv.reader(stream)
+        header = [name.strip() for name in next(reader, [])]
+        if "device_id" not in header or "timestamp" not in header:
+            raise SystemExit(f"{path}: CSV header needs device_id and timestamp columns")
+        device_column = header.index("device_id")
+        time_column = header.index("timestamp")
+        
+        # (column, field position, divisor, low, high); range and conversion checked in one pass
+        columns = []
+        for index, name in enumerate(header):
+            if name in CSV_COLUMNS:
+                field, divisor = CSV_COLUMNS[name]
+                columns.append((index, SENSOR_FIELDS.index(field), divisor, *FIELD_RANGES[field]))
+        unknown = [name for name in header if name not in CSV_COLUMNS and name not in ("device_id", "timestamp")]
+        if unknown:
+            logger.warning(f"Ignoring CSV columns: {', '.join(unknown)}")
+        
+        width = len(SENSOR_FIELDS)
+        for cells in itertools.islice(reader, skip, None):
+            if not cells:
+                yield None
+                continue
+            try:
+                device_id = cells[device_column]
+                if not device_id:
+                    raise ValidationError("Missing device_id")
+                timestamp = cells[time_column]
+                if not timestamp:
+                    raise ValidationError("Missing timestamp")
+                timestamp = normalize_timestamp(int(timestamp) if timestamp.isdigit() else timestamp).isoformat()
+                
+                values = [None] * width
+                for index, position, divisor, low, high in columns:
+                    text = cells[index]
+                    if not text:
+                        continue
+                    try:
+                        value = int(text) if divisor is None else round(float(text) * divisor)
+                    except (ValueError, OverflowError):
+                        raise ValidationError(f"{SENSOR_FIELDS[position]} must be a number")
+                    if not low <= value <= high:
+                        raise ValidationError(f"{SENSOR_FIELDS[position]} out of range")
+                    values[position] = value
+                yield (device_id, timestamp, *values)
+            except IndexError:
+                yield ValidationError("Too few columns")
+            except ValidationError as e:
+                yield e
+
+
+def read_ndjson(path: str, skip: int) -> Iterator:
+    """One row, None (blank line) or ValidationError per line"""
+    with open_text(path) as stream:
+        for line in itertools.islice(stream, skip, None):
+            if not line.strip():
+                yield None
+                continue
+            try:
+                yield convert_record(json.loads(line))
+            except json.JSONDecodeError:
+                yield ValidationError("Invalid JSON")
+            except ValidationError as e:
+                yield e
+
+
+def source_tables(path: str) -> List[str]:
+    """Sensor tables present in a source database, legacy first"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as source:
+        names = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [layout for layout, storage in LAYOUTS.items() if storage.table in names]
+
+
+def source_devices(path: str) -> Dict[str, tuple]:
+    """device_id -> (cow_id, firmware_version) from a source database"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as source:
+        try:
+            rows = source.execute("SELECT device_id, cow_id, firmware_version FROM devices").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def read_sqlite(path: str, skip: int, fetch_size: int = 10000) -> Iterator:
+    """One row or ValidationError per reading of another database, in key order"""
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        for layout in source_tables(path):
+            storage = get_storage(layout)
+            count = source.execute(f"SELECT COUNT(*) FROM {storage.table}").fetchone()[0]
+            if skip >= count:
+                skip -= count
+                continue
+            
+            order = "ORDER BY id" if layout == "legacy" else "ORDER BY r.device_key, r.ts"
+            cursor = source.execute(storage.select(f"{order} LIMIT -1 OFFSET ?", list(SENSOR_FIELDS)), (skip,))
+            skip = 0
+            offset = 1 if layout == "legacy" else 0  # legacy rows lead with id
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    try:
+                        timestamp = normalize_timestamp(row[offset + 1]).isoformat()
+                        yield (row[offset], timestamp) + check_ranges(list(row[offset + 2:]))
+                    except ValidationError as e:
+                        yield e
+    finally:
+        source.close()
+
+
+READERS = {
+    "csv": read_csv,
+    "ndjson": read_ndjson,
+    "sqlite": read_sqlite
+}
+
+
+def batches(records: Iterator, size: int, first: int, archived_until: Optional[str]) -> Iterator[Batch]:
+    """Group records into Batches; first = number of the first record"""
+    number = first
+    while True:
+        rows = []
+        errors = []
+        archived = 0
+        consumed = 0
+        latest: Dict[str, str] = {}
+        earliest = None
+        for record in itertools.islice(records, size):
+            consumed += 1
+            if record is None:
+                continue
+            if isinstance(record, ValidationError):
+                errors.append((number + consumed - 1, str(record)))
+                continue
+            device_id, timestamp = record[0], record[1]
+            if archived_until and timestamp < archived_until:
+                archived += 1
+                continue
+            rows.append(record)
+            if timestamp > latest.get(device_id, ""):
+                latest[device_id] = timestamp
+            if earliest is None or timestamp < earliest:
+                earliest = timestamp
+        if not consumed:
+            return
+        number += consumed
+        yield Batch(rows, consumed, errors, archived, latest, earliest)
+
+
+def lock_writer(database_path: str):
+    """Take the writer lock the server's workers elect on; fail if a server holds it"""
+    lock = open(database_path + ".writer.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise SystemExit(f"{database_path} is open by a running server, stop it before importing")
+    return lock
+
+
+async def get_checkpoint(db, name: str) -> Optional[dict]:
+    cursor = await db.execute("SELECT value FROM statistics_state WHERE name = ?", (name,))
+    row = await cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+async def set_checkpoint(db, name: str, state: dict):
+    await db.execute("""
+        INSERT INTO statistics_state (name, value, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (name, json.dumps(state)))
+
+
+class BulkImporter:
+    """Loads Batches into the writer connection of a Database"""
+    
+    def __init__(self, database: Database, checkpoint: str, devices: Dict[str, tuple], cache_mb: int):
+        self.database = database
+        self.db = database.db
+        self.storage = database.storage
+        self.checkpoint = checkpoint
+        self.source_devices = devices  # device_id -> (cow_id, firmware_version)
+        self.cache_mb = cache_mb
+        self.upserted: set = set()
+        self.state: dict = {}
+        
+        # Statistics
+        self.stats = {
+            "records": 0,
+            "inserted": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "archived": 0,
+            "devices": 0
+        }
+        self.errors: Dict[str, int] = {}
+    
+    async def begin(self, restart: bool):
+        """Relax durability for the load and pick up the checkpoint"""
+        await self.db.execute("PRAGMA synchronous = OFF")
+        await self.db.execute("PRAGMA locking_mode = EXCLUSIVE")
+        await self.db.execute(f"PRAGMA cache_size = -{self.cache_mb * 1024}")
+        
+        state = await get_checkpoint(self.db, self.checkpoint)
+        if state and state.get("layout") != self.storage.name:
+            logger.warning(f"Checkpoint was written for the {state.get('layout')} layout, starting over")
+            state = None
+        self.state = state or {"layout": self.storage.name, "records": 0, "pending": False}
+        if restart:
+            self.state["records"] = 0  # an unfinished load's indexes and dedupe range are kept
+        if self.state["records"]:
+            logger.info(f"Resuming after record {self.state['records']}")
+    
+    async def _drop_indexes(self):
+        """Drop the sensor table's secondary indexes (their SQL is kept in the checkpoint)"""
+        cursor = await self.db.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (self.storage.table,)
+        )
+        indexes = dict(self.state.get("indexes", {}))
+        for name, sql in await cursor.fetchall():
+            indexes[name] = sql
+            await self.db.execute(f"DROP INDEX {name}")
+        self.state["indexes"] = indexes
+        if self.storage.name == "legacy" and "after_id" not in self.state:
+            cursor = await self.db.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_data")
+            self.state["after_id"] = (await cursor.fetchone())[0]
+        self.state["pending"] = True
+        logger.info(f"Dropped {len(indexes)} indexes on {self.storage.table} for the load")
+    
+    async def _upsert_devices(self, device_ids: List[str]):
+        """Register devices first seen in this import (caller commits)"""
+        await self.db.executemany("""
+            INSERT INTO devices (device_id, cow_id, firmware_version, status)
+            VALUES (?, ?, ?, 'active')
+            ON CONFLICT(device_id) DO UPDATE SET
+                cow_id = COALESCE(devices.cow_id, excluded.cow_id),
+                firmware_version = COALESCE(devices.firmware_version, excluded.firmware_version)
+        """, [(device_id, *self.source_devices.get(device_id, (None, None))) for device_id in device_ids])
+        
+        registry = self.database.devices
+        for start in range(0, len(device_ids), 500):
+            chunk = device_ids[start:start + 500]
+            cursor = await self.db.execute(
+                f"SELECT * FROM devices WHERE device_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for row in await cursor.fetchall():
+                registry.devices[row['device_id']] = dict(row)
+        self.upserted.update(device_ids)
+        self.stats["devices"] += len(device_ids)
+    
+    async def write(self, batch: Batch):
+        """One transaction: devices, readings and the checkpoint"""
+        if not self.state["pending"]:
+            await self._drop_indexes()
+        
+        inserted = 0
+        if batch.rows:
+            fresh = [device_id for device_id in batch.latest if device_id not in self.upserted]
+            if fresh:
+                await self._upsert_devices(fresh)
+            
+            device_keys = {device_id: self.database.devices.key(device_id) for device_id in batch.latest}
+            params = self.storage.insert_params(batch.rows, device_keys)
+            if self.storage.name != "legacy":
+                params.sort(key=itemgetter(0, 1))  # clustered key order: pages filled in sequence
+            cursor = await self.db.executemany(self.storage.insert_sql, params)
+            inserted = cursor.rowcount if cursor.rowcount >= 0 else len(params)
+        
+        self.state["records"] += batch.records
+        if inserted:
+            self.state["inserted"] = self.state.get("inserted", 0) + inserted
+            if batch.earliest < self.state.get("earliest", "~"):
+                self.state["earliest"] = batch.earliest
+        await set_checkpoint(self.db, self.checkpoint, self.state)
+        await self.db.commit()
+        
+        for device_id, timestamp in batch.latest.items():
+            self.database.devices.touch(device_id, timestamp)
+        for number, message in batch.errors:
+            if self.stats["rejected"] < 10:
+                logger.warning(f"Record {number} rejected: {message}")
+            self.stats["rejected"] += 1
+            self.errors[message] = self.errors.get(message, 0) + 1
+        self.stats["records"] += batch.records
+        self.stats["inserted"] += inserted
+        self.stats["duplicates"] += len(batch.rows) - inserted
+        self.stats["archived"] += batch.archived
+    
+    async def _rebuild_indexes(self):
+        cursor = await self.db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing = {row[0] for row in await cursor.fetchall()}
+        for name, sql in self.state.get("indexes", {}).items():
+            if name not in existing:
+                await self.db.execute(sql)
+        await self.storage.create_tables(self.db)
+    
+    async def _dedupe_legacy(self) -> int:
+        """sensor_data has no unique key: drop imported rows that repeat an earlier (device_id, timestamp)"""
+        cursor = await self.db.execute("""
+            DELETE FROM sensor_data
+            WHERE id > ? AND EXISTS (
+                SELECT 1 FROM sensor_data AS earlier
+                WHERE earlier.device_id = sensor_data.device_id
+                  AND earlier.timestamp = sensor_data.timestamp
+                  AND earlier.id < sensor_data.id
+            )
+        """, (self.state["after_id"],))
+        return cursor.rowcount
+    
+    async def finish(self) -> dict:
+        """Indexes, dedupe, rollups, devices and statistics, then durable again"""
+        timings = {}
+        if self.state["pending"]:
+            started = time.perf_counter()
+            await self._rebuild_indexes()
+            await self.db.commit()
+            timings["indexes_s"] = round(time.perf_counter() - started, 2)
+            
+            if self.storage.name == "legacy":
+                started = time.perf_counter()
+                removed = await self._dedupe_legacy()
+                await self.db.commit()
+                self.stats["inserted"] -= removed
+                self.stats["duplicates"] += removed
+                self.state["inserted"] = self.state.get("inserted", 0) - removed
+                timings["dedupe_s"] = round(time.perf_counter() - started, 2)
+            
+            if self.state.get("inserted"):
+                started = time.perf_counter()
+                since = self.state["earliest"][:10] + "T00:00:00"
+                archived_until = await self.database.retention.archived_until(self.db)
+                await rollups.rebuild(self.db, source=self.storage.source, since=max(since, archived_until or since))
+                await self.db.commit()
+                timings["rollups_s"] = round(time.perf_counter() - started, 2)
+                
+                # The server rebuilds its counters from the rollups on the next start
+                await self.database.statistics.invalidate(self.db)
+                await self.db.commit()
+        
+        await self.database.flush_devices()
+        self.state["pending"] = False
+        for key in ("indexes", "after_id", "inserted", "earliest"):
+            self.state.pop(key, None)
+        await set_checkpoint(self.db, self.checkpoint, self.state)
+        await self.db.commit()
+        
+        await self.db.execute(f"PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS}")
+        await self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await self.db.execute("PRAGMA optimize")
+        return timings
+
+
+async def run_import(args) -> dict:
+    fmt = args.format or detect_format(args.source)
+    if fmt == "sqlite" and os.path.exists(args.database) and os.path.samefile(args.source, args.database):
+        raise SystemExit("Source and target are the same database")
+    
+    database = Database()
+    database.db_path = args.database
+    database.storage = get_storage(args.layout)
+    database.db = await aiosqlite.connect(args.database)
+    database.db.row_factory = aiosqlite.Row
+    try:
+        await database.configure_writer()
+        await database.create_tables()
+        cursor = await database.db.execute("SELECT * FROM devices")
+        database.devices.load(await cursor.fetchall())
+        
+        importer = BulkImporter(
+            database,
+            CHECKPOINT.format(source=os.path.abspath(args.source)),
+            source_devices(args.source) if fmt == "sqlite" else {},
+            args.cache_mb
+        )
+        await importer.begin(args.restart)
+        skip = importer.state["records"]
+        archived_until = await database.retention.archived_until(database.db)
+        source = batches(READERS[fmt](args.source, skip), args.batch, skip + 1, archived_until)
+        
+        started = time.perf_counter()
+        reported = started
+        
+        # Parse the next batch in a thread while SQLite writes the current one
+        pending = asyncio.ensure_future(asyncio.to_thread(next, source, None))
+        while True:
+            batch = await pending
+            if batch is None:
+                break
+            pending = asyncio.ensure_future(asyncio.to_thread(next, source, None))
+            await importer.write(batch)
+            
+            now = time.perf_counter()
+            if now - reported >= args.progress:
+                reported = now
+                stats = importer.stats
+                rate = stats["records"] / (now - started)
+                logger.info(
+                    f"{skip + stats['records']} records read, {stats['inserted']} inserted, "
+                    f"{stats['duplicates']} duplicate, {stats['rejected']} rejected "
+                    f"({rate:.0f} rows/s, {rate * 60 / 1e6:.2f}M rows/min)"
+                )
+        load_seconds = time.perf_counter() - started
+        
+        if not importer.stats["records"] and not importer.state["pending"]:
+            logger.info(f"Nothing new in {args.source} since the checkpoint (use --restart to read it again)")
+        timings = await importer.finish()
+        
+        elapsed = time.perf_counter() - started
+        return {
+            "source": args.source,
+            "format": fmt,
+            "layout": database.storage.name,
+            **importer.stats,
+            "errors": importer.errors,
+            "load_s": round(load_seconds, 2),
+            **timings,
+            "total_s": round(elapsed, 2),
+            "rows_per_min": round(importer.stats["records"] / elapsed * 60) if elapsed else 0
+        }
+    finally:
+        await database.db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import sensor readings (run with the server stopped)")
+    parser.add_argument("source", help="CSV or NDJSON file (optionally .gz) or another farmtech database")
+    parser.add_argument("--format", choices=FORMATS, help="source format (default: from the file name)")
+    parser.add_argument("--database", default=Config.DATABASE_PATH)
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default=Config.STORAGE_LAYOUT)
+    parser.add_argument("--batch", type=int, default=100000, help="rows per transaction")
+    parser.add_argument("--cache-mb", type=int, default=256, help="SQLite page cache during the load")
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint, read the source from the start")
+    args = parser.parse_args()
+    
+    lock = lock_writer(args.database)
+    try:
+        result = await run_import(args)
+    finally:
+        lock.close()
+    
+    logger.info(
+        f"Import done: {result['records']} records, {result['inserted']} inserted, "
+        f"{result['duplicates']} duplicate, {result['rejected']} rejected, "
+        f"{result['archived']} older than the archive horizon, {result['devices']} devices "
+        f"in {result['total_s']}s ({result['rows_per_min'] / 1e6:.2f}M rows/min)"
+    )
+    for message, count in sorted(result["errors"].items(), key=lambda item: -item[1]):
+        logger.info(f"  {count} x {message}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Validation helpers for bulk sensor uploads
+Used by POST /api/data/batch, the NDJSON stream endpoint and importer.py
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config import Config
+from sensor_schema import SENSOR_FIELDS, FIELD_RANGES
+
+
+class ValidationError(ValueError):
+    """Rejected sensor record"""
+
+
+def normalize_timestamp(value) -> datetime:
+    """
+    Parse a timestamp without any clock-skew check (bulk imports of old logs).
+    Accepts ISO-8601 strings (naive = server local time) or epoch seconds/milliseconds.
+    Returns a naive local datetime, like the server's own timestamps.
+    """
+    if isinstance(value, bool):
+        raise ValidationError("Invalid timestamp")
+    
+    if isinstance(value, (int, float)):
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            timestamp = datetime.fromtimestamp(seconds)
+        except (OverflowError, OSError, ValueError):
+            raise ValidationError("Invalid timestamp")
+    elif isinstance(value, str):
+        try:
+            timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValidationError("Invalid timestamp")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+    else:
+        raise ValidationError("Invalid timestamp")
+    return timestamp
+
+
+def parse_timestamp(value, now: datetime) -> datetime:
+    """Parse a device-supplied timestamp and check it against the clock-skew window"""
+    timestamp = normalize_timestamp(value)
+    if timestamp > now + timedelta(seconds=Config.INGEST_MAX_FUTURE_SKEW):
+        raise ValidationError("Timestamp too far in the future")
+    if timestamp < now - timedelta(seconds=Config.INGEST_MAX_PAST_AGE):
+        raise ValidationError("Timestamp too old")
+    
+    return timestamp
+
+
+def validate_reading(record, now: datetime, device_id: Optional[str] = None) -> dict:
+    """
+    Validate one uploaded record and return a normalised reading dict.
+    device_id overrides the record's own device_id (e.g. from the URL).
+    """
+    if not isinstance(record, dict):
+        raise ValidationError("Record must be an object")
+    
+    device_id = device_id or record.get("device_id")
+    if not isinstance(device_id, str) or not device_id:
+        raise ValidationError("Missing device_id")
+    
+    reading = {"device_id": device_id}
+    
+    if record.get("timestamp") is None:
+        reading["timestamp"] = now.isoformat()
+    else:
+        reading["timestamp"] = parse_timestamp(record["timestamp"], now).isoformat()
+    
+    for field in SENSOR_FIELDS:
+        value = record.get(field)
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValidationError(f"{field} must be an integer")
+            low, high = FIELD_RANGES[field]
+            if not low <= value <= high:
+                raise ValidationError(f"{field} out of range")
+        reading[field] = value
+    
+    return reading
+
+
+def latest_by_device(readings: List[dict]) -> Dict[str, dict]:
+    """
+    Collapse a batch into one entry per device: the newest reading plus
+    the number of readings and the time span they cover.
+    """
+    devices: Dict[str, dict] = {}
+    for reading in readings:
+        entry = devices.get(reading["device_id"])
+        timestamp = reading["timestamp"]
+        if entry is None:
+            devices[reading["device_id"]] = {
+                "latest": reading,
+                "count": 1,
+                "from": timestamp,
+                "to": timestamp
+            }
+            continue
+        
+        entry["count"] += 1
+        if timestamp >= entry["to"]:
+            entry["to"] = timestamp
+            entry["latest"] = reading
+        if timestamp < entry["from"]:
+            entry["from"] = timestamp
+    
+    return devices
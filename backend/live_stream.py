@@ -0,0 +1,161 @@
+"""
+Throttled, delta-encoded live stream for dashboards (opt-in)
+Instead of one sensor_data message per reading, readings are buffered per
+device and sent as one sensor_frame every interval_ms. keep="latest" sends
+only the newest reading per device, keep="all" every reading. Each entry
+holds the timestamp plus only the fields that changed since the previous
+entry sent for that device. Every keyframe_every frames (and after a
+resync request or subscription change) a keyframe is sent: the client drops
+its state, and each device's first entry is complete.
+
+    {"type": "sensor_frame", "seq": 12, "keyframe": false,
+     "devices": {"ESP32_001": [{"timestamp": "...", "heart_rate": 71}]}}
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class LiveStream:
+    """Frame builder and timer for one dashboard"""
+    
+    MODES = ("latest", "all")
+    
+    def __init__(self, send: Callable[[str], None], interval_ms: int, keep: str,
+                 keyframe_every: int, max_pending: int):
+        if keep not in self.MODES:
+            raise ValueError(f"keep must be one of {', '.join(self.MODES)}")
+        self.send = send
+        self.interval_ms = interval_ms
+        self.keep = keep
+        self.keyframe_every = max(1, keyframe_every)
+        self.max_pending = max_pending
+        
+        # device -> readings waiting for the next frame
+        self.pending: Dict[str, Deque[dict]] = {}
+        self.counts: Dict[str, int] = {}
+        
+        # device -> values last sent (what the client currently holds)
+        self.state: Dict[str, dict] = {}
+        self.seq = 0
+        self.since_keyframe = 0
+        self.force_keyframe = True
+        self.task: Optional[asyncio.Task] = None
+        
+        # Statistics
+        self.stats = {
+            "frames": 0,
+            "keyframes": 0,
+            "readings_in": 0,
+            "readings_dropped": 0,
+            "entries_sent": 0,
+            "fields_sent": 0,
+            "fields_unchanged": 0
+        }
+    
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.task = None
+    
+    def resync(self):
+        """Make the next frame a keyframe"""
+        self.force_keyframe = True
+    
+    def add(self, reading: dict, count: int = 1):
+        """Buffer a (projected) reading until the next frame"""
+        device_id = reading.get("device_id")
+        self.stats["readings_in"] += count
+        self.counts[device_id] = self.counts.get(device_id, 0) + count
+        
+        queue = self.pending.get(device_id)
+        if queue is None:
+            queue = deque(maxlen=1 if self.keep == "latest" else self.max_pending)
+            self.pending[device_id] = queue
+        elif len(queue) == queue.maxlen and self.keep == "all":
+            self.stats["readings_dropped"] += 1
+        queue.append(reading)
+    
+    def _delta(self, state: dict, reading: dict) -> dict:
+        """Entry with the timestamp and the fields that differ from state (state is updated)"""
+        entry = {"timestamp": reading.get("timestamp")}
+        state["timestamp"] = entry["timestamp"]
+        for name, value in reading.items():
+            if name in ("device_id", "timestamp"):
+                continue
+            if state.get(name, MISSING) != value:
+                entry[name] = value
+                state[name] = value
+                self.stats["fields_sent"] += 1
+            else:
+                self.stats["fields_unchanged"] += 1
+        return entry
+    
+    def build_frame(self) -> Optional[dict]:
+        """Frame for everything buffered since the last one (None when idle)"""
+        keyframe = self.force_keyframe or self.since_keyframe >= self.keyframe_every
+        if not self.pending and not (keyframe and self.state):
+            return None
+        
+        devices: Dict[str, list] = {}
+        if keyframe:
+            previous, self.state = self.state, {}
+            for device_id, values in previous.items():
+                if device_id not in self.pending:
+                    devices[device_id] = [dict(values)]
+                    self.state[device_id] = values
+        
+        for device_id, readings in self.pending.items():
+            state = self.state.setdefault(device_id, {})
+            entries = [self._delta(state, reading) for reading in readings]
+            count = self.counts.get(device_id, len(entries))
+            if count > len(entries):
+                entries[-1]["n"] = count  # readings coalesced into the last entry
+            devices[device_id] = entries
+            self.stats["entries_sent"] += len(entries)
+        self.pending = {}
+        self.counts = {}
+        
+        self.seq += 1
+        self.stats["frames"] += 1
+        if keyframe:
+            self.stats["keyframes"] += 1
+            self.since_keyframe = 0
+            self.force_keyframe = False
+        self.since_keyframe += 1
+        return {
+            "type": "sensor_frame",
+            "seq": self.seq,
+            "keyframe": keyframe,
+            "devices": devices
+        }
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000)
+            try:
+                frame = self.build_frame()
+                if frame is not None:
+                    self.send(json.dumps(frame))
+            except Exception as e:
+                logger.error(f"Error building dashboard frame: {e}")
+    
+    def describe(self) -> dict:
+        return {
+            "enabled": True,
+            "interval_ms": self.interval_ms,
+            "keep": self.keep,
+            "keyframe_every": self.keyframe_every,
+            "devices": len(self.state),
+            **self.stats
+        }
@@ -0,0 +1,208 @@
+"""
+Server-side ESP32 liveness: online -> warning -> offline
+Every connected device has exactly one pending deadline in a hashed timer
+wheel. Incoming messages only record the time (touch), they never move
+the timer; when a deadline fires, the device's idle time decides whether
+it is rescheduled, pinged (warning) or evicted (offline). Each device
+costs O(1) per message and about one timer per heartbeat interval, and a
+single task advances the wheel for the whole worker.
+
+  online   message within WS_HEARTBEAT_INTERVAL
+  warning  silent for WS_HEARTBEAT_INTERVAL: pinged ({"status": "ping"})
+  offline  silent for WS_TIMEOUT: socket closed, or disconnected
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timer wheel: at most one deadline per key, O(1) schedule and cancel"""
+    
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.due: Dict[Hashable, int] = {}  # key -> tick it fires on
+        self.current = 0  # ticks advanced so far
+    
+    def __len__(self) -> int:
+        return len(self.due)
+    
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)arm key to fire delay seconds from the current tick"""
+        self.cancel(key)
+        target = self.current + max(1, math.ceil(delay / self.tick))
+        self.due[key] = target
+        self.slots[target % len(self.slots)].add(key)
+    
+    def cancel(self, key: Hashable):
+        target = self.due.pop(key, None)
+        if target is not None:
+            self.slots[target % len(self.slots)].discard(key)
+    
+    def advance(self) -> List[Hashable]:
+        """Move one tick forward; keys due on it (deadlines further than one revolution stay)"""
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+        if not slot:
+            return []
+        expired = [key for key in slot if self.due[key] <= self.current]
+        for key in expired:
+            slot.discard(key)
+            del self.due[key]
+        return expired
+
+
+class DeviceLiveness:
+    """Liveness state of one connection"""
+    
+    __slots__ = ("handle", "last_seen", "status")
+    
+    def __init__(self, handle, now: float):
+        self.handle = handle  # connection object, passed back to on_ping/on_timeout
+        self.last_seen = now  # time.monotonic()
+        self.status = "online"
+
+
+class LivenessMonitor:
+    """Deadlines of this worker's ESP32 connections"""
+    
+    def __init__(self, heartbeat: float, timeout: float, tick: float,
+                 on_ping: Callable[[str, object], None],
+                 on_status: Callable[[str, str, float, str], None],
+                 on_timeout: Callable[[str, object], None]):
+        self.heartbeat = heartbeat
+        self.timeout = max(timeout, heartbeat + tick)
+        self.tick = tick
+        self.on_ping = on_ping
+        self.on_status = on_status  # (device_id, status, last_seen wall clock, reason)
+        self.on_timeout = on_timeout
+        
+        # One revolution covers the longest delay, so no deadline is seen twice
+        self.wheel = TimerWheel(tick, math.ceil(self.timeout / tick) + 2)
+        self.devices: Dict[str, DeviceLiveness] = {}
+        self.warning = 0  # devices in "warning", kept up to date instead of counted
+        self.task: Optional[asyncio.Task] = None
+        self.started_at = time.monotonic()
+        
+        # Statistics
+        self.stats = {
+            "pings_sent": 0,
+            "timeouts": 0,
+            "recovered": 0,
+            "timers_fired": 0,
+            "max_tick_ms": 0.0
+        }
+    
+    def start(self):
+        if self.task is None:
+            self.started_at = time.monotonic()
+            self.wheel.current = 0
+            self.task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+    
+    def add(self, device_id: str, handle):
+        """Start tracking a connection (replaces an older one with the same id)"""
+        previous = self.devices.get(device_id)
+        if previous is not None and previous.status == "warning":
+            self.warning -= 1
+        self.devices[device_id] = DeviceLiveness(handle, time.monotonic())
+        self.wheel.schedule(device_id, self.heartbeat)
+        self._emit(device_id, "online", "connected")
+    
+    def remove(self, device_id: str, handle, reason: str = "disconnected"):
+        """Stop tracking a connection (ignored if the id has been taken over by a newer one)"""
+        state = self.devices.get(device_id)
+        if state is None or state.handle is not handle:
+            return
+        del self.devices[device_id]
+        self.wheel.cancel(device_id)
+        if state.status == "warning":
+            self.warning -= 1
+        state.status = "offline"
+        self._emit(device_id, "offline", reason, state.last_seen)
+    
+    def touch(self, device_id: str):
+        """A message arrived (the hot path: no timer is moved)"""
+        state = self.devices.get(device_id)
+        if state is None:
+            return
+        state.last_seen = time.monotonic()
+        if state.status == "warning":
+            state.status = "online"
+            self.warning -= 1
+            self.stats["recovered"] += 1
+            self._emit(device_id, "online", "recovered")
+    
+    def _emit(self, device_id: str, status: str, reason: str, last_seen: Optional[float] = None):
+        if last_seen is None:
+            last_seen = time.monotonic()
+        try:
+            self.on_status(device_id, status, time.time() - (time.monotonic() - last_seen), reason)
+        except Exception as e:
+            logger.error(f"Error reporting liveness of {device_id}: {e}")
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            started = time.perf_counter()
+            
+            # Catch up if the loop was late: one advance per elapsed tick
+            target = int((time.monotonic() - self.started_at) / self.tick)
+            while self.wheel.current < target:
+                for device_id in self.wheel.advance():
+                    self.stats["timers_fired"] += 1
+                    try:
+                        self._expire(device_id)
+                    except Exception as e:
+                        logger.error(f"Error checking liveness of {device_id}: {e}")
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stats["max_tick_ms"] = round(max(self.stats["max_tick_ms"], elapsed_ms), 3)
+    
+    def _expire(self, device_id: str):
+        """A device's deadline passed: decide from its idle time"""
+        state = self.devices.get(device_id)
+        if state is None:
+            return
+        idle = time.monotonic() - state.last_seen
+        
+        if idle < self.heartbeat:
+            self.wheel.schedule(device_id, self.heartbeat - idle)
+        elif idle < self.timeout:
+            if state.status == "online":
+                state.status = "warning"
+                self.warning += 1
+                self.stats["pings_sent"] += 1
+                self._emit(device_id, "warning", "silent", state.last_seen)
+                self.on_ping(device_id, state.handle)
+            self.wheel.schedule(device_id, self.timeout - idle)
+        else:
+            logger.warning(f"ESP32 {device_id} silent for {idle:.0f}s, closing")
+            self.stats["timeouts"] += 1
+            self.remove(device_id, state.handle, "timeout")
+            self.on_timeout(device_id, state.handle)
+    
+    def status_counts(self) -> Dict[str, int]:
+        return {"online": len(self.devices) - self.warning, "warning": self.warning}
+    
+    def describe(self) -> dict:
+        """Tracked devices and counters for /api/status"""
+        return {
+            "heartbeat_interval": self.heartbeat,
+            "timeout": self.timeout,
+            "tick": self.tick,
+            "devices": len(self.devices),
+            **self.status_counts(),
+            "timers_pending": len(self.wheel),
+            **self.stats
+        }
@@ -0,0 +1,264 @@
+"""
+Prometheus text-format metrics for /metrics
+Counters, gauges and histograms are plain objects updated from the event
+loop: no locks (each worker is one thread) and histogram buckets are
+preallocated, so observe() is a bisect and three additions. Values that
+are cheap to read at scrape time (queue depths, connections) come from
+collector callbacks instead of being updated on the hot path.
+
+Each worker process has its own registry; with several workers a scrape
+reaches whichever worker accepts it (see farmtech_worker_info).
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Seconds, 100 us .. 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Rows per batch
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """Base: a metric family, itself the sample for unlabeled metrics"""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[tuple, "Metric"] = {}
+    
+    def _child(self) -> "Metric":
+        raise NotImplementedError
+    
+    def labels(self, *values) -> "Metric":
+        """Child for label values (created once; keep the reference on hot paths)"""
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self.children[key] = self._child()
+        return child
+    
+    def _samples(self, labels: Dict[str, str]) -> List[Sample]:
+        raise NotImplementedError
+    
+    def samples(self) -> List[Sample]:
+        if not self.labelnames:
+            return self._samples({})
+        result = []
+        for key, child in self.children.items():
+            result.extend(child._samples(dict(zip(self.labelnames, key))))
+        return result
+
+
+class Counter(Metric):
+    """Monotonic count"""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+    
+    def _child(self) -> "Counter":
+        return Counter(self.name, self.help)
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+    
+    def set_total(self, value: float):
+        """Mirror a count kept elsewhere (scrape-time collectors)"""
+        self.value = value
+    
+    def _samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [(self.name, labels, self.value)]
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+    
+    def _child(self) -> "Gauge":
+        return Gauge(self.name, self.help)
+    
+    def set(self, value: float):
+        self.value = value
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+    
+    def dec(self, amount: float = 1):
+        self.value -= amount
+    
+    def _samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [(self.name, labels, self.value)]
+
+
+class Histogram(Metric):
+    """Fixed buckets (upper bounds), preallocated counts"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS,
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot: above every bound
+        self.sum = 0.0
+        self.count = 0
+    
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.help, self.bounds)
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def _samples(self, labels: Dict[str, str]) -> List[Sample]:
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            result.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+        result.append((f"{self.name}_sum", labels, self.sum))
+        result.append((f"{self.name}_count", labels, self.count))
+        return result
+
+
+class Registry:
+    """Metrics and scrape-time collectors of one process"""
+    
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+    
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+    
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+    
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS,
+                  labelnames: Iterable[str] = ()) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labelnames))
+    
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """collector() updates and returns its metrics on every scrape"""
+        self.collectors.append(collector)
+    
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        families = list(self.metrics)
+        for collector in self.collectors:
+            families.extend(collector())
+        
+        lines = []
+        for metric in families:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ------------------------------------------------------------
+# Ingest (ESP32 pipeline and HTTP)
+# ------------------------------------------------------------
+
+INGEST_PARSE_SECONDS = REGISTRY.histogram(
+    "farmtech_ingest_parse_seconds", "Time to decode and validate one ESP32 message", labelnames=("format",)
+)
+INGEST_READINGS = REGISTRY.counter(
+    "farmtech_ingest_readings_total", "Readings accepted for storage", labelnames=("source",)
+)
+INGEST_ERRORS = REGISTRY.counter(
+    "farmtech_ingest_errors_total", "ESP32 messages rejected by the parse stage", labelnames=("reason",)
+)
+INGEST_ACK_SECONDS = REGISTRY.histogram(
+    "farmtech_ingest_ack_seconds", "ESP32 message receipt to ack written to the socket"
+)
+INGEST_DURABLE_SECONDS = REGISTRY.histogram(
+    "farmtech_ingest_durable_seconds", "ESP32 message receipt to its rows committed"
+)
+DEVICE_MESSAGES = REGISTRY.counter(
+    "farmtech_device_messages_total", "ESP32 messages received per device", labelnames=("device_id",)
+)
+
+# ------------------------------------------------------------
+# Database writer
+# ------------------------------------------------------------
+
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    "farmtech_db_commit_seconds", "Time to write and commit one batch"
+)
+DB_BATCH_ROWS = REGISTRY.histogram(
+    "farmtech_db_batch_rows", "Rows per committed batch", buckets=SIZE_BUCKETS
+)
+DB_FAILED_BATCHES = REGISTRY.counter(
+    "farmtech_db_failed_batches_total", "Batches whose transaction failed"
+)
+
+# ------------------------------------------------------------
+# Dashboards
+# ------------------------------------------------------------
+
+BROADCAST_FANOUT_SECONDS = REGISTRY.histogram(
+    "farmtech_broadcast_fanout_seconds", "Time to route, encode and queue one broadcast for local dashboards"
+)
+DASHBOARD_SEND_SECONDS = REGISTRY.histogram(
+    "farmtech_dashboard_send_seconds", "Dashboard message queued to written to the socket"
+)
+
+# ------------------------------------------------------------
+# Scrape time (set by the server's collector, not registered)
+# ------------------------------------------------------------
+
+QUEUE_DEPTH = Gauge("farmtech_queue_depth", "Items waiting in each stage queue", ("queue",))
+WRITE_QUEUE_FILL = Gauge("farmtech_write_queue_fill", "Write queue depth over capacity (0 on non-writer workers)")
+CONNECTED_DEVICES = Gauge("farmtech_connected_devices", "ESP32 devices connected to this worker")
+CONNECTED_DASHBOARDS = Gauge("farmtech_connected_dashboards", "Dashboards connected to this worker")
+DEVICE_LIVENESS = Gauge("farmtech_device_liveness", "Tracked ESP32 devices by liveness status", ("status",))
+DEVICE_TIMEOUTS = Counter("farmtech_device_timeouts_total", "ESP32 connections closed for silence")
+SLOWED_DEVICES = Gauge("farmtech_slowed_devices", "ESP32 devices currently told to slow down")
+PUBLISH_DROPPED = Counter(
+    "farmtech_publish_dropped_total", "Readings not published because the publish queue was full"
+)
+READ_CACHE_LOOKUPS = Counter("farmtech_read_cache_total", "Snapshot read lookups by outcome", ("result",))
+WORKER_INFO = Gauge("farmtech_worker_info", "Worker answering this scrape", ("worker", "role"))
@@ -0,0 +1,149 @@
+"""
+Online migration from the legacy sensor_data table to the compact layout
+Copies rows in small id-ordered chunks, each in its own short transaction,
+so a running server (still on the legacy layout) keeps ingesting. Progress
+is checkpointed in statistics_state; rerunning resumes and catches up with
+rows written in the meantime.
+
+Usage:
+    python migrate_storage.py [--database farmtech_data.db] [--chunk 5000]
+    # then restart the server with STORAGE_LAYOUT=compact
+    python migrate_storage.py --drop-legacy   # once the compact layout is live
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import aiosqlite
+
+from config import Config
+from sensor_schema import SENSOR_FIELDS
+from storage import CompactStorage, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = "migrate_storage.last_id"
+
+
+async def get_checkpoint(db) -> int:
+    cursor = await db.execute("SELECT value FROM statistics_state WHERE name = ?", (CHECKPOINT,))
+    row = await cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+async def set_checkpoint(db, last_id: int):
+    await db.execute("""
+        INSERT INTO statistics_state (name, value, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (CHECKPOINT, str(last_id)))
+
+
+async def migrate(db, chunk_size: int, pause: float) -> dict:
+    """Copy legacy rows after the checkpoint into sensor_readings"""
+    compact = CompactStorage()
+    await compact.create_tables(db)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS statistics_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Every device needs an interned key before its rows can move
+    await db.execute("""
+        INSERT OR IGNORE INTO devices (device_id, status)
+        SELECT DISTINCT device_id, 'active' FROM sensor_data
+    """)
+    await db.commit()
+    
+    cursor = await db.execute("SELECT device_id, id FROM devices")
+    device_keys = {row[0]: row[1] for row in await cursor.fetchall()}
+    
+    last_id = await get_checkpoint(db)
+    copied = 0
+    duplicates = 0
+    started = time.perf_counter()
+    
+    while True:
+        cursor = await db.execute(f"""
+            SELECT id, device_id, timestamp, {', '.join(SENSOR_FIELDS)}
+            FROM sensor_data
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, chunk_size))
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        
+        params = []
+        for row in rows:
+            device_id = row[1]
+            if device_id not in device_keys:
+                await db.execute(
+                    "INSERT OR IGNORE INTO devices (device_id, status) VALUES (?, 'active')", (device_id,)
+                )
+                key_cursor = await db.execute("SELECT id FROM devices WHERE device_id = ?", (device_id,))
+                device_keys[device_id] = (await key_cursor.fetchone())[0]
+            params.append((device_keys[device_id], to_epoch_ms(row[2])) + tuple(row[3:]))
+        
+        cursor = await db.executemany(compact.insert_sql, params)
+        inserted = cursor.rowcount if cursor.rowcount >= 0 else len(params)
+        last_id = rows[-1][0]
+        await set_checkpoint(db, last_id)
+        await db.commit()
+        
+        copied += inserted
+        duplicates += len(params) - inserted
+        elapsed = time.perf_counter() - started
+        logger.info(f"Migrated up to id {last_id}: {copied} rows ({copied / elapsed:.0f} rows/s)")
+        
+        # Let the live writer in between chunks
+        await asyncio.sleep(pause)
+    
+    return {"copied": copied, "duplicates_skipped": duplicates, "last_id": last_id}
+
+
+async def drop_legacy(db):
+    """Drop sensor_data once every row has been migrated"""
+    last_id = await get_checkpoint(db)
+    cursor = await db.execute("SELECT COUNT(*) FROM sensor_data WHERE id > ?", (last_id,))
+    remaining = (await cursor.fetchone())[0]
+    if remaining:
+        raise SystemExit(f"{remaining} legacy rows not migrated yet, run the migration again first")
+    
+    await db.execute("DROP TABLE sensor_data")
+    await db.commit()
+    await db.execute("VACUUM")
+    logger.info("Legacy sensor_data table dropped")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrate sensor_data to the compact storage layout")
+    parser.add_argument("--database", default=Config.DATABASE_PATH)
+    parser.add_argument("--chunk", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to yield between chunks")
+    parser.add_argument("--drop-legacy", action="store_true", help="drop sensor_data after migration")
+    args = parser.parse_args()
+    
+    async with aiosqlite.connect(args.database) as db:
+        await db.execute("PRAGMA busy_timeout = 5000")
+        if args.drop_legacy:
+            await drop_legacy(db)
+            return
+        
+        result = await migrate(db, args.chunk, args.pause)
+        logger.info(
+            f"Migration done: {result['copied']} rows copied, "
+            f"{result['duplicates_skipped']} duplicate (device, ms) rows skipped. "
+            f"Restart the server with STORAGE_LAYOUT=compact"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,371 @@
+"""
+Staged ingest for ESP32 WebSocket connections
+The receive loop only reads frames into a bounded per-device inbox; the
+remaining stages run concurrently:
+
+  parse/validate  per device: decode JSON or binary frame, stamp, assign a
+                  sequence number and ack at once ({"status": "ok", "seq": N})
+  persist         the database's group-commit writer (bounded queue); when a
+                  message is committed the device gets {"status": "durable",
+                  "seq": N}, meaning every message up to N is on disk (a
+                  message with readings that repeat a stored timestamp also
+                  gets {"status": "error", "seq": N, "duplicates": count})
+  publish         one shared bounded queue feeding the dashboard fan-out
+
+When the writer falls behind (queue filling up, or too many acked messages
+not yet durable) the device is told {"status": "slow_down", "interval_factor":
+2 or 4}, and {"status": "resume"} once it has caught up, so firmware can
+stretch its sampling interval. All device messages carry "status" because
+the firmware dispatches on it.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import ingest
+import metrics
+import sensor_schema
+
+logger = logging.getLogger(__name__)
+
+PARSE_JSON = metrics.INGEST_PARSE_SECONDS.labels("json")
+PARSE_BINARY = metrics.INGEST_PARSE_SECONDS.labels("binary")
+READINGS = metrics.INGEST_READINGS.labels("websocket")
+
+
+class DeviceSession:
+    """Ingest state of one ESP32 connection"""
+    
+    def __init__(self, pipeline: "IngestPipeline", device_id: str, websocket):
+        self.pipeline = pipeline
+        self.device_id = device_id
+        self.websocket = websocket
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=pipeline.device_queue)
+        
+        self.next_seq = 1
+        self.durable_seq = 0
+        self.completed = set()  # persisted seqs above durable_seq
+        self.inflight: Deque[asyncio.Future] = deque()
+        self.received: Dict[int, float] = {}  # seq -> perf_counter at receipt, until persisted
+        self.messages = metrics.DEVICE_MESSAGES.labels(device_id)
+        self.slowed = False
+        self.closed = False
+        
+        # Outbound messages to the device (with receipt time for acks), sent by their own task
+        self.outbox: Deque[Tuple[dict, Optional[float]]] = deque()
+        self.durable_dirty = False
+        self.wakeup = asyncio.Event()
+        
+        self.parse_task = asyncio.create_task(self._run_parse())
+        self.send_task = asyncio.create_task(self._run_send())
+    
+    async def receive(self, message: dict, received_at: datetime):
+        """Receive stage: hand a raw WebSocket message to the parse stage (blocks while the inbox is full)"""
+        self.pipeline.stats["messages_received"] += 1
+        self.messages.inc()
+        await self.inbox.put((message, received_at, time.perf_counter()))
+    
+    async def close(self):
+        """Finish parsing what was received (it was or will be acked), then stop sending"""
+        self.closed = True
+        await self.inbox.put(None)
+    
+    # ------------------------------------------------------------
+    # Parse/validate stage
+    # ------------------------------------------------------------
+    
+    def parse(self, message: dict, received_at: datetime) -> Optional[List[dict]]:
+        """
+        Decode a text (JSON object) or binary frame into stamped readings (None
+        for a pong). A JSON reading that fails validation raises ValidationError.
+        """
+        if message.get("bytes") is not None:
+            data = message["bytes"]
+            readings = sensor_schema.decode_frame(data)
+            for reading in readings:
+                age_ms = reading.pop("age_ms")
+                reading['timestamp'] = (received_at - timedelta(milliseconds=age_ms)).isoformat()
+        else:
+            data = message.get("text") or ""
+            sensor_data = json.loads(data)
+            if not isinstance(sensor_data, dict):
+                raise ValueError("Expected a JSON object")
+            if sensor_data.get("type") == "pong":
+                return None  # reply to a liveness ping, only resets the device's deadline
+            
+            # Same checks as the HTTP batch endpoints (types, ranges), stamped on receipt
+            sensor_data['timestamp'] = None
+            readings = [ingest.validate_reading(sensor_data, received_at, self.device_id)]
+        
+        for reading in readings:
+            reading['device_id'] = self.device_id
+        logger.debug(f"Received data from {self.device_id}: {len(data)} bytes, {len(readings)} readings")
+        return readings
+    
+    async def _run_parse(self):
+        stats = self.pipeline.stats
+        try:
+            while True:
+                item = await self.inbox.get()
+                if item is None:
+                    break
+                message, received_at, started = item
+                
+                parse_started = time.perf_counter()
+                try:
+                    readings = self.parse(message, received_at)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Invalid JSON from {self.device_id}: {e}")
+                    stats["parse_errors"] += 1
+                    metrics.INGEST_ERRORS.labels("json").inc()
+                    self.send({"status": "error", "message": "Invalid JSON format"})
+                    continue
+                except sensor_schema.FrameError as e:
+                    logger.error(f"Invalid binary frame from {self.device_id}: {e}")
+                    stats["parse_errors"] += 1
+                    metrics.INGEST_ERRORS.labels("frame").inc()
+                    self.send({"status": "error", "message": f"Invalid binary frame: {e}"})
+                    continue
+                except ValueError as e:
+                    stats["parse_errors"] += 1
+                    metrics.INGEST_ERRORS.labels("payload").inc()
+                    self.send({"status": "error", "message": str(e)})
+                    continue
+                if readings is None:
+                    continue
+                (PARSE_BINARY if message.get("bytes") is not None else PARSE_JSON).observe(time.perf_counter() - parse_started)
+                
+                seq = self.next_seq
+                self.next_seq += 1
+                stats["readings_parsed"] += len(readings)
+                READINGS.inc(len(readings))
+                self.send({
+                    "status": "ok",
+                    "message": "Data received",
+                    "seq": seq,
+                    "count": len(readings),
+                    "timestamp": datetime.now().isoformat()
+                }, started)
+                stats["acks_sent"] += 1
+                self.received[seq] = started
+                
+                # Enqueue: publish is best effort, persist waits for writer queue space
+                self.pipeline.publish(readings)
+                await self._persist(seq, readings)
+                self._check_pressure()
+        except Exception as e:
+            logger.error(f"Ingest pipeline for {self.device_id} failed: {e}")
+        finally:
+            # Acked messages still in flight will be persisted; only stop talking to the device
+            self.closed = True
+            self.wakeup.set()
+    
+    # ------------------------------------------------------------
+    # Persist stage
+    # ------------------------------------------------------------
+    
+    async def _persist(self, seq: int, readings: List[dict]):
+        # Hard bound on acked-but-not-durable messages per device
+        while len(self.inflight) >= 2 * self.pipeline.max_inflight:
+            await asyncio.wait([self.inflight[0]])
+            while self.inflight and self.inflight[0].done():
+                self.inflight.popleft()
+        
+        try:
+            future = await self.pipeline.database.submit_readings(readings)
+        except Exception as e:
+            self._on_persisted(seq, len(readings), None, error=e)
+            return
+        self.inflight.append(future)
+        future.add_done_callback(partial(self._on_persisted, seq, len(readings)))
+    
+    def _on_persisted(self, seq: int, count: int, future: Optional[asyncio.Future],
+                      error: Optional[Exception] = None):
+        stored = count
+        if future is not None:
+            if future.cancelled():
+                error = asyncio.CancelledError()
+            else:
+                error = future.exception()
+                if error is None:
+                    stored = future.result()
+            while self.inflight and self.inflight[0].done():
+                self.inflight.popleft()
+        started = self.received.pop(seq, None)
+        if error is None and started is not None:
+            metrics.INGEST_DURABLE_SECONDS.observe(time.perf_counter() - started)
+        
+        # The device is told; durable_seq moves past it so later messages can be confirmed
+        if error is not None:
+            self.pipeline.stats["persist_errors"] += 1
+            self.send({"status": "error", "message": "Data not saved", "seq": seq})
+        elif stored < count:
+            # Readings at a timestamp the device already has a stored reading for
+            self.pipeline.stats["duplicates"] += count - stored
+            self.send({
+                "status": "error",
+                "message": "Duplicate timestamps, readings not saved",
+                "seq": seq,
+                "duplicates": count - stored
+            })
+        
+        self.completed.add(seq)
+        advanced = False
+        while self.durable_seq + 1 in self.completed:
+            self.completed.remove(self.durable_seq + 1)
+            self.durable_seq += 1
+            advanced = True
+        if advanced:
+            self.durable_dirty = True
+            self.wakeup.set()
+            self._check_pressure()
+    
+    def _check_pressure(self):
+        """Send slow_down when the persist stage falls behind, resume once it has caught up"""
+        fill = self.pipeline.writer_fill()
+        pending = self.next_seq - 1 - self.durable_seq
+        if not self.slowed and (fill >= self.pipeline.slow_fill or pending >= self.pipeline.max_inflight):
+            self.slowed = True
+            self.pipeline.stats["slow_down_sent"] += 1
+            self.send({
+                "status": "slow_down",
+                "interval_factor": 4 if fill >= 0.9 else 2,
+                "queue_fill": round(fill, 3),
+                "pending": pending
+            })
+        elif self.slowed and fill <= self.pipeline.resume_fill and pending <= self.pipeline.max_inflight // 4:
+            self.slowed = False
+            self.pipeline.stats["resume_sent"] += 1
+            self.send({"status": "resume"})
+    
+    # ------------------------------------------------------------
+    # Outbound to the device
+    # ------------------------------------------------------------
+    
+    def send(self, message: dict, started: Optional[float] = None):
+        """Queue a message for the device; acks pass their receipt time for the ack latency metric"""
+        self.outbox.append((message, started))
+        self.wakeup.set()
+    
+    async def _run_send(self):
+        while True:
+            if not self.outbox and not self.durable_dirty:
+                if self.closed and self.parse_task.done():
+                    return
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            if self.outbox:
+                message, started = self.outbox.popleft()
+            else:
+                # Coalesced: only the latest durable seq is sent
+                self.durable_dirty = False
+                message, started = {"status": "durable", "seq": self.durable_seq}, None
+                self.pipeline.stats["durable_sent"] += 1
+            try:
+                await self.websocket.send_json(message)
+                if started is not None:
+                    metrics.INGEST_ACK_SECONDS.observe(time.perf_counter() - started)
+            except Exception:
+                # Socket gone: nothing more can be delivered
+                self.outbox.clear()
+                self.durable_dirty = False
+                if self.parse_task.done():
+                    return
+    
+    def describe(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "inbox": self.inbox.qsize(),
+            "last_seq": self.next_seq - 1,
+            "durable_seq": self.durable_seq,
+            "slowed": self.slowed
+        }
+
+
+class IngestPipeline:
+    """Shared persist and publish stages, and the per-device sessions"""
+    
+    def __init__(self, database, publish: Callable[[List[dict]], Awaitable[None]], device_queue: int,
+                 publish_queue: int, max_inflight: int, slow_fill: float, resume_fill: float):
+        self.database = database
+        self.publish_readings = publish
+        self.device_queue = device_queue
+        self.publish_queue_size = publish_queue
+        self.max_inflight = max_inflight
+        self.slow_fill = slow_fill
+        self.resume_fill = resume_fill
+        
+        self.sessions = set()
+        self.publish_queue: asyncio.Queue = asyncio.Queue(maxsize=publish_queue)
+        self.publish_task: Optional[asyncio.Task] = None
+        
+        # Statistics
+        self.stats = {
+            "messages_received": 0,
+            "readings_parsed": 0,
+            "parse_errors": 0,
+            "acks_sent": 0,
+            "durable_sent": 0,
+            "persist_errors": 0,
+            "duplicates": 0,
+            "publish_dropped": 0,
+            "slow_down_sent": 0,
+            "resume_sent": 0
+        }
+    
+    def start(self):
+        if self.publish_task is None:
+            self.publish_queue = asyncio.Queue(maxsize=self.publish_queue_size)
+            self.publish_task = asyncio.create_task(self._run_publish())
+    
+    def stop(self):
+        if self.publish_task:
+            self.publish_task.cancel()
+            self.publish_task = None
+    
+    def open_session(self, device_id: str, websocket) -> DeviceSession:
+        session = DeviceSession(self, device_id, websocket)
+        self.sessions.add(session)
+        session.send_task.add_done_callback(lambda task: self.sessions.discard(session))
+        return session
+    
+    def writer_fill(self) -> float:
+        """How full the persist stage's queue is (0..1; 0 on workers that forward to the writer)"""
+        writer = self.database.writer
+        if writer.task is None:
+            return 0.0
+        return writer.queue.qsize() / writer.queue_size
+    
+    def publish(self, readings: List[dict]):
+        """Publish stage input; readings are dropped (and counted) when dashboards fall this far behind"""
+        try:
+            self.publish_queue.put_nowait(readings)
+        except asyncio.QueueFull:
+            self.stats["publish_dropped"] += len(readings)
+    
+    async def _run_publish(self):
+        while True:
+            readings = await self.publish_queue.get()
+            try:
+                await self.publish_readings(readings)
+            except Exception as e:
+                logger.error(f"Error publishing readings: {e}")
+    
+    def describe(self) -> dict:
+        """Stage queue depths and counters for /api/status"""
+        return {
+            "sessions": len(self.sessions),
+            "inbox_depth": sum(session.inbox.qsize() for session in self.sessions),
+            "persist_queue_fill": round(self.writer_fill(), 3),
+            "publish_queue_depth": self.publish_queue.qsize(),
+            "slowed_devices": sum(1 for session in self.sessions if session.slowed),
+            **self.stats
+        }
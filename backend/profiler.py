@@ -0,0 +1,102 @@
+"""
+Sampling profiler for the event loop thread (turned on at runtime)
+A background thread wakes every interval_ms, records the stack the event
+loop thread is executing, and counts identical stacks. Results are
+collapsed stacks ("module:function;module:function count"), the input
+format of flamegraph tools. Costs nothing while stopped. Off by default:
+start the server with PROFILER_ENABLED=true to allow /api/profiler/start.
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+
+class SamplingProfiler:
+    """Stack sampler for one target thread"""
+    
+    def __init__(self, max_depth: int = 64):
+        self.max_depth = max_depth
+        self.interval = 0.005
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+    
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self, interval_ms: float, duration: Optional[float] = None):
+        """Sample the calling thread (the event loop) until stop() or for duration seconds"""
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        self.interval = interval_ms / 1000
+        self.counts = {}
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.stopping.clear()
+        target = threading.get_ident()
+        self.thread = threading.Thread(
+            target=self._run, args=(target, duration), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+    
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    
+    def _label(self, frame) -> str:
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+        return f"{module}:{frame.f_code.co_name}"
+    
+    def _run(self, target: int, duration: Optional[float]):
+        deadline = time.monotonic() + duration if duration else None
+        while not self.stopping.wait(self.interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+        self.stopped_at = time.time()
+    
+    def collapsed(self) -> str:
+        """Collapsed stacks, one "stack count" per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]))
+    
+    def describe(self, limit: int = 50) -> dict:
+        """State and the heaviest stacks"""
+        counts = dict(self.counts)
+        top = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+        
+        # Self time: how often each function is the innermost frame
+        leaves: Dict[str, int] = {}
+        for stack, count in counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        return {
+            "running": self.running,
+            "interval_ms": round(self.interval * 1000, 3),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": self.samples,
+            "top_functions": [
+                {"function": name, "samples": count}
+                for name, count in sorted(leaves.items(), key=lambda item: -item[1])[:limit]
+            ],
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in top]
+        }
@@ -0,0 +1,160 @@
+"""
+Read-through cache of encoded JSON for snapshot reads
+(/api/devices, /api/data/recent, /api/statistics, dashboard initial data)
+Concurrent misses on the same key share one load (single flight); the
+result is kept as UTF-8 JSON bytes for a short TTL in an LRU bounded by
+entry count and total size, so a hit skips both the query and the
+serialization. Every entry carries tags naming what it was built from;
+ingest invalidates by tag. A load that started before an invalidation of
+one of its tags still answers its waiters but is not stored.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+Loader = Callable[[], Awaitable[object]]
+
+# What a committed ingest batch changes: device last_seen, recent readings, counters
+INGEST_TAGS = ("devices", "recent", "statistics")
+
+
+def encode(value) -> bytes:
+    """Compact JSON, as FastAPI's JSONResponse renders it"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class CacheEntry:
+    """One encoded result"""
+    
+    __slots__ = ("body", "expires", "tags")
+    
+    def __init__(self, body: bytes, expires: float, tags: Tuple[str, ...]):
+        self.body = body
+        self.expires = expires  # time.monotonic()
+        self.tags = tags
+
+
+class ReadCache:
+    """TTL + LRU cache of encoded read results with single-flight loads"""
+    
+    def __init__(self, ttl: float, max_bytes: int, max_entries: int, enabled: bool = True):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self.inflight: Dict[Hashable, asyncio.Task] = {}
+        self.generations: Dict[str, int] = {}  # tag -> invalidations so far
+        self.bytes = 0
+        
+        # Statistics
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "expired": 0,
+            "invalidated": 0,
+            "evicted": 0,
+            "discarded": 0,
+            "errors": 0,
+            "load_ms_total": 0.0,
+            "load_ms_max": 0.0
+        }
+    
+    async def get(self, key: Hashable, loader: Loader, tags: Optional[Iterable[str]] = None,
+                  ttl: Optional[float] = None) -> bytes:
+        """
+        Encoded result for key: cached, joined to a load in flight, or loaded.
+        tags default to the key's first element.
+        """
+        if not self.enabled:
+            return encode(await loader())
+        
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry.expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry.body
+            self._drop(key)
+            self.stats["expired"] += 1
+        
+        task = self.inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            tags = tuple(tags) if tags is not None else (key[0],)
+            task = asyncio.ensure_future(self._load(key, loader, tags, self.ttl if ttl is None else ttl))
+            task.add_done_callback(self._loaded)
+            self.inflight[key] = task
+        
+        # A caller going away must not cancel the load the others wait on
+        return await asyncio.shield(task)
+    
+    async def _load(self, key: Hashable, loader: Loader, tags: Tuple[str, ...], ttl: float) -> bytes:
+        generations = [self.generations.get(tag, 0) for tag in tags]
+        started = time.perf_counter()
+        try:
+            body = encode(await loader())
+        finally:
+            del self.inflight[key]
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["load_ms_total"] = round(self.stats["load_ms_total"] + elapsed_ms, 3)
+        self.stats["load_ms_max"] = round(max(self.stats["load_ms_max"], elapsed_ms), 3)
+        
+        if generations != [self.generations.get(tag, 0) for tag in tags]:
+            self.stats["discarded"] += 1  # invalidated while loading
+        elif len(body) <= self.max_bytes:
+            self._store(key, CacheEntry(body, time.monotonic() + ttl, tags))
+        return body
+    
+    def _loaded(self, task: asyncio.Task):
+        # Retrieve the exception even if every waiter has gone
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+    
+    def _store(self, key: Hashable, entry: CacheEntry):
+        if key in self.entries:
+            self._drop(key)
+        while self.entries and (
+            len(self.entries) >= self.max_entries or self.bytes + len(entry.body) > self.max_bytes
+        ):
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self.stats["evicted"] += 1
+        self.entries[key] = entry
+        self.bytes += len(entry.body)
+    
+    def _drop(self, key: Hashable):
+        entry = self.entries.pop(key)
+        self.bytes -= len(entry.body)
+    
+    def invalidate(self, tags: Iterable[str]):
+        """Drop entries built from any of tags; loads in flight for them are not stored"""
+        tags = set(tags)
+        for tag in tags:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+        stale = [key for key, entry in self.entries.items() if not tags.isdisjoint(entry.tags)]
+        for key in stale:
+            self._drop(key)
+        self.stats["invalidated"] += len(stale)
+    
+    def describe(self) -> dict:
+        """Size and counters for /api/status"""
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "inflight": len(self.inflight),
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else None,
+            **self.stats
+        }
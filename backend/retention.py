@@ -0,0 +1,187 @@
+"""
+Retention enforcement
+Readings older than Config.DATA_RETENTION_DAYS are archived one device-day
+at a time, so each day file is written once per run, and then deleted in
+small chunks, each chunk in its own short write transaction, so the batch
+writer never waits long for the lock. Rollups are
+kept: they keep summarising archived days. Purged counts per day are logged
+in retention_log so statistics and rollup rebuilds can account for them.
+GPS track segments and IMU activity windows that end before the cutoff are
+dropped after a purge.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import activity
+import geo
+
+logger = logging.getLogger(__name__)
+
+
+async def archived_until(db) -> Optional[str]:
+    """
+    Start of the first day with no purged readings, None if nothing was
+    purged (or retention never ran on this database)
+    """
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'retention_log'")
+    if not await cursor.fetchone():
+        return None
+    cursor = await db.execute("SELECT MAX(day) FROM retention_log")
+    row = await cursor.fetchone()
+    if not row or not row[0]:
+        return None
+    next_day = datetime.fromisoformat(row[0]) + timedelta(days=1)
+    return next_day.isoformat()
+
+
+class RetentionManager:
+    """Background archive-then-purge task"""
+    
+    def __init__(self, database, archive, retention_days: int, chunk_size: int, pause: float):
+        self.database = database
+        self.archive = archive
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.task: Optional[asyncio.Task] = None
+        self.stop_event = asyncio.Event()
+        
+        # Statistics
+        self.stats = {
+            "runs": 0,
+            "rows_purged": 0,
+            "files_written": 0,
+            "errors": 0,
+            "last_run": None,
+            "last_run_ms": 0.0
+        }
+    
+    async def create_tables(self, db):
+        """Create the per-day purge log"""
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS retention_log (
+                day TEXT PRIMARY KEY,
+                purged INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+    def cutoff(self) -> Optional[str]:
+        """Readings older than this are expired (None when retention is off)"""
+        if self.retention_days <= 0:
+            return None
+        return (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+    
+    async def archived_until(self, db) -> Optional[str]:
+        """Start of the first day with no purged readings, None if nothing was purged"""
+        return await archived_until(db)
+    
+    def start(self, interval: float):
+        """Start the periodic retention task"""
+        if self.task is None and self.retention_days > 0:
+            self.stop_event = asyncio.Event()
+            self.task = asyncio.create_task(self._run(interval))
+    
+    async def stop(self):
+        """Finish the current chunk and stop"""
+        if self.task is None:
+            return
+        self.stop_event.set()
+        await self.task
+        self.task = None
+    
+    async def _run(self, interval: float):
+        while not self.stop_event.is_set():
+            try:
+                await self.enforce()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Retention run failed: {e}")
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def enforce(self) -> int:
+        """Archive and delete all expired readings; returns rows purged"""
+        cutoff = self.cutoff()
+        if cutoff is None:
+            return 0
+        
+        storage = self.database.storage
+        started = time.perf_counter()
+        purged = 0
+        
+        groups = await self.database.readers.fetchall(storage.expired_days_sql, (storage.time_arg(cutoff),))
+        for group in groups:
+            if self.stop_event.is_set():
+                break
+            day = group["day"]
+            next_day = (datetime.fromisoformat(day) + timedelta(days=1)).date().isoformat()
+            rows = await self.database.readers.fetchall(
+                storage.expired_day_sql,
+                (group["device"], storage.time_arg(day), storage.time_arg(min(next_day, cutoff)))
+            )
+            if not rows:
+                continue
+            readings = [dict(row) for row in rows]
+            
+            # Archive first: a crash before the deletes only re-archives the rows left
+            self.stats["files_written"] += await asyncio.to_thread(self.archive.append, readings)
+            
+            for start in range(0, len(readings), self.chunk_size):
+                if start and self.stop_event.is_set():
+                    break
+                chunk = readings[start:start + self.chunk_size]
+                await self._delete(chunk, day)
+                purged += len(chunk)
+                await asyncio.sleep(self.pause)
+        
+        if purged:
+            # Track segments and activity windows that ended before the cutoff point at deleted rows only
+            async with self.database.write_lock:
+                await geo.purge_tracks(self.database.db, cutoff)
+                await activity.purge(self.database.db, cutoff)
+                await self.database.db.commit()
+        
+        self.stats["runs"] += 1
+        self.stats["last_run"] = datetime.now().isoformat()
+        self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        if purged:
+            logger.info(f"Retention: archived and purged {purged} readings older than {cutoff}")
+        return purged
+    
+    async def _delete(self, readings: List[dict], day: str):
+        """Delete one chunk of archived readings of a day and log it"""
+        storage = self.database.storage
+        db = self.database.db
+        async with self.database.write_lock:
+            try:
+                await db.executemany(storage.delete_sql, storage.delete_params(readings))
+                await db.execute("""
+                    INSERT INTO retention_log (day, purged, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(day) DO UPDATE SET
+                        purged = purged + excluded.purged, updated_at = excluded.updated_at
+                """, (day, len(readings)))
+                await self.database.statistics.journal(db, {day: -len(readings)})
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+            self.database.statistics.remove({day: len(readings)})
+        
+        self.stats["rows_purged"] += len(readings)
+    
+    def describe(self) -> dict:
+        """Retention settings and counters for /api/status"""
+        return {
+            "retention_days": self.retention_days,
+            "cutoff": self.cutoff(),
+            "archive_dir": self.archive.directory,
+            **self.stats
+        }
@@ -0,0 +1,245 @@
+"""
+Per-device time-bucket rollups (1 minute, 1 hour, 1 day)
+Each bucket keeps count/sum/min/max for every sensor field. Buckets are
+updated incrementally inside the batch writer's transaction; late readings
+land in the bucket of their own timestamp.
+
+Rebuild from raw sensor_data (days already purged to the archive are kept):
+    python rollups.py --rebuild [--device DEV001]
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+from config import Config
+from ingest import normalize_timestamp
+from retention import archived_until
+from sensor_schema import SENSOR_FIELDS
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# bucket name -> (table, timestamp prefix length, suffix completing the bucket start)
+BUCKETS = {
+    "1m": ("rollup_1m", 16, ":00"),
+    "1h": ("rollup_1h", 13, ":00:00"),
+    "1d": ("rollup_1d", 10, "T00:00:00")
+}
+
+STAT_COLUMNS = [
+    f"{field}_{stat}" for field in SENSOR_FIELDS for stat in ("count", "sum", "min", "max")
+]
+
+# Values aggregate() counts; anything else (None, bool, text) is left out of the field stats
+NUMERIC_TYPES = frozenset((int, float))
+
+
+def bucket_start(timestamp: str, bucket: str) -> str:
+    """Start of the bucket containing an ISO-8601 timestamp"""
+    _, length, suffix = BUCKETS[bucket]
+    return timestamp[:length] + suffix
+
+
+async def create_tables(db):
+    """Create rollup tables"""
+    columns = ",\n".join(
+        f"{field}_count INTEGER NOT NULL DEFAULT 0, {field}_sum INTEGER NOT NULL DEFAULT 0, "
+        f"{field}_min INTEGER, {field}_max INTEGER"
+        for field in SENSOR_FIELDS
+    )
+    for table, _, _ in BUCKETS.values():
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id TEXT NOT NULL,
+                bucket_start TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                {columns},
+                PRIMARY KEY (device_id, bucket_start)
+            ) WITHOUT ROWID
+        """)
+
+
+def _upsert_sql(table: str) -> str:
+    """INSERT ... ON CONFLICT statement merging a partial aggregate into a bucket"""
+    updates = ["count = count + excluded.count"]
+    for field in SENSOR_FIELDS:
+        updates.append(f"{field}_count = {field}_count + excluded.{field}_count")
+        updates.append(f"{field}_sum = {field}_sum + excluded.{field}_sum")
+        updates.append(
+            f"{field}_min = CASE WHEN {field}_min IS NULL OR excluded.{field}_min < {field}_min "
+            f"THEN excluded.{field}_min ELSE {field}_min END"
+        )
+        updates.append(
+            f"{field}_max = CASE WHEN {field}_max IS NULL OR excluded.{field}_max > {field}_max "
+            f"THEN excluded.{field}_max ELSE {field}_max END"
+        )
+    columns = ["device_id", "bucket_start", "count"] + STAT_COLUMNS
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT(device_id, bucket_start) DO UPDATE SET {', '.join(updates)}
+    """
+
+
+UPSERT_SQL = {bucket: _upsert_sql(table) for bucket, (table, _, _) in BUCKETS.items()}
+
+
+def aggregate(rows: List[tuple]) -> Dict[str, List[list]]:
+    """
+    Aggregate sensor rows (device_id, timestamp, *SENSOR_FIELDS) into partial
+    buckets. Returns upsert parameters per bucket name. A non-numeric field
+    value is skipped rather than failing the writer's whole batch.
+    """
+    result = {}
+    width = len(SENSOR_FIELDS)
+    
+    for bucket, (_, length, suffix) in BUCKETS.items():
+        partials: Dict[tuple, list] = {}
+        for row in rows:
+            key = (row[0], row[1][:length] + suffix)
+            stats = partials.get(key)
+            if stats is None:
+                stats = [0] + [0, 0, None, None] * width
+                partials[key] = stats
+            stats[0] += 1
+            
+            for i in range(width):
+                value = row[2 + i]
+                if type(value) not in NUMERIC_TYPES:
+                    continue
+                base = 1 + i * 4
+                stats[base] += 1
+                stats[base + 1] += value
+                if stats[base + 2] is None or value < stats[base + 2]:
+                    stats[base + 2] = value
+                if stats[base + 3] is None or value > stats[base + 3]:
+                    stats[base + 3] = value
+        
+        result[bucket] = [[device_id, start] + stats for (device_id, start), stats in partials.items()]
+    
+    return result
+
+
+async def apply(db, rows: List[tuple]):
+    """Merge a batch of sensor rows into all rollups (caller commits)"""
+    for bucket, params in aggregate(rows).items():
+        await db.executemany(UPSERT_SQL[bucket], params)
+
+
+async def rebuild(db, device_id: Optional[str] = None, source: str = "sensor_data",
+                  since: Optional[str] = None):
+    """
+    Regenerate rollups from raw readings (caller commits).
+    source yields (device_id, timestamp, *SENSOR_FIELDS), see storage.py.
+    With since (a day start), older buckets are left alone: their raw
+    readings may already have been purged to the archive. Only the minute
+    buckets scan raw readings; hours and days are merged from them.
+    """
+    conditions = []
+    args = []
+    if device_id:
+        conditions.append("device_id = ?")
+        args.append(device_id)
+    if since:
+        conditions.append("{column} >= ?")
+        args.append(since)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    selects = ", ".join(
+        f"COUNT({field}), COALESCE(SUM({field}), 0), MIN({field}), MAX({field})"
+        for field in SENSOR_FIELDS
+    )
+    merges = ", ".join(
+        f"SUM({field}_count), SUM({field}_sum), MIN({field}_min), MAX({field}_max)"
+        for field in SENSOR_FIELDS
+    )
+    
+    for bucket, (table, length, suffix) in BUCKETS.items():
+        await db.execute(f"DELETE FROM {table} {where.format(column='bucket_start')}", args)
+        if bucket == "1m":
+            await db.execute(f"""
+                INSERT INTO {table} (device_id, bucket_start, count, {', '.join(STAT_COLUMNS)})
+                SELECT device_id, substr(timestamp, 1, {length}) || '{suffix}', COUNT(*), {selects}
+                FROM {source} {where.format(column='timestamp')}
+                GROUP BY device_id, substr(timestamp, 1, {length})
+            """, args)
+            continue
+        
+        # Coarser buckets merge the minute buckets just rebuilt instead of rescanning raw rows
+        await db.execute(f"""
+            INSERT INTO {table} (device_id, bucket_start, count, {', '.join(STAT_COLUMNS)})
+            SELECT device_id, substr(bucket_start, 1, {length}) || '{suffix}', SUM(count), {merges}
+            FROM rollup_1m {where.format(column='bucket_start')}
+            GROUP BY device_id, substr(bucket_start, 1, {length})
+        """, args)
+
+
+async def query(db, device_id: str, bucket: str, start: Optional[str] = None,
+                end: Optional[str] = None) -> List[Dict]:
+    """
+    Rollup rows for one device, oldest first, with per-field averages.
+    start/end select the buckets containing them, however they are written
+    (date only, space separator, UTC offset).
+    """
+    table = BUCKETS[bucket][0]
+    conditions = ["device_id = ?"]
+    args = [device_id]
+    if start:
+        conditions.append("bucket_start >= ?")
+        args.append(bucket_start(normalize_timestamp(start).isoformat(), bucket))
+    if end:
+        conditions.append("bucket_start <= ?")
+        args.append(bucket_start(normalize_timestamp(end).isoformat(), bucket))
+    
+    cursor = await db.execute(f"""
+        SELECT * FROM {table}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket_start
+    """, args)
+    
+    result = []
+    for row in await cursor.fetchall():
+        fields = {}
+        for field in SENSOR_FIELDS:
+            count = row[f"{field}_count"]
+            fields[field] = {
+                "count": count,
+                "sum": row[f"{field}_sum"],
+                "min": row[f"{field}_min"],
+                "max": row[f"{field}_max"],
+                "avg": row[f"{field}_sum"] / count if count else None
+            }
+        result.append({
+            "bucket_start": row["bucket_start"],
+            "count": row["count"],
+            "fields": fields
+        })
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="FarmTech rollup maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate rollups from sensor_data")
+    parser.add_argument("--device", help="only rebuild this device")
+    parser.add_argument("--database", default=Config.DATABASE_PATH)
+    parser.add_argument("--layout", default=Config.STORAGE_LAYOUT, help="legacy or compact")
+    args = parser.parse_args()
+    
+    if not args.rebuild:
+        parser.print_help()
+        return
+    
+    async with aiosqlite.connect(args.database) as db:
+        await create_tables(db)
+        since = await archived_until(db)
+        await rebuild(db, args.device, source=get_storage(args.layout).source, since=since)
+        await db.commit()
+    logger.info(f"Rollups rebuilt for {args.device or 'all devices'} in {args.database}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Sensor payload schema shared with the dashboard
+Field order, types and scaling come from SENSOR_CONFIG in
+frontend/js/sensor-config.js, so server and dashboard use one definition.
+
+Binary ESP32 frame (little-endian):
+    header  : uint8 version, uint8 flags, uint16 reading count
+    reading : uint32 age_ms, [presence mask,] then every sensor field in
+              SENSOR_CONFIG order
+age_ms is how long before the frame was sent the reading was taken, so one
+frame can carry several buffered readings. With FLAG_PRESENCE set, each
+reading carries a little-endian bitmask (bit i = i-th field present, one
+byte per 8 fields) and absent fields, sent as 0, decode to None. Without
+it every field is present.
+"""
+
+import json
+import os
+import re
+import struct
+from typing import Dict, List, Optional
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "frontend", "js", "sensor-config.js")
+
+# Schema type -> struct format code
+STRUCT_CODES = {
+    "int8": "b",
+    "uint8": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I"
+}
+
+# Schema type -> inclusive value range
+TYPE_RANGES = {
+    "int8": (-0x80, 0x7F),
+    "uint8": (0, 0xFF),
+    "int16": (-0x8000, 0x7FFF),
+    "uint16": (0, 0xFFFF),
+    "int32": (-0x80000000, 0x7FFFFFFF),
+    "uint32": (0, 0xFFFFFFFF)
+}
+
+HEADER = struct.Struct("<BBH")
+AGE_FORMAT = "I"
+MAX_READINGS_PER_FRAME = 0xFFFF
+
+# Header flags
+FLAG_PRESENCE = 0x01
+
+
+class FrameError(ValueError):
+    """Invalid binary sensor frame"""
+
+
+def load_sensor_config(path: str = SCHEMA_PATH) -> tuple:
+    """Read SENSOR_CONFIG and SENSOR_FRAME_VERSION from sensor-config.js"""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    
+    match = re.search(r"const SENSOR_CONFIG = (\[.*?\n\]);", source, re.S)
+    if not match:
+        raise RuntimeError(f"SENSOR_CONFIG not found in {path}")
+    config = sorted(json.loads(match.group(1)), key=lambda sensor: sensor["no"])
+    
+    match = re.search(r"const SENSOR_FRAME_VERSION = (\d+);", source)
+    if not match:
+        raise RuntimeError(f"SENSOR_FRAME_VERSION not found in {path}")
+    
+    return config, int(match.group(1))
+
+
+def parse_scale(expression: str) -> float:
+    """Divisor for a SENSOR_CONFIG scale expression ("value" or "value/<number>")"""
+    match = re.fullmatch(r"\s*value\s*(?:/\s*([0-9.eE+]+)\s*)?", expression)
+    if not match:
+        raise RuntimeError(f"Unsupported scale expression: {expression}")
+    return float(match.group(1)) if match.group(1) else 1.0
+
+
+SENSOR_CONFIG, FRAME_VERSION = load_sensor_config()
+SENSOR_FIELDS = tuple(sensor["field"] for sensor in SENSOR_CONFIG)
+SENSORS_BY_FIELD: Dict[str, dict] = {sensor["field"]: sensor for sensor in SENSOR_CONFIG}
+FIELD_RANGES: Dict[str, tuple] = {sensor["field"]: TYPE_RANGES[sensor["type"]] for sensor in SENSOR_CONFIG}
+SCALE_DIVISORS: Dict[str, float] = {sensor["field"]: parse_scale(sensor["scale"]) for sensor in SENSOR_CONFIG}
+
+FIELD_FORMAT = "".join(STRUCT_CODES[s["type"]] for s in SENSOR_CONFIG)
+PRESENCE_BYTES = (len(SENSOR_FIELDS) + 7) // 8
+READING = struct.Struct("<" + AGE_FORMAT + FIELD_FORMAT)
+READING_WITH_PRESENCE = struct.Struct("<" + AGE_FORMAT + f"{PRESENCE_BYTES}s" + FIELD_FORMAT)
+
+
+def describe_frame() -> dict:
+    """Frame layout for firmware authors (served by /api)"""
+    return {
+        "version": FRAME_VERSION,
+        "byte_order": "little",
+        "header": ["uint8 version", "uint8 flags", "uint16 count"],
+        "header_size": HEADER.size,
+        "flags": {"presence": FLAG_PRESENCE},
+        "reading": ["uint32 age_ms"] + [f"{s['type']} {s['field']}" for s in SENSOR_CONFIG],
+        "reading_size": READING.size,
+        "presence_mask_bytes": PRESENCE_BYTES
+    }
+
+
+def decode_frame(payload: bytes) -> List[dict]:
+    """Decode a binary frame into reading dicts (sensor fields plus age_ms)"""
+    if len(payload) < HEADER.size:
+        raise FrameError("Frame shorter than header")
+    
+    version, flags, count = HEADER.unpack_from(payload)
+    if version != FRAME_VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    if flags & ~FLAG_PRESENCE:
+        raise FrameError(f"Unsupported frame flags {flags:#04x}")
+    reading = READING_WITH_PRESENCE if flags & FLAG_PRESENCE else READING
+    
+    expected = HEADER.size + count * reading.size
+    if len(payload) != expected:
+        raise FrameError(f"Frame size {len(payload)} does not match {count} readings ({expected} bytes)")
+    
+    keys = ("age_ms",) + SENSOR_FIELDS
+    body = memoryview(payload)[HEADER.size:]
+    if reading is READING:
+        return [dict(zip(keys, values)) for values in READING.iter_unpack(body)]
+    
+    result = []
+    for age, mask, *values in reading.iter_unpack(body):
+        present = int.from_bytes(mask, "little")
+        result.append({"age_ms": age, **{
+            field: value if present >> i & 1 else None
+            for i, (field, value) in enumerate(zip(SENSOR_FIELDS, values))
+        }})
+    return result
+
+
+def encode_frame(readings: List[dict], ages_ms: Optional[List[int]] = None) -> bytes:
+    """
+    Encode readings into a binary frame (used by tools and simulators).
+    A presence mask is added only when some reading lacks a field.
+    """
+    if len(readings) > MAX_READINGS_PER_FRAME:
+        raise FrameError(f"At most {MAX_READINGS_PER_FRAME} readings per frame")
+    
+    ages_ms = ages_ms or [0] * len(readings)
+    masked = any(reading.get(field) is None for reading in readings for field in SENSOR_FIELDS)
+    parts = [HEADER.pack(FRAME_VERSION, FLAG_PRESENCE if masked else 0, len(readings))]
+    for reading, age in zip(readings, ages_ms):
+        values = [reading.get(field) for field in SENSOR_FIELDS]
+        fields = [0 if value is None else value for value in values]
+        if not masked:
+            parts.append(READING.pack(age, *fields))
+            continue
+        present = sum(1 << i for i, value in enumerate(values) if value is not None)
+        parts.append(READING_WITH_PRESENCE.pack(age, present.to_bytes(PRESENCE_BYTES, "little"), *fields))
+    return b"".join(parts)
@@ -3,20 +3,38 @@ FarmTech WebSocket Server
 Real-time sensor data collection and broadcasting
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 import asyncio
 import json
 import logging
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set
 import uvicorn
 import os
 
 from database import Database
+from broker import get_broker
 from config import Config
+import sensor_schema
+import ingest
+import rollups
+from export import ExportRequest
+from history import parse_fields, parse_time
+from subscriptions import SubscriptionIndex, resolve_fields
+from live_stream import LiveStream
+import activity
+import alerts
+import geo
+from pipeline import IngestPipeline
+from liveness import LivenessMonitor
+import metrics
+from profiler import SamplingProfiler
+from read_cache import INGEST_TAGS, ReadCache
 
 # Setup logging
 logging.basicConfig(
@@ -51,29 +69,255 @@ if os.path.exists(frontend_dir):
         app.mount("/js", StaticFiles(directory=js_dir), name="js")
         logger.info(f"📁 Serving JS from:  {js_dir}")
 
+# Message bus between workers (a no-op with a single worker)
+broker = get_broker(
+    Config.BROKER,
+    workers=Config.WORKERS,
+    socket_path=Config.BROKER_SOCKET,
+    lock_path=Config.DATABASE_PATH + ".writer.lock",
+    timeout=Config.BROKER_TIMEOUT
+)
+
 # Initialize database
-db = Database()
+db = Database(broker)
+
+# Encoded snapshot reads, invalidated by the writer after each ingest batch
+read_cache = ReadCache(
+    ttl=Config.READ_CACHE_TTL,
+    max_bytes=Config.READ_CACHE_MAX_BYTES,
+    max_entries=Config.READ_CACHE_MAX_ENTRIES,
+    enabled=Config.READ_CACHE_ENABLED
+)
+
+
+async def invalidate_reads(tags: List[str]):
+    read_cache.invalidate(tags)
+
+
+broker.on("invalidate", invalidate_reads)
+
+
+def cached_json(body: bytes) -> Response:
+    """Response for a pre-encoded JSON body"""
+    return Response(content=body, media_type="application/json")
+
+
+async def load_dashboard_snapshot() -> dict:
+    """Initial data shared by every dashboard that connects (see send_initial_data)"""
+    return {
+        "sensor_readings": await db.get_recent_data(limit=100),
+        "devices": await db.get_all_devices(),
+        "statistics": await db.get_statistics()
+    }
 
 
 # ============================================================
 # CONNECTION MANAGER
 # ============================================================
 
+class DashboardConnection:
+    """
+    Outbound side of one dashboard WebSocket.
+    Messages are queued (already JSON-encoded) and sent by a dedicated task,
+    so a slow browser never blocks ingest or other dashboards.
+    """
+    
+    POLICIES = ("drop_oldest", "coalesce", "disconnect")
+    RATE_WINDOW = 5.0  # seconds
+    
+    def __init__(self, websocket: WebSocket, policy: str, max_queue: int, max_lag: float,
+                 totals: Optional[dict] = None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown dashboard slow consumer policy: {policy}")
+        
+        self.websocket = websocket
+        self.policy = policy
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.totals = totals if totals is not None else {}
+        
+        client = websocket.client
+        self.id = f"{client.host}:{client.port}" if client else str(id(websocket))
+        
+        # The server accepts permessage-deflate whenever the client offers it
+        extensions = websocket.headers.get("sec-websocket-extensions", "")
+        self.deflate = Config.WS_PER_MESSAGE_DEFLATE and "permessage-deflate" in extensions
+        
+        # Opt-in throttled delta stream (replaces per-reading sensor_data)
+        self.stream: Optional[LiveStream] = None
+        
+        # Entries are [key, text, enqueued_at]; key is set for coalescable messages
+        self.queue: deque = deque()
+        self.pending: Dict[tuple, list] = {}
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        
+        self.stats = {
+            "sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+            "bytes_sent": 0
+        }
+        
+        # (sent_at, bytes) over the last RATE_WINDOW seconds, for bytes_per_sec
+        self.sent_window: deque = deque()
+        self.sent_window_bytes = 0
+    
+    def start(self, on_error):
+        """Start the sender task; on_error(connection) is called if sending fails"""
+        self.task = asyncio.create_task(self._run(on_error))
+    
+    def stop(self):
+        """Stop the sender task"""
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.task = None
+        self.set_stream(None)
+    
+    def set_stream(self, stream: Optional[LiveStream]):
+        """Switch to (or, with None, out of) the throttled delta stream"""
+        if self.stream is not None:
+            self.stream.stop()
+        self.stream = stream
+        if stream is not None:
+            stream.start()
+    
+    def _count_sent(self, nbytes: int):
+        now = time.monotonic()
+        self.stats["bytes_sent"] += nbytes
+        self.sent_window.append((now, nbytes))
+        self.sent_window_bytes += nbytes
+        self._trim_window(now)
+    
+    def _trim_window(self, now: float):
+        while self.sent_window and now - self.sent_window[0][0] > self.RATE_WINDOW:
+            self.sent_window_bytes -= self.sent_window.popleft()[1]
+    
+    def bytes_per_sec(self) -> float:
+        """Payload bytes sent per second over the last RATE_WINDOW seconds (before compression)"""
+        self._trim_window(time.monotonic())
+        return round(self.sent_window_bytes / self.RATE_WINDOW, 1)
+    
+    def lag(self) -> float:
+        """Seconds the oldest queued message has been waiting"""
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - self.queue[0][2]
+    
+    def enqueue(self, text: str, key: Optional[tuple] = None) -> bool:
+        """
+        Queue an encoded message. Returns False when the consumer has fallen
+        further behind than the policy allows and should be disconnected.
+        """
+        if key is not None and self.policy == "coalesce":
+            entry = self.pending.get(key)
+            if entry is not None:
+                entry[1] = text
+                self.stats["coalesced"] += 1
+                return True
+        
+        if len(self.queue) >= self.max_queue:
+            dropped = self.queue.popleft()
+            if dropped[0] is not None and self.pending.get(dropped[0]) is dropped:
+                del self.pending[dropped[0]]
+            self.stats["dropped"] += 1
+            self.totals["dashboard_messages_dropped"] = self.totals.get("dashboard_messages_dropped", 0) + 1
+        
+        entry = [key, text, time.monotonic()]
+        self.queue.append(entry)
+        if key is not None and self.policy == "coalesce":
+            self.pending[key] = entry
+        self.ready.set()
+        
+        if self.policy == "disconnect" and self.lag() > self.max_lag:
+            return False
+        return True
+    
+    async def _run(self, on_error):
+        """Send queued messages in order"""
+        while True:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            
+            entry = self.queue.popleft()
+            if entry[0] is not None and self.pending.get(entry[0]) is entry:
+                del self.pending[entry[0]]
+            
+            try:
+                await self.websocket.send_text(entry[1])
+            except Exception as e:
+                logger.error(f"Error sending to dashboard {self.id}: {e}")
+                on_error(self)
+                return
+            
+            lag_ms = (time.monotonic() - entry[2]) * 1000
+            metrics.DASHBOARD_SEND_SECONDS.observe(lag_ms / 1000)
+            self._count_sent(len(entry[1]))  # json.dumps output is ASCII
+            self.stats["sent"] += 1
+            self.stats["last_lag_ms"] = round(lag_ms, 3)
+            self.stats["max_lag_ms"] = round(max(self.stats["max_lag_ms"], lag_ms), 3)
+    
+    def describe(self) -> dict:
+        """Per-dashboard counters for /api/status"""
+        return {
+            "id": self.id,
+            "policy": self.policy,
+            "queued": len(self.queue),
+            "lag_ms": round(self.lag() * 1000, 3),
+            **self.stats,
+            "bytes_per_sec": self.bytes_per_sec(),
+            "deflate": self.deflate,
+            "stream": self.stream.describe() if self.stream else {"enabled": False}
+        }
+
+
 class ConnectionManager:
-    """Manage WebSocket connections"""
+    """
+    Manage WebSocket connections
+    Sockets are local to this worker; broadcasts, device presence, commands
+    and stats reach the other workers through the broker.
+    """
     
-    def __init__(self):
+    def __init__(self, broker):
         # ESP32 devices connections
         self.esp32_connections:  Dict[str, WebSocket] = {}
         
+        # ESP32 devices connected to other workers: device_id -> worker id
+        self.broker = broker
+        self.remote_devices: Dict[str, str] = {}
+        self.worker_stats: Dict[str, dict] = {}
+        self.stats_task: Optional[asyncio.Task] = None
+        
+        # Fire-and-forget tasks, referenced until they finish so they are not collected mid-run
+        self.background_tasks: Set[asyncio.Task] = set()
+        
+        broker.on("dashboard", self._on_remote_broadcast)
+        broker.on("presence", self._on_presence)
+        broker.on("hello", self._on_worker_joined)
+        broker.on("worker_left", self._on_worker_left)
+        broker.on("command", self._on_command)
+        broker.on("stats", self._on_worker_stats)
+        broker.on("groups", self._on_group_changed)
+        broker.on("alerts", self._on_alerts)
+        broker.on("geofence", self._on_geofence)
+        
         # Web dashboard connections
-        self.dashboard_connections: Set[WebSocket] = set()
+        self.dashboard_connections: Dict[WebSocket, DashboardConnection] = {}
+        
+        # Which dashboards want which devices/fields (default: everything)
+        self.subscriptions = SubscriptionIndex()
         
         # Statistics
         self.stats = {
             "total_messages": 0,
             "total_esp32_connected": 0,
-            "total_dashboard_connected": 0
+            "total_dashboard_connected": 0,
+            "dashboard_messages_dropped": 0,
+            "dashboards_disconnected_slow": 0
         }
     
     async def connect_esp32(self, device_id: str, websocket: WebSocket):
@@ -82,6 +326,7 @@ class ConnectionManager:
         self.esp32_connections[device_id] = websocket
         self.stats["total_esp32_connected"] = len(self.esp32_connections)
         logger.info(f"ESP32 {device_id} connected.  Total ESP32: {len(self.esp32_connections)}")
+        await self.broker.publish("presence", self._presence(device_id, True))
         
         # Notify dashboards about new device
         await self.broadcast_to_dashboards({
@@ -92,45 +337,228 @@ class ConnectionManager:
     
     async def connect_dashboard(self, websocket:  WebSocket):
         """Connect web dashboard"""
-        await websocket. accept()
-        self.dashboard_connections.add(websocket)
-        self.stats["total_dashboard_connected"] = len(self. dashboard_connections)
-        logger.info(f"Dashboard connected. Total dashboards: {len(self.dashboard_connections)}")
+        await websocket.accept()
+        connection = DashboardConnection(
+            websocket,
+            policy=Config.DASHBOARD_SLOW_POLICY,
+            max_queue=Config.DASHBOARD_QUEUE_SIZE,
+            max_lag=Config.DASHBOARD_MAX_LAG,
+            totals=self.stats
+        )
+        
+        # Initial data is queued first so it precedes any broadcast
+        await self.send_initial_data(connection)
         
-        # Send initial data
-        await self.send_initial_data(websocket)
+        self.dashboard_connections[websocket] = connection
+        self.subscriptions.add(websocket)
+        connection.start(self._on_dashboard_error)
+        self.stats["total_dashboard_connected"] = len(self.dashboard_connections)
+        logger.info(f"Dashboard connected. Total dashboards: {len(self.dashboard_connections)}")
+    
+    def spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
     
-    def disconnect_esp32(self, device_id: str):
-        """Disconnect ESP32 device"""
+    def disconnect_esp32(self, device_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect ESP32 device (only that socket, if given: the id may have reconnected)"""
+        if websocket is not None and self.esp32_connections.get(device_id) is not websocket:
+            return
         if device_id in self. esp32_connections:
             del self.esp32_connections[device_id]
             self.stats["total_esp32_connected"] = len(self.esp32_connections)
             logger.info(f"ESP32 {device_id} disconnected. Total ESP32: {len(self.esp32_connections)}")
+            self.spawn(self.broker.publish("presence", self._presence(device_id, False)))
     
     def disconnect_dashboard(self, websocket: WebSocket):
         """Disconnect web dashboard"""
-        if websocket in self.dashboard_connections:
-            self.dashboard_connections.remove(websocket)
+        connection = self.dashboard_connections.pop(websocket, None)
+        if connection is not None:
+            self.subscriptions.remove(websocket)
+            connection.stop()
             self.stats["total_dashboard_connected"] = len(self.dashboard_connections)
             logger.info(f"Dashboard disconnected. Total dashboards: {len(self. dashboard_connections)}")
     
+    async def evict_esp32(self, device_id: str, websocket: WebSocket):
+        """Close a device connection that stopped responding (its receive loop then ends)"""
+        self.disconnect_esp32(device_id, websocket)
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            pass
+    
+    def _on_dashboard_error(self, connection: DashboardConnection):
+        """Sender task failed: drop the dashboard"""
+        self.disconnect_dashboard(connection.websocket)
+    
+    async def _close_slow_dashboard(self, connection: DashboardConnection):
+        """Disconnect a dashboard that fell too far behind"""
+        logger.warning(f"Dashboard {connection.id} is {connection.lag():.1f}s behind, disconnecting")
+        self.stats["dashboards_disconnected_slow"] += 1
+        self.disconnect_dashboard(connection.websocket)
+        try:
+            await connection.websocket.close(code=1013)
+        except Exception:
+            pass
+    
+    def _enqueue(self, connection: DashboardConnection, text: str, key=None):
+        if not connection.enqueue(text, key):
+            self.spawn(self._close_slow_dashboard(connection))
+    
     async def broadcast_to_dashboards(self, message: dict):
-        """Broadcast message to all connected dashboards"""
-        disconnected = set()
+        """Broadcast message to all dashboards on every worker"""
+        await self.broker.publish("dashboard", message)
+        self.deliver(message)
+    
+    def deliver(self, message: dict):
+        """Queue a broadcast for this worker's dashboards (encoded once, queued per dashboard)"""
+        if not self.dashboard_connections:
+            return
         
-        for connection in self.dashboard_connections:
-            try:
-                await connection. send_json(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to dashboard:  {e}")
-                disconnected. add(connection)
+        started = time.perf_counter()
+        if message.get("type") == "sensor_data":
+            self.route_sensor_data(message)
+        else:
+            text = json.dumps(message)
+            for connection in list(self.dashboard_connections.values()):
+                self._enqueue(connection, text)
+        metrics.BROADCAST_FANOUT_SECONDS.observe(time.perf_counter() - started)
+    
+    def route_sensor_data(self, message: dict):
+        """
+        Send a reading only to dashboards subscribed to its device (directly,
+        via a group, or by default to everything), projected to each
+        dashboard's fields; each distinct projection is encoded once
+        """
+        device_id = message["data"].get("device_id")
+        key = ("sensor_data", device_id)
+        count = message.get("batch", {}).get("count", 1)
+        for fields, websockets in self.subscriptions.route(device_id).items():
+            data = message["data"]
+            if fields is not None:
+                data = {
+                    name: value for name, value in data.items()
+                    if name in fields or name not in sensor_schema.SENSORS_BY_FIELD
+                }
+            text = None
+            for websocket in websockets:
+                connection = self.dashboard_connections.get(websocket)
+                if connection is None:
+                    continue
+                if connection.stream is not None:
+                    connection.stream.add(data, count)
+                    continue
+                if text is None:
+                    text = json.dumps({**message, "data": data})
+                self._enqueue(connection, text, key)
+    
+    def set_stream_mode(self, websocket: WebSocket, options) -> dict:
+        """
+        Turn the throttled delta stream on or off for a dashboard.
+        options: enabled, interval_ms, keep ("latest" or "all"), keyframe_every
+        """
+        connection = self.dashboard_connections[websocket]
+        if not options.get("enabled", True):
+            connection.set_stream(None)
+            return {"enabled": False}
         
-        # Remove disconnected clients
-        for conn in disconnected:
-            self. disconnect_dashboard(conn)
+        interval_ms = int(options.get("interval_ms", Config.STREAM_INTERVAL_MS))
+        if interval_ms < Config.STREAM_MIN_INTERVAL_MS:
+            raise ValueError(f"interval_ms must be at least {Config.STREAM_MIN_INTERVAL_MS}")
+        stream = LiveStream(
+            lambda text: self._enqueue(connection, text),
+            interval_ms=interval_ms,
+            keep=options.get("keep", "latest"),
+            keyframe_every=int(options.get("keyframe_every", Config.STREAM_KEYFRAME_EVERY)),
+            max_pending=Config.STREAM_MAX_PENDING
+        )
+        connection.set_stream(stream)
+        return stream.describe()
+    
+    def resync_stream(self, websocket: WebSocket):
+        """Next frame to this dashboard is a keyframe (no-op outside stream mode)"""
+        connection = self.dashboard_connections.get(websocket)
+        if connection is not None and connection.stream is not None:
+            connection.stream.resync()
+    
+    def subscribe_dashboard(self, websocket: WebSocket, command: dict) -> dict:
+        """
+        Handle a subscribe command: add device ids and/or groups, set the
+        field projection (categories and/or fields), or "all": true to go
+        back to receiving everything
+        """
+        projection = "categories" in command or "fields" in command
+        fields = resolve_fields(command.get("categories"), command.get("fields"))
+        subscription = self.subscriptions.subscribe(
+            websocket,
+            devices=self._id_list(command.get("devices")),
+            groups=self._id_list(command.get("groups")),
+            fields=fields,
+            everything=bool(command.get("all")),
+            projection=projection
+        )
+        self.resync_stream(websocket)
+        return subscription.describe()
+    
+    def unsubscribe_dashboard(self, websocket: WebSocket, command: dict) -> dict:
+        """Handle an unsubscribe command (devices, groups, fields/categories, or "all": true)"""
+        fields = set(self._id_list(command.get("fields")))
+        categories = self._id_list(command.get("categories"))
+        if categories:
+            fields |= resolve_fields(categories) or set(sensor_schema.SENSOR_FIELDS)
+        subscription = self.subscriptions.unsubscribe(
+            websocket,
+            devices=self._id_list(command.get("devices")),
+            groups=self._id_list(command.get("groups")),
+            fields=fields,
+            everything=bool(command.get("all"))
+        )
+        self.resync_stream(websocket)
+        return subscription.describe()
+    
+    @staticmethod
+    def _id_list(value) -> List[str]:
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError("Expected a string or a list of strings")
+        return value
+    
+    async def publish_batch(self, readings: List[dict]):
+        """Broadcast a batch as one sensor_data message per device (newest reading)"""
+        for device_id, entry in ingest.latest_by_device(readings).items():
+            await self.broadcast_to_dashboards({
+                "type": "sensor_data",
+                "data": entry["latest"],
+                "batch": {
+                    "count": entry["count"],
+                    "from": entry["from"],
+                    "to": entry["to"]
+                }
+            })
+    
+    def send_to_dashboard(self, websocket: WebSocket, message: dict):
+        """Queue a message for one dashboard"""
+        connection = self.dashboard_connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, json.dumps(message))
+    
+    def dashboard_stats(self) -> List[dict]:
+        """Per-dashboard queue, lag, drop counters and subscription"""
+        return [
+            {**connection.describe(), "subscription": self.subscriptions.subscriptions[websocket].describe()}
+            for websocket, connection in self.dashboard_connections.items()
+        ]
     
     async def send_to_esp32(self, device_id: str, message: dict):
-        """Send message to specific ESP32 device"""
+        """Send message to specific ESP32 device (forwarded if it is connected to another worker)"""
+        if device_id not in self.esp32_connections and device_id in self.remote_devices:
+            await self.broker.publish("command", {"device_id": device_id, "command": message})
+            return
         if device_id in self.esp32_connections:
             try:
                 await self.esp32_connections[device_id].send_json(message)
@@ -138,33 +566,235 @@ class ConnectionManager:
                 logger. error(f"Error sending to ESP32 {device_id}: {e}")
                 self.disconnect_esp32(device_id)
     
-    async def send_initial_data(self, websocket: WebSocket):
-        """Send initial data to newly connected dashboard"""
+    async def send_initial_data(self, connection: DashboardConnection):
+        """Queue initial data for newly connected dashboard"""
         try:
-            # Get recent sensor data
-            recent_data = await db.get_recent_data(limit=100)
-            
-            # Get device list
-            devices = await db.get_all_devices()
-            
-            # Get statistics
-            stats = await db. get_statistics()
-            
-            await websocket.send_json({
-                "type": "initial_data",
-                "data": {
-                    "sensor_readings": recent_data,
-                    "devices": devices,
-                    "statistics": stats,
-                    "connected_devices": list(self.esp32_connections. keys())
-                }
-            })
+            # Recent readings, devices and statistics: one cached encoding for
+            # every dashboard; connected devices are appended per send
+            snapshot = await read_cache.get(("snapshot",), load_dashboard_snapshot, tags=INGEST_TAGS)
+            self._enqueue(
+                connection,
+                '{"type":"initial_data","data":' + snapshot.decode()[:-1]
+                + ',"connected_devices":' + json.dumps(self.connected_devices()) + '}}'
+            )
         except Exception as e: 
             logger.error(f"Error sending initial data: {e}")
+    
+    def connected_devices(self) -> List[str]:
+        """ESP32 devices connected to any worker"""
+        return sorted(set(self.esp32_connections) | set(self.remote_devices))
+    
+    def _presence(self, device_id: str, connected: bool) -> dict:
+        return {"worker": self.broker.worker_id, "device_id": device_id, "connected": connected}
+    
+    async def update_group(self, name: str, device_ids: Optional[List[str]]):
+        """Apply a device group change (None = deleted) here and on the other workers"""
+        await self._on_group_changed({"name": name, "device_ids": device_ids})
+        await self.broker.publish("groups", {"name": name, "device_ids": device_ids})
+    
+    def start(self):
+        """Start publishing this worker's stats to the others"""
+        if self.stats_task is None:
+            self.stats_task = asyncio.create_task(self._stats_loop())
+    
+    def stop(self):
+        if self.stats_task:
+            self.stats_task.cancel()
+            self.stats_task = None
+    
+    def local_stats(self) -> dict:
+        return {
+            "esp32_devices": len(self.esp32_connections),
+            "dashboards": len(self.dashboard_connections),
+            **self.stats
+        }
+    
+    async def _stats_loop(self):
+        while True:
+            await asyncio.sleep(Config.BROKER_STATS_INTERVAL)
+            try:
+                await self.broker.publish("stats", {"worker": self.broker.worker_id, "stats": self.local_stats()})
+            except Exception as e:
+                logger.error(f"Error publishing worker stats: {e}")
+    
+    def cluster_stats(self) -> dict:
+        """Broker state, per-worker stats and totals across workers"""
+        workers = {self.broker.worker_id: self.local_stats(), **self.worker_stats}
+        totals: Dict[str, int] = {}
+        for stats in workers.values():
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return {
+            "broker": self.broker.describe(),
+            "workers": workers,
+            "totals": totals
+        }
+    
+    # Broker handlers (messages from other workers)
+    
+    async def _on_remote_broadcast(self, message: dict):
+        self.deliver(message)
+    
+    async def _on_presence(self, message: dict):
+        if message["connected"]:
+            self.remote_devices[message["device_id"]] = message["worker"]
+        elif self.remote_devices.get(message["device_id"]) == message["worker"]:
+            del self.remote_devices[message["device_id"]]
+    
+    async def _on_worker_joined(self, message):
+        """A worker (re)connected: tell it which devices are connected here"""
+        for device_id in list(self.esp32_connections):
+            await self.broker.publish("presence", self._presence(device_id, True))
+    
+    async def _on_worker_left(self, message: dict):
+        worker = message["worker"]
+        self.worker_stats.pop(worker, None)
+        for device_id in [d for d, w in self.remote_devices.items() if w == worker]:
+            del self.remote_devices[device_id]
+            self.deliver({
+                "type": "device_disconnected",
+                "device_id": device_id,
+                "timestamp": datetime.now().isoformat()
+            })
+    
+    async def _on_command(self, message: dict):
+        if message["device_id"] in self.esp32_connections:
+            await self.send_to_esp32(message["device_id"], message["command"])
+    
+    async def _on_worker_stats(self, message: dict):
+        self.worker_stats[message["worker"]] = message["stats"]
+    
+    async def _on_group_changed(self, message: dict):
+        if message["device_ids"] is None:
+            self.subscriptions.remove_group(message["name"])
+        else:
+            self.subscriptions.set_group(message["name"], message["device_ids"])
+    
+    async def _on_alerts(self, found: List[dict]):
+        """Alerts from the writer's detection stage, to dashboards subscribed to each device"""
+        self.route_device_events("alert", found)
+    
+    async def _on_geofence(self, events: List[dict]):
+        """Geofence enter/exit events from the writer, to dashboards subscribed to each device"""
+        self.route_device_events("geofence", events)
+    
+    def route_device_events(self, kind: str, events: List[dict]):
+        for event in events:
+            text = json.dumps({"type": kind, "data": event})
+            for websockets in self.subscriptions.route(event["device_id"]).values():
+                for websocket in websockets:
+                    connection = self.dashboard_connections.get(websocket)
+                    if connection is not None:
+                        self._enqueue(connection, text)
 
 
 # Initialize connection manager
-manager = ConnectionManager()
+manager = ConnectionManager(broker)
+
+
+async def publish_readings(readings: List[dict]):
+    """Publish stage of the ESP32 ingest pipeline: fan readings out to dashboards"""
+    for sensor_data in readings:
+        await manager.broadcast_to_dashboards({
+            "type": "sensor_data",
+            "data": sensor_data
+        })
+    manager.stats["total_messages"] += len(readings)
+
+
+# Initialize ESP32 ingest pipeline
+pipeline = IngestPipeline(
+    db,
+    publish_readings,
+    device_queue=Config.PIPELINE_DEVICE_QUEUE,
+    publish_queue=Config.PIPELINE_PUBLISH_QUEUE,
+    max_inflight=Config.PIPELINE_MAX_INFLIGHT,
+    slow_fill=Config.PIPELINE_SLOW_DOWN_FILL,
+    resume_fill=Config.PIPELINE_RESUME_FILL
+)
+
+
+def ping_device(device_id: str, session):
+    """Liveness: a device went quiet, ask it for a pong"""
+    session.send({"status": "ping", "timestamp": datetime.now().isoformat()})
+
+
+def report_device_status(device_id: str, status: str, last_seen: float, reason: str):
+    """Liveness: push online/warning/offline transitions to dashboards"""
+    manager.spawn(manager.broadcast_to_dashboards({
+        "type": "device_status",
+        "device_id": device_id,
+        "status": status,
+        "reason": reason,
+        "last_seen": datetime.fromtimestamp(last_seen).isoformat(),
+        "timestamp": datetime.now().isoformat()
+    }))
+
+
+def evict_device(device_id: str, session):
+    """Liveness: a device stayed silent past WS_TIMEOUT"""
+    manager.spawn(manager.evict_esp32(device_id, session.websocket))
+
+
+# Initialize device liveness monitor
+liveness = LivenessMonitor(
+    heartbeat=Config.WS_HEARTBEAT_INTERVAL,
+    timeout=Config.WS_TIMEOUT,
+    tick=Config.LIVENESS_TICK,
+    on_ping=ping_device,
+    on_status=report_device_status,
+    on_timeout=evict_device
+)
+
+
+# ============================================================
+# METRICS & PROFILER
+# ============================================================
+
+HTTP_READINGS = metrics.INGEST_READINGS.labels("http")
+
+profiler = SamplingProfiler()
+
+
+def collect_metrics():
+    """Scrape-time gauges: queue depths and connections of this worker"""
+    queues = metrics.QUEUE_DEPTH
+    queues.labels("write").set(db.writer.queue.qsize() if db.writer.task else 0)
+    queues.labels("pipeline_inbox").set(sum(session.inbox.qsize() for session in pipeline.sessions))
+    queues.labels("publish").set(pipeline.publish_queue.qsize())
+    queues.labels("dashboard").set(sum(len(c.queue) for c in manager.dashboard_connections.values()))
+    
+    metrics.WRITE_QUEUE_FILL.set(round(pipeline.writer_fill(), 4))
+    
+    metrics.CONNECTED_DEVICES.set(len(manager.esp32_connections))
+    metrics.CONNECTED_DASHBOARDS.set(len(manager.dashboard_connections))
+    
+    # Only statuses with tracked devices, as reported by the monitor
+    status = metrics.DEVICE_LIVENESS
+    status.children.clear()
+    for name, count in liveness.status_counts().items():
+        status.labels(name).set(count)
+    metrics.DEVICE_TIMEOUTS.set_total(liveness.stats["timeouts"])
+    
+    metrics.SLOWED_DEVICES.set(sum(1 for session in pipeline.sessions if session.slowed))
+    
+    metrics.PUBLISH_DROPPED.set_total(pipeline.stats["publish_dropped"])
+    
+    reads = metrics.READ_CACHE_LOOKUPS
+    for result, key in (("hit", "hits"), ("miss", "misses"), ("coalesced", "coalesced")):
+        reads.labels(result).set_total(read_cache.stats[key])
+    
+    # The role changes when a follower is promoted to writer
+    info = metrics.WORKER_INFO
+    info.children.clear()
+    info.labels(broker.worker_id, "writer" if db.writer.task else "follower").set(1)
+    return [
+        queues, metrics.WRITE_QUEUE_FILL, metrics.CONNECTED_DEVICES, metrics.CONNECTED_DASHBOARDS, status,
+        metrics.DEVICE_TIMEOUTS, metrics.SLOWED_DEVICES, metrics.PUBLISH_DROPPED, reads, info
+    ]
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
 
 
 # ============================================================
@@ -175,49 +805,25 @@ manager = ConnectionManager()
 async def websocket_esp32_endpoint(websocket: WebSocket, device_id: str):
     """
     WebSocket endpoint for ESP32 devices
-    ESP32 connects here to send sensor data
+    ESP32 connects here to send sensor data, either as JSON text or as
+    binary frames (layout in sensor_schema.py, one or more readings each)
     """
     await manager.connect_esp32(device_id, websocket)
     
+    # Parse, persist and publish run in the pipeline; this loop only receives
+    session = pipeline.open_session(device_id, websocket)
+    liveness.add(device_id, session)
     try:
         while True:
-            # Receive data from ESP32
-            data = await websocket.receive_text()
-            
-            try:
-                sensor_data = json.loads(data)
-                sensor_data['device_id'] = device_id
-                sensor_data['timestamp'] = datetime. now().isoformat()
-                
-                logger.info(f"Received data from {device_id}: {len(data)} bytes")
-                
-                # Save to database
-                await db.save_sensor_data(sensor_data)
-                
-                # Broadcast to all dashboards
-                await manager.broadcast_to_dashboards({
-                    "type": "sensor_data",
-                    "data": sensor_data
-                })
-                
-                manager.stats["total_messages"] += 1
-                
-                # Send acknowledgment back to ESP32
-                await websocket.send_json({
-                    "status": "ok",
-                    "message":  "Data received",
-                    "timestamp": datetime.now().isoformat()
-                })
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON from {device_id}: {e}")
-                await websocket.send_json({
-                    "status":  "error",
-                    "message": "Invalid JSON format"
-                })
-            
+            # Receive data from ESP32 (JSON text or binary frame)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            liveness.touch(device_id)
+            await session.receive(message, datetime.now())
+    
     except WebSocketDisconnect: 
-        manager.disconnect_esp32(device_id)
+        manager.disconnect_esp32(device_id, websocket)
         await manager.broadcast_to_dashboards({
             "type": "device_disconnected",
             "device_id":  device_id,
@@ -225,7 +831,10 @@ async def websocket_esp32_endpoint(websocket: WebSocket, device_id: str):
         })
     except Exception as e:
         logger.error(f"Error in ESP32 WebSocket {device_id}: {e}")
-        manager.disconnect_esp32(device_id)
+        manager.disconnect_esp32(device_id, websocket)
+    finally:
+        liveness.remove(device_id, session)
+        await session.close()
 
 
 @app.websocket("/ws/dashboard")
@@ -233,9 +842,21 @@ async def websocket_dashboard_endpoint(websocket: WebSocket):
     """
     WebSocket endpoint for web dashboards
     Dashboard connects here to receive real-time sensor data
+    (?stream=1&interval_ms=250&keep=latest starts in stream mode)
     """
     await manager.connect_dashboard(websocket)
     
+    params = websocket.query_params
+    if params.get("stream", "").lower() in ("1", "true"):
+        try:
+            manager.set_stream_mode(websocket, dict(params))
+        except (ValueError, TypeError) as e:
+            manager.send_to_dashboard(websocket, {
+                "type": "error",
+                "command": "stream_mode",
+                "message": str(e)
+            })
+    
     try:
         while True:
             # Receive commands from dashboard
@@ -246,37 +867,110 @@ async def websocket_dashboard_endpoint(websocket: WebSocket):
                 command_type = command.get("type")
                 
                 if command_type == "ping":
-                    await websocket. send_json({
+                    manager.send_to_dashboard(websocket, {
                         "type": "pong",
                         "timestamp": datetime. now().isoformat()
                     })
                 
                 elif command_type == "get_stats":
                     stats = await db.get_statistics()
-                    await websocket.send_json({
+                    manager.send_to_dashboard(websocket, {
                         "type": "statistics",
                         "data": stats
                     })
                 
                 elif command_type == "get_device_data":
                     device_id = command.get("device_id")
-                    limit = command.get("limit", 100)
-                    data = await db.get_device_data(device_id, limit)
-                    await websocket. send_json({
+                    try:
+                        query = db.history(
+                            device_id,
+                            start=command.get("from"),
+                            end=command.get("to"),
+                            fields=command.get("fields"),
+                            cursor=command.get("cursor"),
+                            limit=command.get("limit", 100)
+                        )
+                        page = await query.fetch()
+                    except (ValueError, TypeError) as e:
+                        manager.send_to_dashboard(websocket, {
+                            "type": "error",
+                            "command": command_type,
+                            "message": str(e)
+                        })
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error getting device data: {e}")
+                        page = {"data": [], "next_cursor": None}
+                    manager.send_to_dashboard(websocket, {
                         "type": "device_data",
                         "device_id": device_id,
-                        "data": data
+                        "data": page["data"],
+                        "next_cursor": page["next_cursor"]
+                    })
+                
+                elif command_type == "get_device_window":
+                    device_id = command.get("device_id")
+                    try:
+                        field_list = parse_fields(command.get("fields", ["imu_x", "imu_y", "imu_z"]))
+                        size = max(1, int(command.get("size", 50)))
+                    except (ValueError, TypeError) as e:
+                        manager.send_to_dashboard(websocket, {
+                            "type": "error",
+                            "command": command_type,
+                            "message": str(e)
+                        })
+                        continue
+                    manager.send_to_dashboard(websocket, {
+                        "type": "device_window",
+                        "device_id": device_id,
+                        "data": await db.get_device_window(device_id, field_list or list(sensor_schema.SENSOR_FIELDS), size)
+                    })
+                
+                elif command_type in ("subscribe", "unsubscribe"):
+                    try:
+                        if command_type == "subscribe":
+                            subscription = manager.subscribe_dashboard(websocket, command)
+                        else:
+                            subscription = manager.unsubscribe_dashboard(websocket, command)
+                    except (ValueError, TypeError) as e:
+                        manager.send_to_dashboard(websocket, {
+                            "type": "error",
+                            "command": command_type,
+                            "message": str(e)
+                        })
+                        continue
+                    manager.send_to_dashboard(websocket, {
+                        "type": "subscriptions",
+                        "data": subscription
                     })
                 
+                elif command_type == "stream_mode":
+                    try:
+                        stream = manager.set_stream_mode(websocket, command)
+                    except (ValueError, TypeError) as e:
+                        manager.send_to_dashboard(websocket, {
+                            "type": "error",
+                            "command": command_type,
+                            "message": str(e)
+                        })
+                        continue
+                    manager.send_to_dashboard(websocket, {
+                        "type": "stream_mode",
+                        "data": stream
+                    })
+                
+                elif command_type == "resync":
+                    manager.resync_stream(websocket)
+                
                 elif command_type == "send_command_to_device":
                     # Forward command to specific ESP32
                     device_id = command.get("device_id")
                     device_command = command.get("command")
                     await manager.send_to_esp32(device_id, device_command)
-                
+            
             except json. JSONDecodeError as e: 
                 logger.error(f"Invalid JSON from dashboard: {e}")
-            
+    
     except WebSocketDisconnect:
         manager.disconnect_dashboard(websocket)
     except Exception as e:
@@ -299,6 +993,7 @@ async def api_info():
             "esp32": "/ws/esp32/{device_id}",
             "dashboard": "/ws/dashboard"
         },
+        "esp32_binary_frame": sensor_schema.describe_frame(),
         "dashboard":  "http://localhost:8000/"
     }
 
@@ -311,73 +1006,512 @@ async def get_status():
         "connections": {
             "esp32_devices": len(manager.esp32_connections),
             "dashboards": len(manager.dashboard_connections),
-            "connected_devices": list(manager.esp32_connections. keys())
+            "connected_devices": manager.connected_devices(),
+            "dashboard_queues": manager.dashboard_stats(),
+            "subscriptions": manager.subscriptions.describe()
         },
         "statistics": manager.stats,
+        "writer": {
+            **db.writer.stats,
+            "queue_depth": db.writer.queue.qsize()
+        },
+        "ingest_pipeline": pipeline.describe(),
+        "liveness": liveness.describe(),
+        "read_pool": db.readers.describe(),
+        "retention": db.retention.describe(),
+        "exports": db.exports.describe(),
+        "hot_cache": db.hot_cache.describe(),
+        "read_cache": read_cache.describe(),
+        "alerts": db.alerts.describe(),
+        "geo": db.geo.describe() if db.broker.is_writer else {"writer": False},
+        "activity": db.activity.describe() if db.broker.is_writer else {"writer": False},
+        "cluster": manager.cluster_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint (this worker's registry)"""
+    if not Config.METRICS_ENABLED:
+        return PlainTextResponse("Metrics disabled\n", status_code=404)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/profiler/start", tags=["default"])
+async def start_profiler(interval_ms: float = Query(Config.PROFILER_INTERVAL_MS, ge=1, le=1000),
+                         duration: float = Query(30, gt=0)):
+    """Start sampling this worker's event loop (stops by itself after duration seconds)"""
+    if not Config.PROFILER_ENABLED:
+        return {
+            "status": "error",
+            "message": "Profiler disabled (set PROFILER_ENABLED=true)"
+        }
+    try:
+        profiler.start(interval_ms, min(duration, Config.PROFILER_MAX_DURATION))
+    except RuntimeError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    return {
+        "status": "ok",
+        "worker": broker.worker_id,
+        "interval_ms": interval_ms,
+        "duration": min(duration, Config.PROFILER_MAX_DURATION)
+    }
+
+
+@app.post("/api/profiler/stop", tags=["default"])
+async def stop_profiler():
+    """Stop sampling and keep the results"""
+    profiler.stop()
+    return {
+        "status": "ok",
+        "samples": profiler.samples
+    }
+
+
+@app.get("/api/profiler", tags=["default"])
+async def get_profiler(format: str = "json", limit: int = Query(50, ge=1, le=1000)):
+    """Profiler results: top functions and stacks (json) or collapsed stacks for flamegraph tools"""
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    if format != "json":
+        return {
+            "status": "error",
+            "message": "format must be json or collapsed"
+        }
+    return {
+        "worker": broker.worker_id,
+        **profiler.describe(limit)
+    }
+
+
 @app.get("/api/devices", tags=["devices"])
 async def get_devices():
     """Get all registered devices"""
-    devices = await db.get_all_devices()
+    async def load():
+        devices = await db.get_all_devices()
+        return {
+            "devices": devices,
+            "count": len(devices)
+        }
+    return cached_json(await read_cache.get(("devices",), load))
+
+
+@app.get("/api/groups", tags=["devices"])
+async def get_groups():
+    """Get device groups (for dashboard subscriptions)"""
+    groups = await db.get_device_groups()
     return {
-        "devices": devices,
-        "count": len(devices)
+        "groups": groups,
+        "count": len(groups)
+    }
+
+
+@app.put("/api/groups/{name}", tags=["devices"])
+async def put_group(name: str, device_ids: List[str] = Body(...)):
+    """Create or replace a device group"""
+    device_ids = list(dict.fromkeys(device_ids))
+    await db.set_device_group(name, device_ids)
+    await manager.update_group(name, device_ids)
+    return {
+        "status": "success",
+        "group": name,
+        "devices": device_ids
+    }
+
+
+@app.delete("/api/groups/{name}", tags=["devices"])
+async def delete_group(name: str):
+    """Delete a device group (subscribers to it stop receiving its devices)"""
+    if not await db.delete_device_group(name):
+        return {
+            "status": "error",
+            "message": f"Group {name} not found"
+        }
+    await manager.update_group(name, None)
+    return {
+        "status": "success",
+        "group": name
     }
 
 
 @app.get("/api/devices/{device_id}/data", tags=["devices"])
-async def get_device_data(device_id: str, limit: int = 100):
-    """Get sensor data for specific device"""
-    data = await db.get_device_data(device_id, limit)
+async def get_device_data(
+    device_id: str,
+    limit: int = 100,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    fields: str = None,
+    cursor: str = None
+):
+    """
+    Get sensor data for specific device, newest first.
+    Page with next_cursor; limit is capped at HISTORY_MAX_PAGE and fields is
+    a comma-separated projection (e.g. fields=spo2,heart_rate).
+    """
+    try:
+        query = db.history(device_id, start, end, fields, cursor, limit)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    return StreamingResponse(query.json_chunks(), media_type="application/json")
+
+
+@app.get("/api/devices/{device_id}/window", tags=["devices"])
+async def get_device_window(device_id: str, fields: str = "imu_x,imu_y,imu_z", size: int = 50):
+    """Latest readings of a device as per-field columns, oldest first (chart window, from memory)"""
+    try:
+        field_list = parse_fields(fields) or list(sensor_schema.SENSOR_FIELDS)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    window = await db.get_device_window(device_id, field_list, max(1, size))
+    if window is None:
+        return {
+            "status": "error",
+            "message": f"No readings for device {device_id}"
+        }
+    return {
+        "device_id": device_id,
+        "size": len(window["timestamps"]),
+        **window
+    }
+
+
+@app.get("/api/devices/{device_id}/aggregates", tags=["devices"])
+async def get_device_aggregates(
+    device_id: str,
+    bucket: str = "1h",
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to")
+):
+    """Get count/sum/min/max/avg per sensor field in 1m, 1h or 1d buckets"""
+    if bucket not in rollups.BUCKETS:
+        return {
+            "status": "error",
+            "message": f"bucket must be one of {', '.join(rollups.BUCKETS)}"
+        }
+    try:
+        start = parse_time(start, "from")
+        end = parse_time(end, "to", end=True)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    data = await db.get_aggregates(device_id, bucket, start, end)
     return {
         "device_id": device_id,
+        "bucket": bucket,
         "data": data,
         "count": len(data)
     }
 
 
+@app.post("/api/admin/rollups/rebuild", tags=["testing"])
+async def rebuild_rollups(device_id: str = None):
+    """Regenerate rollups from raw sensor data"""
+    await db.rebuild_rollups(device_id)
+    return {
+        "status": "ok",
+        "device_id": device_id
+    }
+
+
 @app.get("/api/data/recent", tags=["data"])
 async def get_recent_data(limit: int = 100):
     """Get recent sensor data from all devices"""
-    data = await db.get_recent_data(limit)
-    return {
-        "data": data,
-        "count": len(data)
-    }
+    async def load():
+        data = await db.get_recent_data(limit)
+        return {
+            "data": data,
+            "count": len(data)
+        }
+    return cached_json(await read_cache.get(("recent", limit), load))
+
+
+@app.get("/api/export", tags=["data"])
+async def export_data(
+    devices: str = None,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    fields: str = None,
+    format: str = "csv",
+    gzip: bool = False
+):
+    """
+    Stream sensor history as CSV or NDJSON (gzip=true to compress).
+    devices and fields are comma-separated; default is every device and field.
+    Values are scaled to display units (SENSOR_CONFIG scale).
+    """
+    try:
+        device_ids = [device.strip() for device in devices.split(",") if device.strip()] if devices else None
+        request = ExportRequest(device_ids, start, end, fields, format, gzip)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    filename = request.filename(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    return StreamingResponse(
+        db.exports.stream(request),
+        media_type=request.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @app.get("/api/statistics", tags=["data"])
 async def get_statistics():
     """Get system statistics"""
-    stats = await db.get_statistics()
-    return stats
+    return cached_json(await read_cache.get(("statistics",), db.get_statistics))
+
+
+@app.get("/api/alerts", tags=["data"])
+async def get_alerts(
+    device_id: str = None,
+    field: str = None,
+    kind: str = None,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    limit: int = 100
+):
+    """Alerts raised by server-side detection, newest first"""
+    if field is not None and field not in sensor_schema.SENSORS_BY_FIELD:
+        return {
+            "status": "error",
+            "message": f"Unknown field: {field}"
+        }
+    if kind is not None and kind not in alerts.KINDS:
+        return {
+            "status": "error",
+            "message": f"kind must be one of {', '.join(alerts.KINDS)}"
+        }
+    try:
+        start = parse_time(start, "from")
+        end = parse_time(end, "to", end=True)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    found = await db.get_alerts(device_id, field, kind, start, end, max(1, min(limit, Config.HISTORY_MAX_PAGE)))
+    return {
+        "alerts": found,
+        "count": len(found)
+    }
+
+
+@app.get("/api/activity", tags=["data"])
+async def get_activity(
+    device_id: str = None,
+    activity_kind: str = Query(None, alias="activity"),
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    limit: int = 100
+):
+    """IMU activity windows (features and class per device per window), newest first"""
+    if activity_kind is not None and activity_kind not in activity.ACTIVITIES:
+        return {
+            "status": "error",
+            "message": f"activity must be one of {', '.join(activity.ACTIVITIES)}"
+        }
+    try:
+        start = parse_time(start, "from")
+        end = parse_time(end, "to", end=True)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    windows = await db.get_activity(device_id, activity_kind, start, end, max(1, min(limit, Config.HISTORY_MAX_PAGE)))
+    return {
+        "windows": windows,
+        "count": len(windows),
+        "window_seconds": Config.ACTIVITY_WINDOW
+    }
+
+
+@app.get("/api/activity/summary", tags=["data"])
+async def get_activity_summary(
+    device_id: str = None,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to")
+):
+    """Per device: windows spent resting/grazing/walking, steps and mean SMA"""
+    try:
+        start = parse_time(start, "from")
+        end = parse_time(end, "to", end=True)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    devices = await db.get_activity_summary(device_id, start, end)
+    return {
+        "devices": devices,
+        "count": len(devices),
+        "window_seconds": Config.ACTIVITY_WINDOW,
+        "hop_seconds": Config.ACTIVITY_HOP
+    }
+
+
+@app.get("/api/geo/devices", tags=["geo"])
+async def get_devices_in_box(min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+    """Devices whose latest GPS fix is inside a bounding box (degrees)"""
+    if min_lat > max_lat or min_lon > max_lon:
+        return {
+            "status": "error",
+            "message": "min_lat/min_lon must not exceed max_lat/max_lon"
+        }
+    devices = await db.get_devices_in_box(min_lat, min_lon, max_lat, max_lon)
+    return {
+        "devices": devices[:Config.GEO_MAX_POINTS],
+        "count": len(devices)
+    }
+
+
+@app.get("/api/geo/devices/near", tags=["geo"])
+async def get_devices_near(lat: float, lon: float, radius_m: float, limit: int = 100):
+    """Devices whose latest GPS fix is within radius_m meters, nearest first"""
+    if not 0 < radius_m <= Config.GEO_MAX_RADIUS_M:
+        return {
+            "status": "error",
+            "message": f"radius_m must be in (0, {Config.GEO_MAX_RADIUS_M:g}]"
+        }
+    devices = await db.get_devices_near(lat, lon, radius_m, max(1, min(limit, Config.GEO_MAX_POINTS)))
+    return {
+        "devices": devices,
+        "count": len(devices)
+    }
+
+
+@app.get("/api/geo/tracks", tags=["geo"])
+async def get_tracks(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    device_id: str = None,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    limit: int = 1000
+):
+    """Historical GPS points inside a bounding box, optionally for one device and a time range"""
+    try:
+        start = parse_time(start, "from")
+        end = parse_time(end, "to", end=True)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    return await db.get_tracks(
+        min_lat, min_lon, max_lat, max_lon, start, end, device_id, max(1, min(limit, Config.GEO_MAX_POINTS))
+    )
+
+
+@app.get("/api/geo/geofences", tags=["geo"])
+async def get_geofences():
+    """Registered geofences with how many devices are inside each"""
+    fences = await db.get_geofences()
+    return {
+        "geofences": fences,
+        "count": len(fences)
+    }
+
+
+@app.get("/api/geo/geofences/{name}", tags=["geo"])
+async def get_geofence(name: str):
+    """A geofence and the devices inside and outside it (by latest position)"""
+    fence = await db.get_geofence_members(name)
+    if fence is None:
+        return {
+            "status": "error",
+            "message": f"Geofence {name} not found"
+        }
+    return fence
+
+
+@app.put("/api/geo/geofences/{name}", tags=["geo"])
+async def put_geofence(name: str, polygon: list = Body(...)):
+    """Create or replace a polygon geofence: [[latitude, longitude], ...] in degrees"""
+    try:
+        polygon = geo.validate_polygon(polygon, Config.GEOFENCE_MAX_VERTICES)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    fence = await db.set_geofence(name, polygon)
+    return {
+        "status": "success",
+        "geofence": fence
+    }
+
+
+@app.delete("/api/geo/geofences/{name}", tags=["geo"])
+async def delete_geofence(name: str):
+    """Delete a geofence"""
+    if not await db.delete_geofence(name):
+        return {
+            "status": "error",
+            "message": f"Geofence {name} not found"
+        }
+    return {
+        "status": "success",
+        "geofence": name
+    }
 
 
 @app.post("/api/data", tags=["data"])
-async def post_sensor_data(data: dict):
+async def post_sensor_data(data: dict, wait: bool = True):
     """
     HTTP POST endpoint (fallback for devices that can't use WebSocket)
+    With wait=true (default) the response is sent after the data is committed,
+    and a reading at a timestamp the device already has is reported as an error.
     """
     try:
-        device_id = data.get('device_id')
-        data['timestamp'] = datetime.now().isoformat()
-        
+        # Validated like the batch endpoints, stamped with the server time
+        reading = ingest.validate_reading({**data, "timestamp": None}, datetime.now())
+    except ingest.ValidationError as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    try:
         # Save to database
-        await db. save_sensor_data(data)
+        if await db.save_sensor_data(reading, wait=wait) is False:
+            return {
+                "status": "error",
+                "message": "Duplicate timestamp, reading not saved",
+                "device_id": reading['device_id']
+            }
+        HTTP_READINGS.inc()
         
         # Broadcast to dashboards
         await manager.broadcast_to_dashboards({
             "type": "sensor_data",
-            "data": data
+            "data": reading
         })
         
         return {
             "status": "ok",
             "message": "Data received",
-            "device_id": device_id
+            "device_id": reading['device_id']
         }
     except Exception as e:
         logger.error(f"Error saving data: {e}")
@@ -387,6 +1521,145 @@ async def post_sensor_data(data: dict):
         }
 
 
+@app.post("/api/data/batch", tags=["data"])
+async def post_sensor_batch(records: list = Body(...), wait: bool = True):
+    """
+    Upload many readings at once (JSON array).
+    Device timestamps are kept if they fall inside the clock-skew window;
+    invalid records are rejected individually. With wait=true, readings
+    repeating a stored (device, timestamp) are counted as duplicates.
+    """
+    if len(records) > Config.INGEST_MAX_BATCH:
+        return {
+            "status": "error",
+            "message": f"Batch larger than {Config.INGEST_MAX_BATCH} records"
+        }
+    
+    now = datetime.now()
+    readings = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            readings.append(ingest.validate_reading(record, now))
+        except ingest.ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+    
+    duplicates = 0
+    try:
+        if readings:
+            stored = await db.save_sensor_batch(readings, wait=wait)
+            if stored is not None:
+                duplicates = len(readings) - stored
+            HTTP_READINGS.inc(len(readings))
+            await manager.publish_batch(readings)
+            manager.stats["total_messages"] += len(readings)
+    except Exception as e:
+        logger.error(f"Error saving batch: {e}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    return {
+        "status": "ok",
+        "accepted": len(readings) - duplicates,
+        "duplicates": duplicates,
+        "rejected": len(errors),
+        "errors": errors[:Config.INGEST_MAX_ERRORS]
+    }
+
+
+@app.post("/api/data/stream", tags=["data"])
+async def post_sensor_stream(request: Request, wait: bool = True):
+    """
+    Upload readings as NDJSON (one JSON object per line).
+    The body is read incrementally and written in WRITE_BATCH_SIZE chunks.
+    A line over INGEST_MAX_LINE_BYTES is rejected and skipped up to its
+    newline; only the first INGEST_MAX_ERRORS errors are listed.
+    """
+    accepted = 0
+    duplicates = 0
+    rejected = 0
+    errors = []
+    chunk = []
+    buffer = b""
+    line_number = 0
+    skipping = False  # inside an oversized line, dropping bytes until its newline
+    
+    async def flush():
+        nonlocal chunk, accepted, duplicates
+        if chunk:
+            stored = await db.save_sensor_batch(chunk, wait=wait)
+            HTTP_READINGS.inc(len(chunk))
+            await manager.publish_batch(chunk)
+            manager.stats["total_messages"] += len(chunk)
+            stored = len(chunk) if stored is None else stored
+            accepted += stored
+            duplicates += len(chunk) - stored
+            chunk = []
+    
+    def reject(error: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < Config.INGEST_MAX_ERRORS:
+            errors.append({"line": line_number, "error": error})
+    
+    def handle_line(line: bytes):
+        nonlocal line_number
+        line_number += 1
+        if len(line) > Config.INGEST_MAX_LINE_BYTES:
+            reject("Line too long")
+            return
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            chunk.append(ingest.validate_reading(record, datetime.now()))
+        except json.JSONDecodeError:
+            reject("Invalid JSON")
+        except ingest.ValidationError as e:
+            reject(str(e))
+    
+    try:
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if skipping:
+                    # Rest of the oversized line, already counted
+                    skipping = False
+                    continue
+                handle_line(line)
+            if not skipping and len(buffer) > Config.INGEST_MAX_LINE_BYTES:
+                line_number += 1
+                reject("Line too long")
+                skipping = True
+            if skipping:
+                buffer = b""
+            if len(chunk) >= Config.WRITE_BATCH_SIZE:
+                await flush()
+        
+        if buffer:
+            handle_line(buffer)
+        await flush()
+    except Exception as e:
+        logger.error(f"Error saving stream: {e}")
+        return {
+            "status": "error",
+            "message": str(e),
+            "accepted": accepted
+        }
+    
+    return {
+        "status": "ok",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "errors": errors
+    }
+
+
 @app.get("/api/test/generate", tags=["testing"])
 async def generate_test_data():
     """Generate dummy sensor data for testing"""
@@ -453,6 +1726,10 @@ async def startup_event():
     """Initialize on startup"""
     logger.info("🚀 FarmTech Server starting...")
     await db.initialize()
+    manager.subscriptions.load_groups(await db.get_device_groups())
+    manager.start()
+    pipeline.start()
+    liveness.start()
     logger.info("✅ Database initialized")
     logger.info("🌐 WebSocket server ready")
 
@@ -461,6 +1738,10 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("🛑 FarmTech Server shutting down...")
+    manager.stop()
+    pipeline.stop()
+    liveness.stop()
+    profiler.stop()
     await db.close()
     logger.info("✅ Cleanup completed")
 
@@ -475,5 +1756,7 @@ if __name__ == "__main__":
         host=Config.HOST,
         port=Config.PORT,
         reload=False,
-        log_level="info"
+        workers=Config.WORKERS,
+        log_level="info",
+        ws_per_message_deflate=Config.WS_PER_MESSAGE_DEFLATE
     )
\ No newline at end of file
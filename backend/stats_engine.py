@@ -0,0 +1,210 @@
+"""
+Constant-time ingest statistics
+Running totals, per-day counters and a one-hour sliding window of
+per-minute counters, updated by the batch writer. Snapshots are saved to
+the statistics_state table periodically and on clean shutdown. Every write
+that adds or purges readings also adds its per-day counts to
+statistics_journal in the same transaction, and a snapshot empties the
+journal, so after a crash the last snapshot plus the journal is exact.
+Without a usable snapshot (first start, after a bulk import) the counters
+are rebuilt from the rollup tables less the readings purged by retention.
+"""
+
+import json
+import logging
+from array import array
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+WINDOW_MINUTES = 60
+STATE_VERSION = 2
+
+
+def epoch_minute(timestamp: str) -> int:
+    """Minutes since the epoch for an ISO-8601 timestamp (local time)"""
+    return int(datetime.fromisoformat(timestamp[:16]).timestamp()) // 60
+
+
+def count_days(timestamps: Iterable[str]) -> Dict[str, int]:
+    """Readings per day for ISO-8601 timestamps"""
+    return dict(Counter(timestamp[:10] for timestamp in timestamps))
+
+
+class StatisticsEngine:
+    """In-memory counters behind Database.get_statistics()"""
+    
+    def __init__(self):
+        self.total_records = 0
+        self.per_day: Dict[str, int] = {}
+        
+        # Ring of per-minute counters: slot = minute % WINDOW_MINUTES
+        self.minute_ids = array('q', [-1] * WINDOW_MINUTES)
+        self.minute_counts = array('q', [0] * WINDOW_MINUTES)
+    
+    def record(self, timestamps: Iterable[str]):
+        """Count newly committed readings by their timestamps"""
+        now_minute = int(datetime.now().timestamp()) // 60
+        oldest = now_minute - WINDOW_MINUTES + 1
+        
+        for timestamp in timestamps:
+            self.total_records += 1
+            day = timestamp[:10]
+            self.per_day[day] = self.per_day.get(day, 0) + 1
+            
+            minute = epoch_minute(timestamp)
+            if minute < oldest:
+                continue
+            slot = minute % WINDOW_MINUTES
+            if self.minute_ids[slot] != minute:
+                if self.minute_ids[slot] > minute:
+                    continue
+                self.minute_ids[slot] = minute
+                self.minute_counts[slot] = 0
+            self.minute_counts[slot] += 1
+    
+    def remove(self, per_day: Dict[str, int]):
+        """Account for deleted readings, given as counts per day"""
+        self._add({day: -count for day, count in per_day.items()})
+    
+    def _add(self, per_day: Dict[str, int]):
+        """Apply signed per-day count changes to the totals"""
+        for day, count in per_day.items():
+            self.total_records += count
+            remaining = self.per_day.get(day, 0) + count
+            if remaining > 0:
+                self.per_day[day] = remaining
+            else:
+                self.per_day.pop(day, None)
+    
+    def records_last_hour(self) -> int:
+        """Readings whose timestamp falls in the last 60 minutes"""
+        oldest = int(datetime.now().timestamp()) // 60 - WINDOW_MINUTES + 1
+        return sum(
+            count for minute, count in zip(self.minute_ids, self.minute_counts) if minute >= oldest
+        )
+    
+    def snapshot(self, total_devices: int) -> Dict:
+        """Statistics in the /api/statistics format"""
+        return {
+            "total_records": self.total_records,
+            "total_devices": total_devices,
+            "records_today": self.per_day.get(datetime.now().date().isoformat(), 0),
+            "records_last_hour": self.records_last_hour(),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    async def create_tables(self, db):
+        """Create the persisted state table"""
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS statistics_state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS statistics_journal (
+                day TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+    
+    async def journal(self, db, per_day: Dict[str, int]):
+        """Log signed per-day count changes in the caller's write transaction"""
+        await db.executemany("""
+            INSERT INTO statistics_journal (day, count) VALUES (?, ?)
+            ON CONFLICT(day) DO UPDATE SET count = count + excluded.count
+        """, list(per_day.items()))
+    
+    async def seed(self, db):
+        """
+        Load counters at startup: the last snapshot plus the journal written
+        since, or, without a usable snapshot, a rebuild from the rollup tables
+        """
+        cursor = await db.execute("SELECT value FROM statistics_state WHERE name = 'engine'")
+        row = await cursor.fetchone()
+        state = json.loads(row[0]) if row else None
+        
+        # Version 1 snapshots carry no journal and are only exact when saved on shutdown
+        if state and (state.get("version") == STATE_VERSION or state.get("clean")):
+            self.total_records = state["total_records"]
+            self.per_day = state["per_day"]
+            cursor = await db.execute("SELECT day, count FROM statistics_journal")
+            journaled = {day: count for day, count in await cursor.fetchall()}
+            self._add(journaled)
+            if state.get("clean"):
+                self.minute_ids = array('q', state["minute_ids"])
+                self.minute_counts = array('q', state["minute_counts"])
+            else:
+                await self._seed_window(db)
+            logger.info(
+                f"Statistics loaded from snapshot: {self.total_records} records "
+                f"({sum(journaled.values())} journaled since)"
+            )
+        else:
+            cursor = await db.execute("""
+                SELECT substr(bucket_start, 1, 10) AS day, SUM(count) AS count
+                FROM rollup_1d GROUP BY day
+            """)
+            self.per_day = {row[0]: row[1] for row in await cursor.fetchall()}
+            
+            # Rollups outlive the raw readings purged to the archive
+            cursor = await db.execute("SELECT day, purged FROM retention_log")
+            for day, purged in await cursor.fetchall():
+                remaining = self.per_day.get(day, 0) - purged
+                if remaining > 0:
+                    self.per_day[day] = remaining
+                else:
+                    self.per_day.pop(day, None)
+            self.total_records = sum(self.per_day.values())
+            await self._seed_window(db)
+            logger.info(f"Statistics seeded from rollups: {self.total_records} records")
+        
+        # New baseline: the journal restarts from here
+        await self.persist(db)
+    
+    async def _seed_window(self, db):
+        """Rebuild the last-hour ring from the per-minute rollups"""
+        self.minute_ids = array('q', [-1] * WINDOW_MINUTES)
+        self.minute_counts = array('q', [0] * WINDOW_MINUTES)
+        oldest = int(datetime.now().timestamp()) // 60 - WINDOW_MINUTES + 1
+        since = datetime.fromtimestamp(oldest * 60).isoformat()
+        cursor = await db.execute("""
+            SELECT bucket_start, SUM(count) FROM rollup_1m
+            WHERE bucket_start >= ? GROUP BY bucket_start
+        """, (since,))
+        for bucket_start, count in await cursor.fetchall():
+            minute = epoch_minute(bucket_start)
+            slot = minute % WINDOW_MINUTES
+            if minute > self.minute_ids[slot]:
+                self.minute_ids[slot] = minute
+                self.minute_counts[slot] = count
+    
+    async def persist(self, db, clean: bool = False):
+        """
+        Save counters and empty the journal (caller holds the write lock and
+        commits). clean marks a snapshot taken on shutdown, whose last-hour
+        window is kept as well.
+        """
+        state = {
+            "version": STATE_VERSION,
+            "clean": clean,
+            "total_records": self.total_records,
+            "per_day": self.per_day,
+            "minute_ids": list(self.minute_ids),
+            "minute_counts": list(self.minute_counts)
+        }
+        await db.execute("""
+            INSERT INTO statistics_state (name, value, updated_at)
+            VALUES ('engine', ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """, (json.dumps(state),))
+        await db.execute("DELETE FROM statistics_journal")
+    
+    async def invalidate(self, db):
+        """Drop the snapshot so the next start rebuilds from the rollups (caller commits)"""
+        await db.execute("DELETE FROM statistics_state WHERE name = 'engine'")
+        await db.execute("DELETE FROM statistics_journal")
@@ -0,0 +1,320 @@
+"""
+Storage layouts for sensor readings
+Selected with Config.STORAGE_LAYOUT:
+
+legacy  - sensor_data: AUTOINCREMENT id, TEXT device_id, ISO-8601 TEXT
+          timestamp, created_at, two secondary indexes
+compact - sensor_readings: device interned to devices.id, epoch milliseconds,
+          clustered on (device_key, ts) WITHOUT ROWID, one index on ts
+
+Both layouts return rows with the same column names (device_id, timestamp
+as ISO-8601 text, sensor fields), so callers only build WHERE/ORDER
+clauses from device_column/time_column and convert bounds with
+device_arg()/time_arg(). key_columns/cursor_key() give a unique sort key
+per device for keyset pagination.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sensor_schema import SENSOR_FIELDS
+
+FIELD_LIST = ", ".join(SENSOR_FIELDS)
+
+
+def to_epoch_ms(timestamp: str) -> int:
+    """ISO-8601 timestamp (naive = local time) -> epoch milliseconds"""
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+
+def from_epoch_ms(value: int) -> str:
+    """Epoch milliseconds -> naive local ISO-8601 timestamp"""
+    return datetime.fromtimestamp(value / 1000).isoformat()
+
+
+def to_epoch_us(timestamp: str) -> int:
+    """ISO-8601 timestamp (naive = local time) -> epoch microseconds, exactly"""
+    moment = datetime.fromisoformat(timestamp)
+    return int(moment.replace(microsecond=0).timestamp()) * 1_000_000 + moment.microsecond
+
+
+def from_epoch_us(value: int, timespec: str = "auto") -> str:
+    """Epoch microseconds -> naive local ISO-8601 timestamp"""
+    seconds, micros = divmod(value, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat(timespec=timespec)
+
+
+class LegacyStorage:
+    """Original sensor_data table"""
+    
+    name = "legacy"
+    table = "sensor_data"
+    device_column = "device_id"
+    time_column = "timestamp"
+    
+    # isoformat() timespec of the timestamp text rows carry
+    timespec = "auto"
+    
+    # id breaks timestamp ties; the (device_id, timestamp) index carries it as rowid
+    key_columns = ("timestamp", "id")
+    
+    # Rows shaped (device_id, timestamp, *SENSOR_FIELDS) for rollup rebuilds
+    source = "sensor_data"
+    
+    insert_sql = f"""
+        INSERT INTO sensor_data (device_id, timestamp, {FIELD_LIST})
+        VALUES ({', '.join('?' * (len(SENSOR_FIELDS) + 2))})
+    """
+    
+    async def create_tables(self, db):
+        """Create sensor_data and its indexes"""
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS sensor_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                imu_x INTEGER,
+                imu_y INTEGER,
+                imu_z INTEGER,
+                suhu_kaki INTEGER,
+                vbatt_kaki INTEGER,
+                suhu_leher INTEGER,
+                vbatt_leher INTEGER,
+                latitude INTEGER,
+                longitude INTEGER,
+                spo2 INTEGER,
+                heart_rate INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sensor_device_timestamp
+            ON sensor_data(device_id, timestamp DESC)
+        """)
+        
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sensor_timestamp
+            ON sensor_data(timestamp DESC)
+        """)
+    
+    def insert_params(self, rows: List[tuple], device_keys: Dict[str, int]) -> List[tuple]:
+        """Rows (device_id, timestamp, *fields) -> INSERT parameters"""
+        return rows
+    
+    def select(self, clauses: str = "", fields: Optional[List[str]] = None) -> str:
+        """SELECT returning API-shaped rows; clauses = WHERE/ORDER BY/LIMIT"""
+        if fields is None:
+            return f"SELECT * FROM sensor_data {clauses}"
+        return f"SELECT {', '.join(['id', 'device_id', 'timestamp'] + fields)} FROM sensor_data {clauses}"
+    
+    def row_key(self, row) -> int:
+        return row["id"]
+    
+    def key_from(self, timestamp: str, row_key: int) -> list:
+        return [timestamp, row_key]
+    
+    def cursor_key(self, row) -> list:
+        return self.key_from(row["timestamp"], self.row_key(row))
+    
+    async def insert(self, db, params: List[tuple]) -> Tuple[List[int], List[int]]:
+        """
+        Insert rows (caller commits); returns the positions in params that were
+        stored and their row keys. sensor_data stores every row.
+        """
+        await db.executemany(self.insert_sql, params)
+        
+        # Single writer, AUTOINCREMENT: the ids just handed out are consecutive
+        cursor = await db.execute("SELECT last_insert_rowid()")
+        last = (await cursor.fetchone())[0]
+        return list(range(len(params))), list(range(last - len(params) + 1, last + 1))
+    
+    def stored_timestamp(self, timestamp: str) -> str:
+        """Timestamp text as select() will return it"""
+        return timestamp
+    
+    # (device, device_id, day) groups holding rows before a cutoff, oldest day first
+    expired_days_sql = """
+        SELECT device_id AS device, device_id, substr(timestamp, 1, 10) AS day
+        FROM sensor_data
+        WHERE timestamp < ?
+        GROUP BY device_id, day
+        ORDER BY day, device_id
+    """
+    
+    # One device's rows in [start, end), with the key columns delete_params() needs
+    expired_day_sql = """
+        SELECT * FROM sensor_data
+        WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp, id
+    """
+    
+    delete_sql = "DELETE FROM sensor_data WHERE id = ?"
+    
+    def delete_params(self, rows: List[dict]) -> List[tuple]:
+        return [(row["id"],) for row in rows]
+    
+    def device_arg(self, device_id: str, device_key: int):
+        return device_id
+    
+    def time_arg(self, timestamp: str):
+        return timestamp
+
+
+class CompactStorage:
+    """Clustered sensor_readings table keyed on (device_key, ts)"""
+    
+    name = "compact"
+    table = "sensor_readings"
+    device_column = "r.device_key"
+    time_column = "r.ts"
+    timespec = "milliseconds"
+    
+    # (device_key, ts) is the primary key, so ts alone is unique per device
+    key_columns = ("r.ts",)
+    
+    # Epoch ms -> local ISO-8601 with millisecond precision
+    TIMESTAMP_SQL = "strftime('%Y-%m-%dT%H:%M:%f', r.ts / 1000.0, 'unixepoch', 'localtime')"
+    
+    SELECT_SQL = f"""
+        SELECT d.device_id AS device_id, {TIMESTAMP_SQL} AS timestamp, {', '.join('r.' + f for f in SENSOR_FIELDS)}
+        FROM sensor_readings r JOIN devices d ON d.id = r.device_key
+    """
+    
+    source = f"({SELECT_SQL})"
+    
+    insert_sql = f"""
+        INSERT OR IGNORE INTO sensor_readings (device_key, ts, {FIELD_LIST})
+        VALUES ({', '.join('?' * (len(SENSOR_FIELDS) + 2))})
+    """
+    
+    async def create_tables(self, db):
+        """Create sensor_readings and its single secondary index"""
+        columns = ",\n".join(f"{field} INTEGER" for field in SENSOR_FIELDS)
+        await db.execute(f"""
+            CREATE TABLE IF NOT EXISTS sensor_readings (
+                device_key INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                {columns},
+                PRIMARY KEY (device_key, ts)
+            ) WITHOUT ROWID
+        """)
+        
+        # Cross-device "latest N" and retention; entries carry only (ts, device_key)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_readings_ts
+            ON sensor_readings(ts)
+        """)
+    
+    def insert_params(self, rows: List[tuple], device_keys: Dict[str, int]) -> List[tuple]:
+        """Rows (device_id, timestamp, *fields) -> (device_key, ts, *fields)"""
+        return [(device_keys[row[0]], to_epoch_ms(row[1])) + tuple(row[2:]) for row in rows]
+    
+    def select(self, clauses: str = "", fields: Optional[List[str]] = None) -> str:
+        """SELECT returning API-shaped rows; clauses = WHERE/ORDER BY/LIMIT"""
+        if fields is None:
+            return f"{self.SELECT_SQL} {clauses}"
+        return f"""
+            SELECT d.device_id AS device_id, {self.TIMESTAMP_SQL} AS timestamp{''.join(', r.' + f for f in fields)}
+            FROM sensor_readings r JOIN devices d ON d.id = r.device_key
+            {clauses}
+        """
+    
+    def row_key(self, row) -> int:
+        return to_epoch_ms(row["timestamp"])
+    
+    def key_from(self, timestamp: str, row_key: int) -> list:
+        return [row_key]
+    
+    def cursor_key(self, row) -> list:
+        return self.key_from(row["timestamp"], self.row_key(row))
+    
+    async def insert(self, db, params: List[tuple]) -> Tuple[List[int], List[int]]:
+        """
+        Insert rows (caller commits); returns the positions in params that were
+        stored and their row keys. A reading whose (device_key, ts) is already
+        taken, by a stored row or an earlier one in params, is not stored.
+        """
+        # Left open: the caller's COMMIT or ROLLBACK ends it
+        await db.execute("SAVEPOINT insert_readings")
+        cursor = await db.executemany(self.insert_sql, params)
+        if cursor.rowcount == len(params):
+            return list(range(len(params))), [param[1] for param in params]
+        
+        # Some keys were taken: insert again with only the readings that are new
+        await db.execute("ROLLBACK TO insert_readings")
+        taken = await self._stored_keys(db, params)
+        stored = []
+        for index, param in enumerate(params):
+            key = param[:2]
+            if key not in taken:
+                taken.add(key)
+                stored.append(index)
+        await db.executemany(self.insert_sql, [params[index] for index in stored])
+        return stored, [params[index][1] for index in stored]
+    
+    async def _stored_keys(self, db, params: List[tuple]) -> Set[tuple]:
+        """(device_key, ts) of params already in sensor_readings"""
+        by_device: Dict[int, Set[int]] = {}
+        for param in params:
+            by_device.setdefault(param[0], set()).add(param[1])
+        
+        taken = set()
+        for device_key, stamps in by_device.items():
+            stamps = list(stamps)
+            for start in range(0, len(stamps), 500):
+                chunk = stamps[start:start + 500]
+                cursor = await db.execute(
+                    f"SELECT ts FROM sensor_readings WHERE device_key = ? AND ts IN ({', '.join('?' * len(chunk))})",
+                    [device_key] + chunk
+                )
+                taken.update((device_key, row[0]) for row in await cursor.fetchall())
+        return taken
+    
+    def stored_timestamp(self, timestamp: str) -> str:
+        """Timestamp text as select() will return it (millisecond precision)"""
+        moment = datetime.fromtimestamp(to_epoch_ms(timestamp) / 1000)
+        return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}"
+    
+    # (device, device_id, day) groups holding rows before a cutoff, oldest day first
+    expired_days_sql = """
+        SELECT r.device_key AS device, d.device_id AS device_id,
+               date(r.ts / 1000, 'unixepoch', 'localtime') AS day
+        FROM sensor_readings r JOIN devices d ON d.id = r.device_key
+        WHERE r.ts < ?
+        GROUP BY r.device_key, day
+        ORDER BY day, d.device_id
+    """
+    
+    # One device's rows in [start, end), with the key columns delete_params() needs
+    expired_day_sql = f"""
+        SELECT r.device_key AS device_key, r.ts AS ts,
+               d.device_id AS device_id, {TIMESTAMP_SQL} AS timestamp, {', '.join('r.' + f for f in SENSOR_FIELDS)}
+        FROM sensor_readings r JOIN devices d ON d.id = r.device_key
+        WHERE r.device_key = ? AND r.ts >= ? AND r.ts < ?
+        ORDER BY r.ts
+    """
+    
+    delete_sql = "DELETE FROM sensor_readings WHERE device_key = ? AND ts = ?"
+    
+    def delete_params(self, rows: List[dict]) -> List[tuple]:
+        return [(row["device_key"], row["ts"]) for row in rows]
+    
+    def device_arg(self, device_id: str, device_key: int):
+        return device_key
+    
+    def time_arg(self, timestamp: str):
+        return to_epoch_ms(timestamp)
+
+
+LAYOUTS = {
+    "legacy": LegacyStorage,
+    "compact": CompactStorage
+}
+
+
+def get_storage(name: str):
+    """Storage layout instance by name"""
+    if name not in LAYOUTS:
+        raise ValueError(f"Unknown storage layout: {name} (expected {', '.join(LAYOUTS)})")
+    return LAYOUTS[name]()
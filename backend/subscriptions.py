@@ -0,0 +1,197 @@
+"""
+Dashboard subscriptions for sensor_data fan-out
+A dashboard subscribes to device ids and/or device groups, and narrows
+the fields it receives by category (SENSOR_CATEGORIES in sensor-config.js)
+or by field name. The index maps device -> subscribers and group ->
+subscribers, so routing a reading touches only the dashboards that want it.
+Dashboards that never subscribe receive everything, as before.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from sensor_schema import SENSOR_CONFIG, SENSOR_FIELDS
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_FIELDS: Dict[str, List[str]] = {"all": list(SENSOR_FIELDS)}
+for _sensor in SENSOR_CONFIG:
+    CATEGORY_FIELDS.setdefault(_sensor["category"], []).append(_sensor["field"])
+
+
+def resolve_fields(categories: Iterable[str] = (), fields: Iterable[str] = ()) -> Optional[frozenset]:
+    """Categories and field names -> projection set (None = every field)"""
+    categories = list(categories or [])
+    fields = list(fields or [])
+    unknown = [category for category in categories if category not in CATEGORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown categories: {', '.join(unknown)}")
+    unknown = [field for field in fields if field not in SENSOR_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if "all" in categories or (not categories and not fields):
+        return None
+    selected = set(fields)
+    for category in categories:
+        selected.update(CATEGORY_FIELDS[category])
+    return frozenset(selected)
+
+
+class Subscription:
+    """What one dashboard wants"""
+    
+    def __init__(self):
+        self.everything = True
+        self.devices: Set[str] = set()
+        self.groups: Set[str] = set()
+        self.fields: Optional[frozenset] = None
+    
+    def describe(self) -> dict:
+        return {
+            "everything": self.everything,
+            "devices": sorted(self.devices),
+            "groups": sorted(self.groups),
+            "fields": sorted(self.fields) if self.fields is not None else None
+        }
+
+
+class SubscriptionIndex:
+    """Reverse index from devices and groups to subscribed connections"""
+    
+    def __init__(self):
+        self.subscriptions: Dict[object, Subscription] = {}
+        self.everything: Set[object] = set()
+        self.by_device: Dict[str, Set[object]] = {}
+        self.by_group: Dict[str, Set[object]] = {}
+        
+        # Group membership: group -> devices and device -> groups
+        self.group_devices: Dict[str, Set[str]] = {}
+        self.device_groups: Dict[str, Set[str]] = {}
+    
+    # ------------------------------------------------------------
+    # Groups
+    # ------------------------------------------------------------
+    
+    def set_group(self, name: str, device_ids: Iterable[str]):
+        self.remove_group(name)
+        members = set(device_ids)
+        self.group_devices[name] = members
+        for device_id in members:
+            self.device_groups.setdefault(device_id, set()).add(name)
+    
+    def remove_group(self, name: str):
+        for device_id in self.group_devices.pop(name, ()):
+            groups = self.device_groups.get(device_id)
+            if groups:
+                groups.discard(name)
+                if not groups:
+                    del self.device_groups[device_id]
+    
+    def load_groups(self, groups: Dict[str, List[str]]):
+        self.group_devices = {}
+        self.device_groups = {}
+        for name, device_ids in groups.items():
+            self.set_group(name, device_ids)
+    
+    # ------------------------------------------------------------
+    # Connections
+    # ------------------------------------------------------------
+    
+    def add(self, connection):
+        """New dashboard: subscribed to everything"""
+        self.subscriptions[connection] = Subscription()
+        self.everything.add(connection)
+    
+    def remove(self, connection):
+        subscription = self.subscriptions.pop(connection, None)
+        if subscription is None:
+            return
+        self.everything.discard(connection)
+        for device_id in subscription.devices:
+            self._unindex(self.by_device, device_id, connection)
+        for group in subscription.groups:
+            self._unindex(self.by_group, group, connection)
+    
+    @staticmethod
+    def _unindex(index: Dict[str, Set[object]], key: str, connection):
+        members = index.get(key)
+        if members:
+            members.discard(connection)
+            if not members:
+                del index[key]
+    
+    def subscribe(self, connection, devices: Iterable[str] = (), groups: Iterable[str] = (),
+                  fields: Optional[frozenset] = None, everything: bool = False,
+                  projection: bool = False) -> Subscription:
+        """
+        Add devices/groups (leaving "everything" mode), or go back to
+        everything. With projection=True the field projection is replaced.
+        """
+        subscription = self.subscriptions[connection]
+        devices = set(devices or ())
+        groups = set(groups or ())
+        
+        if everything:
+            self.unsubscribe(connection, subscription.devices, subscription.groups)
+            subscription.everything = True
+            self.everything.add(connection)
+        elif devices or groups:
+            subscription.everything = False
+            self.everything.discard(connection)
+        
+        for device_id in devices - subscription.devices:
+            self.by_device.setdefault(device_id, set()).add(connection)
+        for group in groups - subscription.groups:
+            self.by_group.setdefault(group, set()).add(connection)
+        subscription.devices |= devices
+        subscription.groups |= groups
+        
+        if projection:
+            subscription.fields = fields
+        return subscription
+    
+    def unsubscribe(self, connection, devices: Iterable[str] = (), groups: Iterable[str] = (),
+                    fields: Iterable[str] = (), everything: bool = False) -> Subscription:
+        """Remove devices/groups/fields; everything=True unsubscribes from all readings"""
+        subscription = self.subscriptions[connection]
+        if everything:
+            devices, groups = set(subscription.devices), set(subscription.groups)
+            subscription.everything = False
+            self.everything.discard(connection)
+        
+        for device_id in set(devices or ()) & subscription.devices:
+            self._unindex(self.by_device, device_id, connection)
+            subscription.devices.discard(device_id)
+        for group in set(groups or ()) & subscription.groups:
+            self._unindex(self.by_group, group, connection)
+            subscription.groups.discard(group)
+        
+        fields = set(fields or ())
+        if fields:
+            current = subscription.fields if subscription.fields is not None else frozenset(SENSOR_FIELDS)
+            subscription.fields = frozenset(current - fields)
+        return subscription
+    
+    # ------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------
+    
+    def route(self, device_id: str) -> Dict[Optional[frozenset], List[object]]:
+        """Connections interested in a device, grouped by field projection"""
+        targets = set(self.everything)
+        targets.update(self.by_device.get(device_id, ()))
+        for group in self.device_groups.get(device_id, ()):
+            targets.update(self.by_group.get(group, ()))
+        
+        routes: Dict[Optional[frozenset], List[object]] = {}
+        for connection in targets:
+            routes.setdefault(self.subscriptions[connection].fields, []).append(connection)
+        return routes
+    
+    def describe(self) -> dict:
+        return {
+            "everything": len(self.everything),
+            "devices_indexed": len(self.by_device),
+            "groups_indexed": len(self.by_group),
+            "groups_defined": len(self.group_devices)
+        }
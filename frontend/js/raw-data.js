@@ -32,6 +32,7 @@ function initializeWebSocket() {
     state. ws.onSensorData = handleNewSensorData;
     state. ws.onDeviceConnected = handleDeviceConnected;
     state.ws. onDeviceDisconnected = handleDeviceDisconnected;
+    state.ws.onDeviceStatus = handleDeviceStatus;
     state.ws.onStatistics = handleStatistics;
     state. ws.onConnectionChange = handleConnectionChange;
     
@@ -256,6 +257,23 @@ function handleDeviceDisconnected(deviceId) {
     updateQuickStats();
 }
 
+/**
+ * Handle device status event (server-side liveness)
+ */
+function handleDeviceStatus(message) {
+    const device = state.devices.find(d => d.id === message.device_id);
+    if (!device) {
+        if (message.status !== 'offline') handleDeviceConnected(message.device_id);
+        return;
+    }
+    
+    device.status = message.status;
+    if (message.last_seen) device.lastData = new Date(message.last_seen);
+    
+    renderDeviceStatus();
+    updateQuickStats();
+}
+
 /**
  * Handle statistics update
  */
@@ -272,6 +290,7 @@ function handleConnectionChange(connected) {
 
 /**
  * Determine device status based on last seen time
+ * (initial guess only: the server pushes device_status events afterwards)
  */
 function determineDeviceStatus(lastSeen) {
     if (!lastSeen) return 'offline';
@@ -3,119 +3,124 @@
 // Konfigurasi sensor berdasarkan spesifikasi payload
 // ============================================================
 
+// Strict JSON literal: backend/sensor_schema.py reads this array to build the
+// binary frame layout, so keep keys quoted and field order == "no".
 const SENSOR_CONFIG = [
   {
-    no: 1,
-    field: "imu_x",
-    type: "int16",
-    scale: "value/100",
-    unit: "m/s²",
-    displayName: "IMU X",
-    category: "imu",
-    thresholds: { low: -20, high: 20 }
+    "no": 1,
+    "field": "imu_x",
+    "type": "int16",
+    "scale": "value/100",
+    "unit": "m/s²",
+    "displayName": "IMU X",
+    "category": "imu",
+    "thresholds": { "low": -20, "high": 20 }
   },
   {
-    no: 2,
-    field:  "imu_y",
-    type: "int16",
-    scale: "value/100",
-    unit: "m/s²",
-    displayName: "IMU Y",
-    category: "imu",
-    thresholds: { low: -20, high: 20 }
+    "no": 2,
+    "field": "imu_y",
+    "type": "int16",
+    "scale": "value/100",
+    "unit": "m/s²",
+    "displayName": "IMU Y",
+    "category": "imu",
+    "thresholds": { "low": -20, "high": 20 }
   },
   {
-    no: 3,
-    field: "imu_z",
-    type:  "int16",
-    scale:  "value/100",
-    unit: "m/s²",
-    displayName: "IMU Z",
-    category: "imu",
-    thresholds: { low: -20, high: 20 }
+    "no": 3,
+    "field": "imu_z",
+    "type": "int16",
+    "scale": "value/100",
+    "unit": "m/s²",
+    "displayName": "IMU Z",
+    "category": "imu",
+    "thresholds": { "low": -20, "high": 20 }
   },
   {
-    no: 4,
-    field: "suhu_kaki",
-    type: "int16",
-    scale: "value/100",
-    unit: "°C",
-    displayName:  "Suhu Kaki",
-    category: "temperature",
-    thresholds: { low:  15, high: 40 }
+    "no": 4,
+    "field": "suhu_kaki",
+    "type": "int16",
+    "scale": "value/100",
+    "unit": "°C",
+    "displayName": "Suhu Kaki",
+    "category": "temperature",
+    "thresholds": { "low": 15, "high": 40 }
   },
   {
-    no: 5,
-    field: "vbatt_kaki",
-    type: "uint16",
-    scale: "value",
-    unit: "mV",
-    displayName: "Baterai Kaki",
-    category: "power",
-    thresholds: { low: 3000, high: 4200 }
+    "no": 5,
+    "field": "vbatt_kaki",
+    "type": "uint16",
+    "scale": "value",
+    "unit": "mV",
+    "displayName": "Baterai Kaki",
+    "category": "power",
+    "thresholds": { "low": 3000, "high": 4200 }
   },
   {
-    no: 6,
-    field: "suhu_leher",
-    type: "int16",
-    scale: "value/100",
-    unit: "°C",
-    displayName: "Suhu Leher",
-    category: "temperature",
-    thresholds:  { low: 15, high:  40 }
+    "no": 6,
+    "field": "suhu_leher",
+    "type": "int16",
+    "scale": "value/100",
+    "unit": "°C",
+    "displayName": "Suhu Leher",
+    "category": "temperature",
+    "thresholds": { "low": 15, "high": 40 }
   },
   {
-    no: 7,
-    field: "vbatt_leher",
-    type: "uint16",
-    scale: "value",
-    unit:  "mV",
-    displayName: "Baterai Leher",
-    category: "power",
-    thresholds: { low: 3000, high:  4200 }
+    "no": 7,
+    "field": "vbatt_leher",
+    "type": "uint16",
+    "scale": "value",
+    "unit": "mV",
+    "displayName": "Baterai Leher",
+    "category": "power",
+    "thresholds": { "low": 3000, "high": 4200 }
   },
   {
-    no: 8,
-    field: "latitude",
-    type: "int32",
-    scale: "value/1e7",
-    unit: "deg",
-    displayName: "Latitude",
-    category: "gps",
-    thresholds:  null
+    "no": 8,
+    "field": "latitude",
+    "type": "int32",
+    "scale": "value/1e7",
+    "unit": "deg",
+    "displayName": "Latitude",
+    "category": "gps",
+    "thresholds": null
   },
   {
-    no: 9,
-    field: "longitude",
-    type:  "int32",
-    scale:  "value/1e7",
-    unit: "deg",
-    displayName: "Longitude",
-    category: "gps",
-    thresholds: null
+    "no": 9,
+    "field": "longitude",
+    "type": "int32",
+    "scale": "value/1e7",
+    "unit": "deg",
+    "displayName": "Longitude",
+    "category": "gps",
+    "thresholds": null
   },
   {
-    no:  10,
-    field: "spo2",
-    type: "uint8",
-    scale: "value",
-    unit: "%",
-    displayName: "SpO2",
-    category: "health",
-    thresholds: { low: 90, high: 100 }
+    "no": 10,
+    "field": "spo2",
+    "type": "uint8",
+    "scale": "value",
+    "unit": "%",
+    "displayName": "SpO2",
+    "category": "health",
+    "thresholds": { "low": 90, "high": 100 }
   },
   {
-    no: 11,
-    field:  "heart_rate",
-    type: "uint8",
-    scale: "value",
-    unit: "bpm",
-    displayName: "Heart Rate",
-    category: "health",
-    thresholds: { low: 60, high: 100 }
+    "no": 11,
+    "field": "heart_rate",
+    "type": "uint8",
+    "scale": "value",
+    "unit": "bpm",
+    "displayName": "Heart Rate",
+    "category": "health",
+    "thresholds": { "low": 60, "high": 100 }
   }
 ];
 
+// Versi layout frame biner ESP32 (naikkan jika urutan/tipe field berubah)
+const SENSOR_FRAME_VERSION = 1;
+
 // Category definitions untuk filtering
 const SENSOR_CATEGORIES = {
   all: { name: "Semua Sensor", icon: "fa-list" },
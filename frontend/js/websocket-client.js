@@ -16,8 +16,16 @@ class FarmTechWebSocket {
         this.onSensorData = null;
         this.onDeviceConnected = null;
         this. onDeviceDisconnected = null;
+        this.onDeviceStatus = null;
         this.onInitialData = null;
         this.onStatistics = null;
+        this.onSubscriptions = null;
+        this.onSensorFrame = null;
+        this.onAlert = null;
+        this.onGeofence = null;
+        
+        // Stream mode: latest values per device, rebuilt from delta frames
+        this.frameState = {};
         this. onConnectionChange = null;
         
         this.wsUrl = this.getWebSocketURL();
@@ -188,12 +196,42 @@ class FarmTechWebSocket {
                 }
                 break;
             
+            case 'device_status':
+                // Server-side liveness: online / warning / offline
+                if (this.onDeviceStatus) {
+                    this.onDeviceStatus(message);
+                }
+                break;
+            
             case 'statistics':
                 if (this.onStatistics) {
                     this.onStatistics(data);
                 }
                 break;
             
+            case 'sensor_frame':
+                this.applyFrame(message);
+                break;
+            
+            case 'alert':
+                if (this.onAlert) {
+                    this.onAlert(data);
+                }
+                break;
+            
+            case 'geofence':
+                // { device_id, geofence, event: 'enter'|'exit', latitude, longitude, timestamp }
+                if (this.onGeofence) {
+                    this.onGeofence(data);
+                }
+                break;
+            
+            case 'subscriptions':
+                if (this.onSubscriptions) {
+                    this.onSubscriptions(data);
+                }
+                break;
+            
             case 'pong':
                 // Heartbeat response
                 break;
@@ -203,6 +241,30 @@ class FarmTechWebSocket {
         }
     }
     
+    // Merge a delta frame into frameState; a keyframe replaces the state.
+    // Without onSensorFrame, each device's merged reading goes to onSensorData
+    applyFrame(frame) {
+        if (frame.keyframe) {
+            this.frameState = {};
+        }
+        
+        const updated = {};
+        for (const [deviceId, entries] of Object.entries(frame.devices)) {
+            const state = this.frameState[deviceId] || { device_id: deviceId };
+            for (const entry of entries) {
+                Object.assign(state, entry);
+            }
+            this.frameState[deviceId] = state;
+            updated[deviceId] = { ...state };
+        }
+        
+        if (this.onSensorFrame) {
+            this.onSensorFrame(updated, frame);
+        } else if (this.onSensorData) {
+            Object.values(updated).forEach(reading => this.onSensorData(reading));
+        }
+    }
+    
     updateConnectionStatus(connected) {
         if (this.onConnectionChange) {
             this.onConnectionChange(connected);
@@ -220,11 +282,39 @@ class FarmTechWebSocket {
         }
     }
     
-    requestDeviceData(deviceId, limit = 100) {
+    // options: { from, to, fields: ['spo2', ...], cursor } - pass the reply's
+    // next_cursor back as cursor to fetch the next (older) page
+    requestDeviceData(deviceId, limit = 100, options = {}) {
         return this.send({
             type: 'get_device_data',
             device_id: deviceId,
-            limit: limit
+            limit: limit,
+            ...options
+        });
+    }
+    
+    // Narrow sensor_data to devices/groups and/or categories, e.g.
+    // subscribe({ devices: ['ESP32_001'], categories: ['health'] }); subscribe({ all: true }) resets
+    subscribe(options = {}) {
+        return this.send({
+            type: 'subscribe',
+            ...options
+        });
+    }
+    
+    unsubscribe(options = {}) {
+        return this.send({
+            type: 'unsubscribe',
+            ...options
+        });
+    }
+    
+    // Throttled delta frames, e.g. setStreamMode({ interval_ms: 500, keep: 'latest' });
+    // setStreamMode({ enabled: false }) goes back to one sensor_data per reading
+    setStreamMode(options = {}) {
+        return this.send({
+            type: 'stream_mode',
+            ...options
         });
     }
     
@@ -27,6 +27,12 @@ const char* device_id = "DEV002";       // Device ID unik
 
 // Sampling rate
 const unsigned long SAMPLING_INTERVAL = 1000;  // Kirim data setiap 1 detik (1000ms)
+const unsigned long MAX_SAMPLING_INTERVAL = 8000;  // Batas atas saat server minta slow_down
+
+// Format payload: true = frame biner ringkas (28 byte/reading), false = JSON
+// Layout frame: lihat backend/sensor_schema.py dan SENSOR_CONFIG di sensor-config.js
+const bool USE_BINARY_FRAMES = true;
+const uint8_t SENSOR_FRAME_VERSION = 1;
 
 // ============================================================
 // OBJECTS
@@ -35,6 +41,30 @@ const unsigned long SAMPLING_INTERVAL = 1000;  // Kirim data setiap 1 detik (100
 WebSocketsClient webSocket;
 unsigned long lastSampleTime = 0;
 bool isConnected = false;
+unsigned long samplingInterval = SAMPLING_INTERVAL;  // Diubah oleh pesan slow_down/resume dari server
+long lastDurableSeq = 0;  // seq terakhir yang dikonfirmasi tersimpan (reset tiap koneksi)
+
+// Satu reading dalam frame biner (little-endian, urutan = SENSOR_CONFIG)
+struct __attribute__((packed)) SensorReading {
+  uint32_t age_ms;      // umur reading saat frame dikirim
+  int16_t imu_x;
+  int16_t imu_y;
+  int16_t imu_z;
+  int16_t suhu_kaki;
+  uint16_t vbatt_kaki;
+  int16_t suhu_leher;
+  uint16_t vbatt_leher;
+  int32_t latitude;
+  int32_t longitude;
+  uint8_t spo2;
+  uint8_t heart_rate;
+};
+
+struct __attribute__((packed)) SensorFrameHeader {
+  uint8_t version;
+  uint8_t flags;     // 0: every field present (bit 0: per-reading presence mask follows age_ms)
+  uint16_t count;
+};
 
 // ============================================================
 // FUNGSI SENSOR (DUMMY - Ganti dengan sensor asli!)
@@ -107,6 +137,8 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
     case WStype_CONNECTED:
       Serial. printf("[WS] Connected to: %s\n", payload);
       isConnected = true;
+      samplingInterval = SAMPLING_INTERVAL;
+      lastDurableSeq = 0;
       break;
       
     case WStype_TEXT:
@@ -117,9 +149,23 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
         DynamicJsonDocument doc(256);
         deserializeJson(doc, payload);
         
-        const char* status = doc["status"];
+        const char* status = doc["status"] | "";
         if (strcmp(status, "ok") == 0) {
           Serial.println("[WS] Data received by server ✓");
+        } else if (strcmp(status, "durable") == 0) {
+          // Semua data sampai seq ini sudah tersimpan di database
+          lastDurableSeq = doc["seq"] | lastDurableSeq;
+        } else if (strcmp(status, "slow_down") == 0) {
+          // Server kewalahan: perlambat pengiriman
+          unsigned long factor = doc["interval_factor"] | 2;
+          samplingInterval = min(samplingInterval * factor, MAX_SAMPLING_INTERVAL);
+          Serial.printf("[WS] Server busy, interval %lu ms\n", samplingInterval);
+        } else if (strcmp(status, "resume") == 0) {
+          samplingInterval = SAMPLING_INTERVAL;
+          Serial.println("[WS] Server caught up, normal interval");
+        } else if (strcmp(status, "ping") == 0) {
+          // Server belum menerima data: jawab agar koneksi tidak ditutup
+          webSocket.sendTXT("{\"type\":\"pong\"}");
         }
       }
       break;
@@ -140,6 +186,11 @@ void sendSensorData() {
     return;
   }
   
+  if (USE_BINARY_FRAMES) {
+    sendSensorFrame();
+    return;
+  }
+  
   // Buat JSON document
   DynamicJsonDocument doc(512);
   
@@ -166,6 +217,34 @@ void sendSensorData() {
   Serial.println("[DATA] Sent: " + jsonString);
 }
 
+void sendSensorFrame() {
+  uint8_t buffer[sizeof(SensorFrameHeader) + sizeof(SensorReading)];
+  
+  SensorFrameHeader header = { SENSOR_FRAME_VERSION, 0, 1 };
+  
+  SensorReading reading;
+  reading.age_ms = 0;
+  reading.imu_x = readIMU_X();
+  reading.imu_y = readIMU_Y();
+  reading.imu_z = readIMU_Z();
+  reading.suhu_kaki = readSuhuKaki();
+  reading.vbatt_kaki = readBattKaki();
+  reading.suhu_leher = readSuhuLeher();
+  reading.vbatt_leher = readBattLeher();
+  reading.latitude = readLatitude();
+  reading.longitude = readLongitude();
+  reading.spo2 = readSpO2();
+  reading.heart_rate = readHeartRate();
+  
+  memcpy(buffer, &header, sizeof(header));
+  memcpy(buffer + sizeof(header), &reading, sizeof(reading));
+  
+  // Kirim via WebSocket (binary)
+  webSocket.sendBIN(buffer, sizeof(buffer));
+  
+  Serial.printf("[DATA] Sent binary frame: %u bytes\n", (unsigned) sizeof(buffer));
+}
+
 // ============================================================
 // SETUP
 // ============================================================
@@ -211,10 +290,10 @@ void loop() {
   // Handle WebSocket
   webSocket.loop();
   
-  // Kirim data setiap SAMPLING_INTERVAL
+  // Kirim data setiap samplingInterval (SAMPLING_INTERVAL, lebih lama saat slow_down)
   unsigned long currentTime = millis();
   
-  if (currentTime - lastSampleTime >= SAMPLING_INTERVAL) {
+  if (currentTime - lastSampleTime >= samplingInterval) {
     lastSampleTime = currentTime;
     sendSensorData();
   }